@@ -0,0 +1,168 @@
+"""
+Measures time to first token with COMMIT_TO_GIT on, before and after edit intent was
+classified with embeddings instead of an LLM round trip.
+
+- before: every prompt first waits for a YES/NO completion, as it did before the
+  IntentClassifier.
+- after: the IntentClassifier decides, and the LLM is only asked when it is not
+  confident.
+
+The fake LLM waits --first-token-delay before its first token, like an API model, and the
+fake embedder hashes words into a vector, so prompts that share words with the labelled
+examples are classified. Time to first token is measured from the start of the turn.
+
+Usage:
+    python benchmarks/bench_intent.py --prompts 40 --first-token-delay 0.3
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dir_assistant.assistant.base_assistant as base_assistant
+import dir_assistant.assistant.git_assistant as git_assistant
+from dir_assistant.assistant.git_assistant import GitAssistant
+
+PROMPTS = [
+    "Add a docstring to the parse function",
+    "Fix the bug in the config loader",
+    "Rename the variable n to total in index.py",
+    "Remove the unused imports in main.py",
+    "Write unit tests for the storage layer",
+    "Make the timeout configurable",
+    "How does the file watcher work?",
+    "What does the cache manager return?",
+    "Explain how the context is packed",
+    "Where is the embedding model configured?",
+    "Why is the index rebuilt on every start?",
+    "Which files handle the HTTP server?",
+]
+
+
+class HashingEmbed:
+    def __init__(self, dim):
+        self.dim = dim
+
+    def get_config(self):
+        return {"model": "hashing", "dim": self.dim}
+
+    def create_embedding(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().replace("?", " ").split():
+            digest = hashlib.sha256(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        return vector
+
+
+class FakeLLMAssistant(GitAssistant):
+    first_token_delay = 0.3
+    token_delay = 0.005
+    tokens = 16
+    intent_checks = 0
+
+    def count_tokens(self, text, role="user"):
+        return len(text) // 4
+
+    def ask_edit_intent(self, user_input):
+        self.intent_checks += 1
+        return super().ask_edit_intent(user_input)
+
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        time.sleep(self.first_token_delay)
+        if "Respond only with one word" in chat_history[-1]["content"]:
+            yield {"choices": [{"delta": {"content": "NO"}}]}
+            return
+        for i in range(self.tokens):
+            if i:
+                time.sleep(self.token_delay)
+            yield {"choices": [{"delta": {"content": f"token{i} "}}]}
+
+
+class AlwaysAskAssistant(FakeLLMAssistant):
+    def classify_edit_intent(self, user_input):
+        return self.ask_edit_intent(user_input)
+
+
+def make_assistant(assistant_class, dim):
+    rng = np.random.default_rng(0)
+    chunks = [
+        {"text": f"File chunk {i}\n", "filepath": f"/project/f{i}.py", "chunk_index": 0}
+        for i in range(64)
+    ]
+    embeddings = rng.random((len(chunks), dim), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    index = faiss.IndexFlatIP(dim)
+    index.add(embeddings)
+    llm = assistant_class(
+        "You are a helpful assistant.", HashingEmbed(dim), index, chunks, 0.5, 0.1,
+        0.7, 0.7, 3600, {}, 1, False, False, True, False, True, False, False,
+        "<think>", "</think>", use_retrieval_cache=False,
+    )  # fmt: skip
+    llm.initialize_history()
+    return llm
+
+
+def measure(assistant_class, prompts, dim):
+    llm = make_assistant(assistant_class, dim)
+    times = []
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for prompt in prompts:
+                llm.turn_start_time = time.perf_counter()
+                llm.run_stream_processes(prompt, one_off=True)
+                times.append(llm.last_time_to_first_token)
+    finally:
+        llm.close()
+    return times, llm.intent_checks
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--prompts", type=int, default=36)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument(
+        "--first-token-delay",
+        type=float,
+        default=0.3,
+        help="Seconds before the fake LLM's first token",
+    )
+    args = parser.parse_args()
+
+    FakeLLMAssistant.first_token_delay = args.first_token_delay
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(args.prompts)]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Prompt histories and intent examples go to a throwaway cache
+        base_assistant.CACHE_PATH = temp_dir
+        git_assistant.CACHE_PATH = temp_dir
+        print(
+            f"{args.prompts} prompts, fake LLM first token after "
+            f"{args.first_token_delay:.3f}s"
+        )
+        print(f"{'mode':<8} {'p50 TTFT':>9} {'p95 TTFT':>9} {'LLM intent checks':>18}")
+        for mode, assistant_class in (
+            ("before", AlwaysAskAssistant),
+            ("after", FakeLLMAssistant),
+        ):
+            times, llm_asked = measure(assistant_class, prompts, args.dim)
+            print(
+                f"{mode:<8} {percentile(times, 0.5):>8.3f}s "
+                f"{percentile(times, 0.95):>8.3f}s {llm_asked:>18}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Load tests `dir-assistant serve` with a fake LLM backend, so the numbers show the
+server's own overhead and concurrency rather than a provider's.
+
+The fake LLM streams a fixed number of tokens with a delay between them, like an API
+model would, and the fake embedder returns random vectors. Each client sends its
+requests one after another in its own session, alternating streamed chat completions,
+plain chat completions and retrievals.
+
+Usage:
+    python benchmarks/bench_serve.py --clients 16 --requests 20 --chunks 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dir_assistant.assistant.base_assistant as base_assistant
+from dir_assistant.assistant.base_assistant import BaseAssistant
+from dir_assistant.cli.serve import AssistantServer
+
+
+class FakeEmbed:
+    def __init__(self, dim):
+        self.dim = dim
+        self.rng = np.random.default_rng(1)
+
+    def create_embedding(self, text):
+        return self.rng.random(self.dim, dtype=np.float32)
+
+
+class FakeLLMAssistant(BaseAssistant):
+    tokens = 64
+    token_delay = 0.005
+
+    def count_tokens(self, text, role="user"):
+        return len(text) // 4
+
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        for i in range(self.tokens):
+            time.sleep(self.token_delay)
+            yield {"choices": [{"delta": {"content": f"token{i} "}}]}
+        yield {
+            "choices": [],
+            "usage": {
+                "prompt_tokens": sum(h["tokens"] for h in chat_history),
+                "completion_tokens": self.tokens,
+                "total_tokens": sum(h["tokens"] for h in chat_history) + self.tokens,
+            },
+        }
+
+
+def make_assistant(num_chunks, dim):
+    rng = np.random.default_rng(0)
+    chunks = [
+        {
+            "text": f"User file '/project/module_{i // 4}.py' lines {i % 4 * 50 + 1}-"
+            f"{i % 4 * 50 + 50}:\n\n" + "x = 1\n" * 50,
+            "filepath": f"/project/module_{i // 4}.py",
+            "chunk_index": i % 4,
+        }
+        for i in range(num_chunks)
+    ]
+    embeddings = rng.random((num_chunks, dim), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    index = faiss.IndexFlatIP(dim)
+    index.add(embeddings)
+    return FakeLLMAssistant(
+        "You are a helpful assistant.", FakeEmbed(dim), index, chunks, 0.5, 0.1,
+        0.7, 0.7, 3600, {}, 1, False, True, False, False, "<think>", "</think>",
+    )  # fmt: skip
+
+
+def post(url, body, session_id):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-Session-ID": session_id},
+    )
+    start = time.perf_counter()
+    first_byte = None
+    with urllib.request.urlopen(request, timeout=120) as response:
+        while True:
+            data = response.read1(65536)
+            if not data:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+
+def run_client(base_url, client, num_requests):
+    results = []
+    for i in range(num_requests):
+        kind = ("stream", "chat", "retrieve")[i % 3]
+        message = {"role": "user", "content": f"Question {i} from client {client}"}
+        if kind == "retrieve":
+            url, body = f"{base_url}/retrieve", {"query": message["content"]}
+        else:
+            url = f"{base_url}/chat/completions"
+            body = {"messages": [message], "stream": kind == "stream"}
+        first_byte, total = post(url, body, f"client-{client}")
+        results.append((kind, first_byte, total))
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=12, help="Per client")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--tokens", type=int, default=64, help="Per answer")
+    parser.add_argument(
+        "--token-delay", type=float, default=0.005, help="Seconds between tokens"
+    )
+    args = parser.parse_args()
+
+    FakeLLMAssistant.tokens = args.tokens
+    FakeLLMAssistant.token_delay = args.token_delay
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Prompt histories go to a throwaway cache
+        base_assistant.CACHE_PATH = temp_dir
+        llm = make_assistant(args.chunks, args.dim)
+        server = AssistantServer(("127.0.0.1", 0), llm)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            results = [
+                result
+                for client_results in executor.map(
+                    lambda client: run_client(base_url, client, args.requests),
+                    range(args.clients),
+                )
+                for result in client_results
+            ]
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        llm.close()
+
+    answer_seconds = args.tokens * args.token_delay
+    print(
+        f"{len(results)} requests from {args.clients} clients in {elapsed:.2f}s "
+        f"({len(results) / elapsed:.1f} requests/s), {args.chunks} chunks, "
+        f"fake answers take {answer_seconds:.2f}s"
+    )
+    print(f"{'request':<10} {'count':>6} {'p50 first byte':>15} {'p50':>8} {'p95':>8}")
+    for kind in ("stream", "chat", "retrieve"):
+        first_bytes = [r[1] for r in results if r[0] == kind]
+        totals = [r[2] for r in results if r[0] == kind]
+        if totals:
+            print(
+                f"{kind:<10} {len(totals):>6} {percentile(first_bytes, 0.5):>14.3f}s "
+                f"{percentile(totals, 0.5):>7.3f}s {percentile(totals, 0.95):>7.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compares the legacy SqliteDict index cache with the SQLite storage layer.
+
+Workloads:
+- cold index: every file's chunks and embeddings are written from concurrent workers,
+  the way create_file_index does on a fresh cache.
+- warm start: every file's cached chunks and embeddings are read back for a new session.
+
+Usage:
+    pip install sqlitedict  # only needed for the legacy numbers
+    python benchmarks/bench_storage.py --files 2000 --chunks 4 --dim 768
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dir_assistant.assistant.storage import IndexStore
+
+EMBED_CONFIG = "0" * 64
+
+
+def make_files(num_files, chunks_per_file, dim):
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(num_files):
+        filepath = f"/project/src/module_{i}.py"
+        chunks = [
+            {
+                "text": f"---------------\n\nUser file '{filepath}' lines {j * 50 + 1}-{j * 50 + 50}:\n\n"
+                + "x = 1\n" * 50,
+                "filepath": filepath,
+                "tokens": 400,
+            }
+            for j in range(chunks_per_file)
+        ]
+        embeddings = [rng.random(dim).tolist() for _ in range(chunks_per_file)]
+        files.append((filepath, 1700000000.0 + i, chunks, embeddings))
+    return files
+
+
+def bench_legacy(path, files, workers):
+    from sqlitedict import SqliteDict
+
+    def write(entry):
+        filepath, mtime, chunks, embeddings = entry
+        # The legacy indexer opened a connection per processed file
+        with SqliteDict(path, autocommit=True, timeout=10, journal_mode="WAL") as cache:
+            cache[f"{EMBED_CONFIG}-{filepath}_chunks"] = {
+                "chunks": chunks,
+                "embeddings": embeddings,
+                "mtime": mtime,
+            }
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write, files))
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with SqliteDict(path, autocommit=True, timeout=10, journal_mode="WAL") as cache:
+        loaded = [cache.get(f"{EMBED_CONFIG}-{entry[0]}_chunks") for entry in files]
+    warm = time.perf_counter() - start
+    assert all(loaded)
+    return cold, warm
+
+
+def bench_store(path, files, workers):
+    store = IndexStore(path)
+
+    def write(entry):
+        filepath, mtime, chunks, embeddings = entry
+        store.save_file_chunks(EMBED_CONFIG, filepath, mtime, chunks, embeddings)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write, files))
+    store.flush()
+    cold = time.perf_counter() - start
+    store.close()
+
+    start = time.perf_counter()
+    store = IndexStore(path)
+    loaded = store.load_chunks(EMBED_CONFIG)
+    warm = time.perf_counter() - start
+    store.close()
+    assert len(loaded) == len(files)
+    return cold, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--workers", type=int, default=20)
+    args = parser.parse_args()
+
+    files = make_files(args.files, args.chunks, args.dim)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            results["SqliteDict (before)"] = bench_legacy(
+                os.path.join(directory, "legacy.sqlite"), files, args.workers
+            )
+        except ImportError:
+            sys.stdout.write("sqlitedict is not installed, skipping legacy numbers.\n")
+        results["IndexStore (after)"] = bench_store(
+            os.path.join(directory, "index_cache.db"), files, args.workers
+        )
+
+    sys.stdout.write(
+        f"{args.files} files x {args.chunks} chunks, {args.dim}-d embeddings, {args.workers} workers\n"
+    )
+    sys.stdout.write(f"{'backend':<22}{'cold index (s)':>16}{'warm start (s)':>16}\n")
+    for name, (cold, warm) in results.items():
+        sys.stdout.write(f"{name:<22}{cold:>16.3f}{warm:>16.3f}\n")
+
+
+if __name__ == "__main__":
+    main()
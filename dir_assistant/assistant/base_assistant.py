@@ -1,18 +1,49 @@
+import copy
 import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import nullcontext
 
 import numpy as np
 from colorama import Fore, Style
+from faiss import IndexFlatIP, normalize_L2
+from wove import weave
 
 from dir_assistant.assistant.cache_manager import CacheManager
-from dir_assistant.assistant.index import search_index
+from dir_assistant.assistant.context_assembler import (
+    assemble_context,
+    get_prefix_text_length,
+    group_chunks_by_file,
+)
+from dir_assistant.assistant.context_packer import pack_context
+from dir_assistant.assistant.events import TokenEventStream, get_usage_counts
+from dir_assistant.assistant.index import search_index, search_index_batch
+from dir_assistant.assistant.index_ledger import format_duration
+from dir_assistant.assistant.profiler import get_profiler, record_span, span
 from dir_assistant.assistant.rag_optimizer import RagOptimizer
+from dir_assistant.assistant.stage_timeline import StageTimeline
+from dir_assistant.assistant.storage import IndexStore
+from dir_assistant.assistant.stream_renderer import (
+    TerminalWriter,
+    ThinkingFilter,
+    remove_thinking,
+)
+from dir_assistant.assistant.token_cache import TokenCountCache
 from dir_assistant.cli.config import (
     CACHE_PATH,
+    INDEX_CACHE_FILENAME,
     PREFIX_CACHE_FILENAME,
     PROMPT_HISTORY_FILENAME,
     get_file_path,
 )
 
+QUERY_EMBEDDING_MEMO_SIZE = 16
+CONTEXT_BLOCK_ACKNOWLEDGEMENT = (
+    "I have read the files above and will use them to answer the following requests."
+)
+
 
 class BaseAssistant:
     """
@@ -20,6 +51,9 @@ class BaseAssistant:
     are collected recursively from the current directory.
     """
 
+    # Whether the LLM can run several completions at the same time
+    concurrent_completions = True
+
     def __init__(
         self,
         system_instructions,
@@ -39,6 +73,7 @@ class BaseAssistant:
         hide_thinking,
         thinking_start_pattern,
         thinking_end_pattern,
+        context_layout="per_turn",
     ):
         self.system_instructions = system_instructions
         self.embed = embed
@@ -58,8 +93,42 @@ class BaseAssistant:
         self.hide_thinking = hide_thinking
         self.thinking_start_pattern = thinking_start_pattern
         self.thinking_end_pattern = thinking_end_pattern
+        self.context_layout = context_layout
+        self.context_block_artifacts = []
+        self.context_block_stale = False
         self.last_optimized_artifacts = []
         self.last_matched_prefix = ""
+        self.last_candidate_pool = []
+        self.last_relevant_full_text = ""
+        self.last_relevant_full_text_tokens = 0
+        self.last_context_utilization = 0.0
+        self.last_prefix_text_length = 0
+        self.last_completion_usage = None
+        self.token_count_cache = None
+        self.query_embeddings = OrderedDict()
+        # Embeddings and search results of the prompts of a batch, found before the
+        # prompts are answered. Keyed by query, and by query, cutoff and max_k.
+        self.prefetched_query_embeddings = {}
+        self.prefetched_neighbors = {}
+        self.turn_start_time = None
+        self.last_first_token_time = None
+        self.last_time_to_first_token = None
+        self.last_timeline = None
+        self.last_context_scores = {}
+        self.last_retrieval_cache_match = None
+        # Single prompt mode can stream the answer, optionally as JSON-lines events
+        self.stream_output = False
+        self.event_writer = None
+        self.embed_lock = threading.Lock()
+        # Guards the index and chunks, which background indexing and the file watcher
+        # change while prompts are answered
+        self.index_lock = threading.Lock()
+        self.indexer = None
+        # Sessions created for the HTTP server, which share this assistant's index
+        self.sessions = weakref.WeakSet()
+        self.completion_lock = (
+            nullcontext() if self.concurrent_completions else threading.Lock()
+        )
         prefix_cache_path = get_file_path(CACHE_PATH, PREFIX_CACHE_FILENAME)
         prompt_history_path = get_file_path(CACHE_PATH, PROMPT_HISTORY_FILENAME)
         self.cache_manager = CacheManager(
@@ -78,6 +147,15 @@ class BaseAssistant:
     def close(self):
         """Cleanly close any open resources."""
         self.cache_manager.close()
+        if self.token_count_cache:
+            self.token_count_cache.close()
+
+    def warm_up(self):
+        """
+        Prepares anything the first prompt would otherwise wait for. Runs at startup while
+        the index is built.
+        """
+        pass
 
     def initialize_history(self):
         system_instructions_tokens = self.count_tokens(
@@ -90,6 +168,8 @@ class BaseAssistant:
                 "tokens": system_instructions_tokens,
             }
         ]
+        self.context_block_artifacts = []
+        self.context_block_stale = False
 
     def call_completion(self, chat_history, is_cgrag_call=False):
         raise NotImplementedError
@@ -97,38 +177,223 @@ class BaseAssistant:
     def count_tokens(self, text, role="user"):
         raise NotImplementedError
 
-    def build_relevant_full_text(self, user_input, cutoff):
+    def get_cached_prompt_tokens(self):
         """
-        Identifies relevant text chunks, pre-culs a candidate pool based on token
-        limits, optimizes the pool for caching, and builds the final context string.
+        Returns the number of prompt tokens the provider served from its cache in the last
+        completion, or None if it did not report it.
         """
+        return None
+
+    def get_tokenizer_id(self):
+        """
+        Identifies the LLM tokenizer so chunk token counts can be cached persistently.
+        Returns None if the counts should only be cached in memory.
+        """
+        return None
+
+    def count_chunk_tokens(self, chunk_text):
+        """Counts a context chunk's tokens, tokenizing each chunk only once per tokenizer."""
+        return self.get_token_count_cache().count(chunk_text)
+
+    def get_token_count_cache(self):
+        if self.token_count_cache is None:
+            tokenizer_id = self.get_tokenizer_id()
+            self.token_count_cache = TokenCountCache(
+                lambda text: self.count_tokens(text, role="user"),
+                tokenizer_id,
+                (
+                    IndexStore(get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME))
+                    if tokenizer_id
+                    else None
+                ),
+            )
+        return self.token_count_cache
+
+    def create_session(self):
+        """
+        Creates an assistant with its own chat history that shares this assistant's
+        models, index and caches. Index updates made through this assistant reach the
+        session as well. Only this assistant should be closed.
+
+        Returns:
+            BaseAssistant: The session.
+        """
+        # Caches created lazily would otherwise be created once per session
+        self.get_token_count_cache()
+        session = copy.copy(self)
+        session.sessions = weakref.WeakSet()
+        session.last_optimized_artifacts = []
+        session.last_matched_prefix = ""
+        session.last_candidate_pool = []
+        session.last_relevant_full_text = ""
+        session.last_relevant_full_text_tokens = 0
+        session.last_context_scores = {}
+        session.event_writer = None
+        session.stream_output = False
+        session.turn_start_time = None
+        session.initialize_history()
+        with self.index_lock:
+            session.index = self.index
+            session.chunks = self.chunks
+            self.sessions.add(session)
+        return session
+
+    def get_query_embedding(self, text):
+        """
+        Embeds a query, reusing recent embeddings so the intent check and the retrieval of
+        a prompt only embed it once.
+        """
+        embedding = self.prefetched_query_embeddings.get(text)
+        if embedding is not None:
+            return embedding
+        # The pre-answer stages embed from several threads
+        with self.embed_lock:
+            embedding = self.query_embeddings.get(text)
+            if embedding is None:
+                with span("embed query"):
+                    embedding = self.embed.create_embedding(text)
+                self.query_embeddings[text] = embedding
+                while len(self.query_embeddings) > QUERY_EMBEDDING_MEMO_SIZE:
+                    self.query_embeddings.popitem(last=False)
+            else:
+                self.query_embeddings.move_to_end(text)
+            return embedding
+
+    def count_context_tokens(self, context):
+        """
+        Counts the tokens of an assembled context. A context built by build_relevant_full_text
+        is not re-tokenized; its total is the sum of its cached chunk counts.
+        """
+        if context == self.last_relevant_full_text:
+            return self.last_relevant_full_text_tokens
+        return self.count_tokens(context, role="user")
+
+    def get_max_k(self, context_size=None):
         # Compute dynamic max_k
         estimated_minimal_token_count = 100
-        max_k = int(
-            self.context_size * self.context_file_ratio // estimated_minimal_token_count
+        return int(
+            (context_size or self.context_size)
+            * self.context_file_ratio
+            // estimated_minimal_token_count
         )
-        # 1. Get an initial list of nearest neighbors from the search index.
-        k_nearest_neighbors = search_index(
-            self.embed,
-            self.index,
-            user_input,
-            self.chunks,
-            max_k=max_k,
-            max_distance=cutoff,
+
+    def search_neighbors(self, query, cutoff, context_size=None):
+        """Returns the (chunk, distance) nearest neighbors of a query in the search index"""
+        max_k = self.get_max_k(context_size)
+        neighbors = self.prefetched_neighbors.get((query, cutoff, max_k))
+        if neighbors is not None:
+            return neighbors
+        query_embedding = self.get_query_embedding(query)
+        with self.index_lock:
+            return search_index(
+                self.embed,
+                self.index,
+                query,
+                self.chunks,
+                max_k=max_k,
+                max_distance=cutoff,
+                query_embedding=query_embedding,
+            )
+
+    def get_prompt_searches(self):
+        """
+        Returns:
+            list: The (cutoff, context_size) of each index search of a turn whose query is
+                the prompt itself.
+        """
+        return [(self.artifact_cosine_cutoff, None)]
+
+    def prefetch_retrieval(self, prompts, batch_size=64):
+        """
+        Embeds prompts in batches and searches the index for all of them at once. Answering
+        one of the prompts afterwards, in this assistant or its sessions, reuses the
+        embedding and the search results of the prompt.
+        """
+        prompts = list(dict.fromkeys(prompts))
+        embeddings = []
+        for start in range(0, len(prompts), batch_size):
+            embeddings.extend(
+                self.embed.create_embeddings(prompts[start : start + batch_size])
+            )
+        if not embeddings:
+            return
+        with self.index_lock:
+            for cutoff, context_size in self.get_prompt_searches():
+                max_k = self.get_max_k(context_size)
+                results = search_index_batch(
+                    self.index, embeddings, self.chunks, max_k, cutoff
+                )
+                for prompt, neighbors in zip(prompts, results):
+                    self.prefetched_neighbors[(prompt, cutoff, max_k)] = neighbors
+        self.prefetched_query_embeddings.update(zip(prompts, embeddings))
+
+    def get_index_coverage(self):
+        """
+        Returns:
+            tuple: The number of files indexed so far and the number of files to index,
+                or None if the index was complete at startup.
+        """
+        return self.indexer.get_coverage() if self.indexer else None
+
+    def is_index_complete(self):
+        return self.indexer is None or self.indexer.is_complete()
+
+    def write_index_coverage_message(self):
+        if not self.chat_mode or self.is_index_complete():
+            return
+        indexed_files, total_files = self.get_index_coverage()
+        time_left = self.indexer.get_time_left()
+        time_left_text = (
+            f", about {format_duration(time_left)} left"
+            if time_left is not None
+            else ""
+        )
+        # Written over the thinking message, which is shown again below it
+        sys.stdout.write(
+            f"\r{' ' * 36}\r{self.get_color_prefix(Style.NORMAL, Fore.LIGHTBLACK_EX)}"
+            f"Searched {indexed_files} of {total_files} files "
+            f"({indexed_files / total_files:.0%}). Indexing continues in the background"
+            f"{time_left_text}."
+            f"{self.get_color_suffix()}\n\n"
+            f"{self.get_color_prefix(Style.BRIGHT, Fore.WHITE)}(thinking...)"
+            f"{self.get_color_suffix()}"
         )
+        sys.stdout.flush()
+
+    def build_relevant_full_text(
+        self, user_input, cutoff, context_size=None, k_nearest_neighbors=None
+    ):
+        """
+        Identifies relevant text chunks, pre-culs a candidate pool based on token
+        limits, optimizes the pool for caching, and builds the final context string.
+        The context is sized for context_size, or the LLM's context size if not set.
+        Neighbors that were already searched can be passed as k_nearest_neighbors.
+        """
+        context_size = context_size or self.context_size
+        max_k = self.get_max_k(context_size)
+        # 1. Get an initial list of nearest neighbors from the search index.
+        if k_nearest_neighbors is None:
+            k_nearest_neighbors = self.search_neighbors(
+                user_input, cutoff, context_size
+            )
+        self.last_context_scores = {
+            neighbor[0].get("text", ""): float(neighbor[1])
+            for neighbor in k_nearest_neighbors
+        }
         # 2. Pre-cull candidates to create a token-aware pool for the optimizer.
         # This is the primary change: culling before optimizing.
+        step_start = time.perf_counter()
         candidate_pool = []
         total_candidate_tokens = 0
         # Create a candidate pool larger than the final context to give the
         # optimizer room to swap artifacts. Increased ratio to 3.0 for fuller context.
         optimizer_candidate_pool_ratio = 3.0
         optimizer_pool_limit = (
-            self.context_size * self.context_file_ratio * optimizer_candidate_pool_ratio
+            context_size * self.context_file_ratio * optimizer_candidate_pool_ratio
         )
         for neighbor in k_nearest_neighbors:
             chunk_text = neighbor[0].get("text", "") + "\n\n"
-            chunk_tokens = self.count_tokens(chunk_text, role="user")
+            chunk_tokens = self.count_chunk_tokens(chunk_text)
             # Stop adding candidates when the pool reaches the desired token limit.
             if (
                 total_candidate_tokens + chunk_tokens > optimizer_pool_limit
@@ -138,26 +403,21 @@ class BaseAssistant:
             # The optimizer will need the distance, so we keep the full neighbor object.
             candidate_pool.append(neighbor)
             total_candidate_tokens += chunk_tokens
+        record_span("candidate pool", step_start, candidates=len(candidate_pool))
         # 3. Gather historical and cache metadata for the optimizer.
         # This logic is preserved from the original implementation.
+        step_start = time.perf_counter()
         prompt_history = self.cache_manager.get_prompt_history()
         prefix_cache_metadata = self.cache_manager.get_non_expired_prefixes()
         historical_artifact_metadata = (
             self.cache_manager.compute_artifact_metadata_from_history()
         )
+        # Only the candidate pool is scored, so only its metadata is gathered. The
+        # optimizer converts it to columnar arrays and scores it in one pass.
         combined_artifact_metadata = {}
-        all_artifacts = {chunk["text"] for chunk in self.chunks} | set(
-            historical_artifact_metadata.keys()
-        )
-        for artifact in all_artifacts:
-            filepath = next(
-                (
-                    chunk["filepath"]
-                    for chunk in self.chunks
-                    if chunk["text"] == artifact
-                ),
-                None,
-            )
+        for chunk, distance in candidate_pool:
+            artifact = chunk.get("text", "")
+            filepath = chunk.get("filepath")
             last_modified = (
                 self.artifact_metadata.get(filepath, {}).get("last_modified", 0)
                 if filepath
@@ -171,6 +431,7 @@ class BaseAssistant:
                 "positions": hist_meta["positions"],
                 "last_modified_timestamp": last_modified,
             }
+        record_span("artifact metadata", step_start)
         if self.verbose and self.chat_mode:
             print(f"Computed max_k: {max_k}")
             print(f"K nearest count: {len(k_nearest_neighbors)}")
@@ -180,62 +441,93 @@ class BaseAssistant:
         # 4. Run the optimizer on the pre-culled candidate pool.
         # The optimizer input is now the smaller, more relevant candidate list.
         optimizer_input = [
-            (chunk.get("text", ""), distance) for chunk, distance in candidate_pool
+            (chunk.get("text", ""), float(distance))
+            for chunk, distance in candidate_pool
         ]
-        optimized_artifacts, matched_prefix = (
-            self.rag_optimizer.optimize_rag_for_caching(
-                k_nearest_neighbors_with_distances=optimizer_input,
-                prompt_history=prompt_history,
-                artifact_metadata=combined_artifact_metadata,
-                prefix_cache_metadata=prefix_cache_metadata,
+        with span("optimize_rag_for_caching", candidates=len(optimizer_input)):
+            optimized_artifacts, matched_prefix = (
+                self.rag_optimizer.optimize_rag_for_caching(
+                    k_nearest_neighbors_with_distances=optimizer_input,
+                    prompt_history=prompt_history,
+                    artifact_metadata=combined_artifact_metadata,
+                    prefix_cache_metadata=prefix_cache_metadata,
+                )
             )
-        )
         if self.verbose and self.chat_mode:
             print(f"Optimized artifacts before final cull: {len(optimized_artifacts)}")
             print(f"Matched prefix size: {len(matched_prefix.split())}")
         self.last_matched_prefix = matched_prefix
         self.last_optimized_artifacts = optimized_artifacts
-        # 5. Build the final text, performing a strict culling on the *optimized* list.
-        # This final loop ensures the hard context limit is never exceeded.
-        relevant_full_text = ""
-        final_artifacts_in_context = []
-        chunk_total_tokens = 0
-        target_tokens = self.context_size * self.context_file_ratio
+        self.last_candidate_pool = optimizer_input
+        # 5. Pack the final context within the hard token limit. The optimized artifacts
+        # are preferred, followed by the remaining neighbors sorted by distance. Chunks are
+        # picked by relevance per token, so one large chunk can't leave the budget unused.
+        step_start = time.perf_counter()
+        target_tokens = context_size * self.context_file_ratio
         # An efficient lookup map is better than iterating with next() repeatedly.
         chunk_map = {c["text"]: c for c in self.chunks}
-        for artifact in optimized_artifacts:
-            chunk = chunk_map.get(artifact)
-            if not chunk:
-                continue
-            chunk_text = chunk["text"] + "\n\n"
-            chunk_tokens = self.count_tokens(chunk_text, role="user")
-            if chunk_total_tokens + chunk_tokens > target_tokens:
-                break  # The context is full.
-            relevant_full_text += chunk_text
-            chunk_total_tokens += chunk_tokens
-            final_artifacts_in_context.append(artifact)
-        # If still under target after optimization, add more from original candidates sorted by distance
-        if chunk_total_tokens < target_tokens:
-            remaining_candidates = []
-            for neighbor in k_nearest_neighbors:
-                art_id = neighbor[0].get("text", "")
-                if art_id not in final_artifacts_in_context:
-                    remaining_candidates.append(neighbor)
-            # Sort remaining by distance (assuming k_nearest_neighbors is sorted by relevance)
-            remaining_candidates.sort(key=lambda x: x[1])  # Sort by distance
-            for neighbor in remaining_candidates:
-                chunk = neighbor[0]
-                chunk_text = chunk["text"] + "\n\n"
-                chunk_tokens = self.count_tokens(chunk_text, role="user")
-                if chunk_total_tokens + chunk_tokens > target_tokens:
-                    break
-                relevant_full_text += chunk_text
-                chunk_total_tokens += chunk_tokens
-                final_artifacts_in_context.append(chunk["text"])
+        preferred_artifacts = [a for a in optimized_artifacts if a in chunk_map]
+        optimized_artifact_set = set(optimized_artifacts)
+        remaining_candidates = [
+            neighbor
+            for neighbor in k_nearest_neighbors
+            if neighbor[0].get("text", "") not in optimized_artifact_set
+        ]
+        remaining_candidates.sort(key=lambda x: x[1])  # Sort by distance
+        preferred_artifacts.extend(
+            neighbor[0]["text"] for neighbor in remaining_candidates
+        )
+        packing_candidates = [
+            (artifact, self.count_chunk_tokens(artifact + "\n\n"), 1.0 / (rank + 1))
+            for rank, artifact in enumerate(preferred_artifacts)
+        ]
+        # The matched cache prefix is kept first so the LLM server can reuse it
+        prefix_artifacts = (
+            matched_prefix.split(RagOptimizer.ARTIFACT_SEPARATOR)
+            if matched_prefix
+            else []
+        )
+        pinned_count = 0
+        for prefix_artifact, artifact in zip(prefix_artifacts, preferred_artifacts):
+            if prefix_artifact != artifact:
+                break
+            pinned_count += 1
+        final_artifacts_in_context, chunk_total_tokens = pack_context(
+            packing_candidates, target_tokens, pinned_count
+        )
+        record_span("pack context", step_start)
+        # 6. Assemble the context text. Chunks of one file are grouped after the kept
+        # prefix, and consecutive chunks are merged under one short header.
+        step_start = time.perf_counter()
+        kept_pinned_count = 0
+        for artifact, pinned_artifact in zip(
+            final_artifacts_in_context, preferred_artifacts[:pinned_count]
+        ):
+            if artifact != pinned_artifact:
+                break
+            kept_pinned_count += 1
+        final_artifacts_in_context = group_chunks_by_file(
+            final_artifacts_in_context, chunk_map, kept_pinned_count
+        )
+        relevant_full_text, chunk_total_tokens, merged_tokens_saved = assemble_context(
+            final_artifacts_in_context, chunk_map, self.count_chunk_tokens
+        )
+        record_span("assemble context", step_start)
+        self.last_context_utilization = (
+            chunk_total_tokens / target_tokens if target_tokens else 0.0
+        )
+        # Where a provider cache breakpoint for the kept prefix can be placed
+        self.last_prefix_text_length = get_prefix_text_length(
+            final_artifacts_in_context, chunk_map, kept_pinned_count
+        )
         self.last_optimized_artifacts = final_artifacts_in_context
+        self.last_relevant_full_text = relevant_full_text
+        self.last_relevant_full_text_tokens = chunk_total_tokens
         if self.verbose and self.chat_mode:
             print(f"Total tokens in relevant_full_text: {chunk_total_tokens}")
             print(f"Context fully filled: {chunk_total_tokens >= target_tokens}")
+            print(f"Context budget utilization: {self.last_context_utilization:.1%}")
+            print(f"Tokens saved by merging adjacent chunks: {merged_tokens_saved}")
         return relevant_full_text
 
     def get_color_prefix(self, brightness, color):
@@ -273,25 +565,122 @@ class BaseAssistant:
 
     def create_user_history(self, prompt, context, tokens=0):
         if tokens == 0:
-            tokens = self.count_tokens(prompt, role="user") + self.count_tokens(
-                context, role="user"
+            tokens = self.count_tokens(prompt, role="user") + self.count_context_tokens(
+                context
             )
-        return {"role": "user", "content": f"{context}{prompt}", "tokens": tokens}
+        history = {"role": "user", "content": f"{context}{prompt}", "tokens": tokens}
+        if context and context == self.last_relevant_full_text:
+            # Offsets where providers with explicit prompt caching can cache the content:
+            # after the reused artifact prefix and after the whole context.
+            history["cache_breakpoints"] = [self.last_prefix_text_length, len(context)]
+        return history
 
     def create_assistant_history(self, response_text):
         tokens = self.count_tokens(response_text, role="assistant")
         return {"role": "assistant", "content": response_text, "tokens": tokens}
 
-    def cull_history_list(self, history_list):
+    def cull_history_list(self, history_list, context_size=None):
+        context_size = context_size or self.context_size
         total_tokens = sum(h["tokens"] for h in history_list)
-        while total_tokens > self.context_size:
-            if len(history_list) > 1:
-                removed = history_list.pop(1)
-                total_tokens -= removed["tokens"]
-            else:
+        while total_tokens > context_size:
+            # The system message and pinned messages (the stable context block) are kept
+            removable_index = next(
+                (
+                    i
+                    for i in range(1, len(history_list))
+                    if not history_list[i].get("pinned")
+                ),
+                None,
+            )
+            if removable_index is None:
                 break
+            removed = history_list.pop(removable_index)
+            total_tokens -= removed["tokens"]
         return history_list
 
+    def get_context_block(self):
+        if len(self.chat_history) > 1 and self.chat_history[1].get("pinned"):
+            return self.chat_history[1]
+        return None
+
+    def update_context_block(self, relevant_full_text):
+        """
+        Adds this turn's context to the stable context block that follows the system
+        message. Chunks already in the block are not repeated and new chunks are appended,
+        so the existing block stays an unchanged prompt prefix. The block is rebuilt from
+        this turn's context if less than half of it would be in the block, or if a file in
+        the block changed.
+        """
+        block = self.get_context_block()
+        built = relevant_full_text == self.last_relevant_full_text
+        artifacts = self.last_optimized_artifacts if built else []
+        if block is not None and built and not self.context_block_stale:
+            chunk_map = {c["text"]: c for c in self.chunks}
+            block_artifact_set = set(self.context_block_artifacts)
+            new_artifacts = [
+                a for a in artifacts if a not in block_artifact_set and a in chunk_map
+            ]
+            budget = self.context_size * self.context_file_ratio
+            appended_artifacts, _ = pack_context(
+                [
+                    (
+                        artifact,
+                        self.count_chunk_tokens(artifact + "\n\n"),
+                        1.0 / (rank + 1),
+                    )
+                    for rank, artifact in enumerate(new_artifacts)
+                ],
+                budget - block["tokens"],
+            )
+            available_count = (
+                len(artifacts) - len(new_artifacts) + len(appended_artifacts)
+            )
+            if available_count * 2 >= len(artifacts):
+                block["cache_breakpoints"] = [len(block["content"])]
+                if appended_artifacts:
+                    appended_artifacts = group_chunks_by_file(
+                        appended_artifacts, chunk_map
+                    )
+                    appended_text, appended_tokens, _ = assemble_context(
+                        appended_artifacts, chunk_map, self.count_chunk_tokens
+                    )
+                    block["content"] += appended_text
+                    block["tokens"] += appended_tokens
+                    block["cache_breakpoints"].append(len(block["content"]))
+                    self.context_block_artifacts.extend(appended_artifacts)
+                if self.verbose and self.chat_mode:
+                    print(
+                        f"Context block: appended {len(appended_artifacts)} chunks, "
+                        f"{block['tokens']} tokens total"
+                    )
+                return
+        # Rebuild the block from this turn's context
+        if block is not None:
+            del self.chat_history[1:3]
+        self.context_block_artifacts = list(artifacts)
+        self.context_block_stale = False
+        if not relevant_full_text:
+            return
+        self.chat_history[1:1] = [
+            {
+                "role": "user",
+                "content": relevant_full_text,
+                "tokens": self.count_context_tokens(relevant_full_text),
+                "pinned": True,
+                "cache_breakpoints": [len(relevant_full_text)],
+            },
+            {
+                "role": "assistant",
+                "content": CONTEXT_BLOCK_ACKNOWLEDGEMENT,
+                "tokens": self.count_tokens(
+                    CONTEXT_BLOCK_ACKNOWLEDGEMENT, role="assistant"
+                ),
+                "pinned": True,
+            },
+        ]
+        if self.verbose and self.chat_mode:
+            print(f"Context block: rebuilt with {len(artifacts)} chunks")
+
     def create_prompt(self, user_input):
         return f"""If this is the final part of this prompt, this is the actual request to respond to. All information
 above should be considered supplementary to this request to help answer it.
@@ -303,31 +692,106 @@ Perform the user request above.
 """
 
     def remove_thinking_message(self, content):
-        start_pattern = self.thinking_start_pattern
-        end_pattern = self.thinking_end_pattern
         if not self.hide_thinking:
             return content
-        start_index = content.find(start_pattern)
-        while start_index != -1:
-            end_index = content.find(end_pattern, start_index)
-            if end_index != -1:
-                content = (
-                    content[:start_index] + content[end_index + len(end_pattern) :]
-                )
-            else:
-                content = content[:start_index]
-            start_index = content.find(start_pattern)
-        return content
+        return remove_thinking(
+            content, self.thinking_start_pattern, self.thinking_end_pattern
+        )
 
     def run_pre_stream_processes(self, user_input):
         self.write_assistant_thinking_message()
 
     def run_stream_processes(self, user_input, one_off=False):
-        prompt = self.create_prompt(user_input)
-        relevant_full_text = self.build_relevant_full_text(
-            user_input, self.artifact_cosine_cutoff
+        """
+        Runs the stages before the answer as a small dependency graph. The prompt, which
+        may involve an intent check, is created while the context is retrieved, and both
+        start from the same query embedding. The answer waits for both.
+        """
+        timeline = StageTimeline(
+            on_record=self.write_stage_event if self.event_writer else None
         )
-        return self.run_basic_chat_stream(prompt, relevant_full_text, one_off)
+        if self.turn_start_time is None:
+            self.turn_start_time = timeline.start_time
+        with weave() as w:
+
+            @w.do
+            def query_embedding():
+                with timeline.stage("query embedding"):
+                    return self.get_query_embedding(user_input)
+
+            @w.do
+            def prompt(query_embedding):
+                with timeline.stage("prompt", ["query embedding"]):
+                    return self.create_prompt(user_input)
+
+            @w.do
+            def relevant_full_text(query_embedding):
+                return self.build_turn_context(user_input, timeline)
+
+        # A failed stage cancels the others, so its error is raised rather than theirs
+        if w.result.exception:
+            raise w.result.exception
+        prompt = w.result.prompt
+        relevant_full_text = w.result.relevant_full_text
+        self.write_index_coverage_message()
+        if self.event_writer:
+            self.event_writer.write_event("sources", sources=self.get_context_sources())
+        with timeline.stage("answer", ["prompt", "retrieval"]):
+            final_response = self.run_basic_chat_stream(
+                prompt, relevant_full_text, one_off
+            )
+        self.last_timeline = timeline
+        self.write_debug_message(timeline.format())
+        self.write_turn_profile(self.turn_start_time)
+        if self.event_writer:
+            self.write_done_event(final_response)
+        return final_response
+
+    def write_turn_profile(self, start):
+        """Writes the per-span summary of a turn to stderr while profiling is on"""
+        profiler = get_profiler()
+        if profiler is None:
+            return
+        end = time.perf_counter()
+        profiler.record("turn", start, end)
+        sys.stderr.write(f"{profiler.format_summary(start, end)}\n")
+        sys.stderr.flush()
+
+    def get_context_sources(self):
+        """
+        Returns:
+            list: The file, chunk and search score of each chunk in the last context.
+        """
+        chunk_map = {c["text"]: c for c in self.chunks}
+        return [
+            {
+                "filepath": chunk_map[artifact].get("filepath"),
+                "chunk_index": chunk_map[artifact].get("chunk_index"),
+                "score": self.last_context_scores.get(artifact),
+            }
+            for artifact in self.last_optimized_artifacts
+            if artifact in chunk_map
+        ]
+
+    def write_stage_event(self, name, start, end):
+        self.event_writer.write_event("stage", name=name, start=start, end=end)
+
+    def write_done_event(self, final_response):
+        self.event_writer.write_event(
+            "done",
+            answer=final_response,
+            usage=get_usage_counts(self.last_completion_usage),
+            cached_prompt_tokens=self.get_cached_prompt_tokens(),
+            retrieval_cache=self.last_retrieval_cache_match,
+            time_to_first_token=self.last_time_to_first_token,
+        )
+
+    def build_turn_context(self, user_input, timeline):
+        """Retrieves the context of a turn. The last stage is recorded as "retrieval"."""
+        with timeline.stage("retrieval", ["query embedding"]):
+            return self.build_relevant_full_text(
+                user_input, self.artifact_cosine_cutoff
+            )
 
     def run_post_stream_processes(self, user_input, stream_output):
         return True
@@ -344,6 +808,7 @@ Perform the user request above.
     def stream_chat(self, user_input):
         if not hasattr(self, "chat_history") or not self.chat_history:
             self.initialize_history()
+        self.turn_start_time = time.perf_counter()
         retries = 0
         accepted = False
         stream_output = ""
@@ -360,56 +825,118 @@ Perform the user request above.
             self.run_bad_output_processes(user_input, stream_output)
 
     def run_basic_chat_stream(self, prompt, relevant_full_text, one_off=False):
-        prompt_history = self.create_user_history(
-            prompt, relevant_full_text, self.count_tokens(relevant_full_text)
-        )
+        if self.context_layout == "stable_block":
+            # Files live in the context block, so turns keep only questions and answers
+            self.update_context_block(relevant_full_text)
+            prompt_history = self.create_user_history(prompt, "")
+        else:
+            prompt_history = self.create_user_history(prompt, relevant_full_text)
         self.chat_history.append(prompt_history)
         self.cull_history_list(self.chat_history)
-        completion_generator = self.call_completion(self.chat_history)
-        output_history = self.create_empty_history()
-        if self.chat_mode:
-            sys.stdout.write(f"\r{' ' * 36}\r")
-            sys.stdout.flush()
-        output_history = self.run_completion_generator(
-            completion_generator, output_history, self.chat_mode
-        )
+        # The tokens in front of the reused artifact prefix
+        if self.context_layout == "stable_block":
+            tokens_before_prefix = self.chat_history[0]["tokens"]
+        else:
+            tokens_before_prefix = sum(h["tokens"] for h in self.chat_history[:-1])
+        with span("generation"):
+            completion_generator = self.call_completion(self.chat_history)
+            output_history = self.create_empty_history()
+            if self.chat_mode:
+                sys.stdout.write(f"\r{' ' * 36}\r")
+                sys.stdout.flush()
+            output_history = self.run_completion_generator(
+                completion_generator,
+                output_history,
+                self.chat_mode or self.stream_output,
+            )
         output_history["content"] = self.remove_thinking_message(
             output_history["content"]
         )
+        cached_tokens = self.get_cached_prompt_tokens()
+        self.last_time_to_first_token = (
+            self.last_first_token_time - self.turn_start_time
+            if self.turn_start_time and self.last_first_token_time
+            else None
+        )
+        profiler = get_profiler()
+        if profiler and self.last_time_to_first_token is not None:
+            profiler.record(
+                "time to first token", self.turn_start_time, self.last_first_token_time
+            )
         if not one_off:
             if self.last_matched_prefix:
-                self.cache_manager.update_prefix_hit(self.last_matched_prefix)
+                if cached_tokens is None:
+                    self.cache_manager.update_prefix_hit(self.last_matched_prefix)
+                else:
+                    # The reused prefix was served from the cache if the cached tokens
+                    # reach past the messages in front of it.
+                    self.cache_manager.record_prefix_result(
+                        self.last_matched_prefix, cached_tokens > tokens_before_prefix
+                    )
             # Add the full sequence of artifacts as a new potential prefix
             if self.last_optimized_artifacts:
                 self.cache_manager.update_prefix_hit(self.last_optimized_artifacts)
             self.cache_manager.add_prompt_to_history(
-                prompt, self.last_optimized_artifacts
+                prompt, self.last_optimized_artifacts, self.last_candidate_pool
             )
         self.chat_history.append(output_history)
         final_response = output_history["content"].strip()
         if self.chat_mode:
             sys.stdout.write("\n\n")
             sys.stdout.flush()
+        self.write_completion_report(cached_tokens)
         return final_response
 
-    def update_index_and_chunks(self, file_path, new_chunks, new_embeddings):
-        # Find indices of all chunks from the old file
-        indices_to_remove = {
-            i for i, chunk in enumerate(self.chunks) if chunk["filepath"] == file_path
-        }
-        if indices_to_remove:
-            # Remove from faiss index. The IDs are the original indices.
-            self.index.remove_ids(np.array(list(indices_to_remove), dtype=np.int64))
-            # Rebuild python list of chunks without the removed items.
+    def write_completion_report(self, cached_tokens):
+        """Writes the verbose report of the last completion"""
+        if self.last_time_to_first_token is not None:
+            self.write_debug_message(
+                f"Time to first token: {self.last_time_to_first_token:.2f}s"
+            )
+        if cached_tokens is not None:
+            self.write_debug_message(
+                f"Prompt cache: {cached_tokens} prompt tokens reused from the cache"
+            )
+
+    def replace_file_chunks(self, file_path, new_chunks, new_embeddings):
+        """Replaces the chunks and embeddings of a file in the index"""
+        with self.index_lock:
+            # Find indices of all chunks from the old file
+            indices_to_remove = {
+                i
+                for i, chunk in enumerate(self.chunks)
+                if chunk["filepath"] == file_path
+            }
+            # The context block would otherwise keep showing the old file contents
+            removed_texts = {self.chunks[i]["text"] for i in indices_to_remove}
+            for assistant in [self, *self.sessions]:
+                if not removed_texts.isdisjoint(assistant.context_block_artifacts):
+                    assistant.context_block_stale = True
+            if indices_to_remove:
+                # Remove from faiss index. The IDs are the original indices.
+                self.index.remove_ids(np.array(list(indices_to_remove), dtype=np.int64))
+            # Search results found before the change would point at the old chunks
+            self.prefetched_neighbors.clear()
+            # A new list is built so readers outside the lock never see a partial one
             self.chunks = [
                 chunk
                 for i, chunk in enumerate(self.chunks)
                 if i not in indices_to_remove
-            ]
-        # Add new chunks and embeddings
-        self.chunks.extend(new_chunks)
-        if new_embeddings:
-            self.index.add(np.array(new_embeddings, dtype=np.float32))
+            ] + list(new_chunks)
+            if new_embeddings:
+                embeddings = np.array(new_embeddings, dtype=np.float32)
+                # The index holds normalized embeddings for inner product search
+                normalize_L2(embeddings)
+                if self.index is None:
+                    self.index = IndexFlatIP(embeddings.shape[1])
+                self.index.add(embeddings)
+            # Sessions search the same index, so they need the matching chunk list
+            for session in self.sessions:
+                session.index = self.index
+                session.chunks = self.chunks
+
+    def update_index_and_chunks(self, file_path, new_chunks, new_embeddings):
+        self.replace_file_chunks(file_path, new_chunks, new_embeddings)
         if self.chat_mode and self.verbose:
             sys.stdout.write(
                 f"\n{self.get_color_prefix(Style.BRIGHT, Fore.YELLOW)}"
@@ -424,51 +951,56 @@ Perform the user request above.
     def run_completion_generator(
         self, completion_output, output_message, write_to_stdout
     ):
-        thinking_context = self.create_thinking_context(write_to_stdout)
+        thinking_filter = self.create_thinking_filter(write_to_stdout)
+        writer = self.create_terminal_writer() if write_to_stdout else None
+        # Deltas are collected in a list and joined once, as appending to the content
+        # string would copy it on every token
+        content_parts = [output_message["content"]]
         has_printed = False
+        self.last_completion_usage = None
+        self.last_first_token_time = None
         for chunk in completion_output:
+            usage = (
+                chunk.get("usage")
+                if isinstance(chunk, dict)
+                else getattr(chunk, "usage", None)
+            )
+            if usage:
+                self.last_completion_usage = usage
+            if not chunk["choices"]:
+                continue  # A usage-only chunk at the end of the stream
             delta = chunk["choices"][0]["delta"]
             if "content" in delta and delta["content"] is not None:
-                output_message["content"] += delta["content"]
-                if (
-                    self.is_done_thinking(thinking_context, output_message["content"])
-                    and write_to_stdout
-                ):
-                    if not has_printed:
-                        sys.stdout.write(f"\r{' ' * 36}\r")
-                        has_printed = True
-                    if not self.no_color and self.chat_mode:
-                        sys.stdout.write(
-                            self.get_color_prefix(Style.BRIGHT, Fore.WHITE)
-                        )
-                    extra_delta_after_thinking = self.get_extra_delta_after_thinking(
-                        thinking_context, write_to_stdout
-                    )
-                    if extra_delta_after_thinking is not None:
-                        sys.stdout.write(extra_delta_after_thinking)
-                    sys.stdout.write(delta["content"])
-                    if not self.no_color and self.chat_mode:
-                        sys.stdout.write(self.get_color_suffix())
-                    sys.stdout.flush()
-        if not has_printed and write_to_stdout and output_message["content"]:
-            sys.stdout.write(f"\r{' ' * 36}\r")
-            if not self.no_color and self.chat_mode:
-                sys.stdout.write(self.get_color_prefix(Style.BRIGHT, Fore.WHITE))
-            content_to_print = self.remove_thinking_message(output_message["content"])
-            sys.stdout.write(content_to_print)
-            if not self.no_color and self.chat_mode:
-                sys.stdout.write(self.get_color_suffix())
-            sys.stdout.flush()
+                if self.last_first_token_time is None:
+                    self.last_first_token_time = time.perf_counter()
+                content_parts.append(delta["content"])
+                if writer:
+                    visible = thinking_filter.feed(delta["content"])
+                    if visible:
+                        if not has_printed:
+                            self.clear_thinking_message()
+                            has_printed = True
+                        writer.write(visible)
+        if writer:
+            visible = thinking_filter.finish()
+            if visible:
+                if not has_printed:
+                    self.clear_thinking_message()
+                writer.write(visible)
+            writer.flush()
+        output_message["content"] = "".join(content_parts)
         return output_message
 
     def run_one_off_completion(self, prompt):
         one_off_history = self.create_one_off_prompt_history(prompt)
-        completion_generator = self.call_completion(one_off_history)
-        output = self.run_completion_generator(
-            completion_generator,
-            self.create_empty_history(role="assistant"),
-            False,
-        )["content"]
+        # One-off completions may run next to other pre-answer completions
+        with self.completion_lock:
+            completion_generator = self.call_completion(one_off_history)
+            output = self.run_completion_generator(
+                completion_generator,
+                self.create_empty_history(role="assistant"),
+                False,
+            )["content"]
         return self.remove_thinking_message(output)
 
     def create_empty_history(self, role="user"):
@@ -483,7 +1015,7 @@ Perform the user request above.
             }
         ]
 
-    def create_thinking_context(self, write_to_stdout):
+    def create_thinking_filter(self, write_to_stdout):
         if write_to_stdout and self.hide_thinking and self.chat_mode:
             if not self.no_color:
                 sys.stdout.write(self.get_color_prefix(Style.BRIGHT, Fore.WHITE))
@@ -491,35 +1023,21 @@ Perform the user request above.
             if not self.no_color:
                 sys.stdout.write(self.get_color_suffix())
             sys.stdout.flush()
-        return {
-            "thinking_start_finished": not self.hide_thinking,
-            "thinking_end_finished": not self.hide_thinking,
-            "delta_after_thinking_finished": None,
-        }
+        return ThinkingFilter(
+            self.thinking_start_pattern, self.thinking_end_pattern, self.hide_thinking
+        )
 
-    def is_done_thinking(self, context, content):
-        if not context["thinking_start_finished"]:
-            if len(content) > len(self.thinking_start_pattern) + 20:
-                context["thinking_start_finished"] = True
-                if self.thinking_start_pattern not in content:
-                    context["thinking_end_finished"] = True
-                    context["delta_after_thinking_finished"] = content
-            return False
-        elif not context["thinking_end_finished"]:
-            if self.thinking_end_pattern in content:
-                context["thinking_end_finished"] = True
-                delta_after_thinking_finished_parts = content.split(
-                    self.thinking_end_pattern
-                )
-                context["delta_after_thinking_finished"] = (
-                    delta_after_thinking_finished_parts[-1]
-                )
-            return False
-        return True
+    def clear_thinking_message(self):
+        if self.chat_mode:
+            sys.stdout.write(f"\r{' ' * 36}\r")
 
-    def get_extra_delta_after_thinking(self, context, write_to_stdout):
-        if context["delta_after_thinking_finished"] is not None:
-            output = context["delta_after_thinking_finished"]
-            context["delta_after_thinking_finished"] = None
-            return output
-        return None
+    def create_terminal_writer(self):
+        if self.event_writer:
+            return TerminalWriter(TokenEventStream(self.event_writer))
+        if self.chat_mode:
+            return TerminalWriter(
+                sys.stdout,
+                self.get_color_prefix(Style.BRIGHT, Fore.WHITE),
+                self.get_color_suffix(),
+            )
+        return TerminalWriter(sys.stdout)
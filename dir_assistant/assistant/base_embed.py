@@ -5,6 +5,10 @@ class BaseEmbed:
     def create_embedding(self, text):
         return []
 
+    def create_embeddings(self, texts):
+        """Embeds several texts. Backends that embed a batch in one request override this."""
+        return [self.create_embedding(text) for text in texts]
+
     def get_chunk_size(self):
         return 0
 
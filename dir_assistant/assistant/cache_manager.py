@@ -1,14 +1,14 @@
-import json
 import time
 from collections import defaultdict
 
-from sqlitedict import SqliteDict
+from dir_assistant.assistant.rag_optimizer import RagOptimizer
+from dir_assistant.assistant.storage import PrefixCacheStore, PromptHistoryStore
 
 
 class CacheManager:
     """
     Manages caching for RAG optimization, including a prefix cache for API query reuse
-    and a prompt history for metadata computation, using SqliteDict for both.
+    and a prompt history for metadata computation, each stored in its own SQLite database.
     """
 
     def __init__(
@@ -27,12 +27,8 @@ class CacheManager:
         """
         self.api_context_cache_ttl = api_context_cache_ttl
 
-        self.prefix_cache = SqliteDict(
-            prefix_cache_path, autocommit=True, timeout=10, journal_mode="WAL"
-        )
-        self.prompt_history = SqliteDict(
-            prompt_history_path, autocommit=True, timeout=10, journal_mode="WAL"
-        )
+        self.prefix_cache = PrefixCacheStore(prefix_cache_path)
+        self.prompt_history = PromptHistoryStore(prompt_history_path)
 
     def get_non_expired_prefixes(self) -> dict:
         """
@@ -41,44 +37,57 @@ class CacheManager:
         Returns:
             dict: A dictionary of {prefix_string: metadata}.
         """
-        now = time.time()
-        expired_keys = [
-            key
-            for key, value in self.prefix_cache.items()
-            if not isinstance(value, dict)
-            or now - value.get("last_hit_timestamp", 0) >= self.api_context_cache_ttl
-        ]
+        expiry_timestamp = time.time() - self.api_context_cache_ttl
+        self.prefix_cache.delete_prefixes_before(expiry_timestamp)
+        return self.prefix_cache.get_prefixes_since(expiry_timestamp)
 
-        for key in expired_keys:
-            del self.prefix_cache[key]
+    def update_prefix_hit(self, prefix_artifacts):
+        """
+        Updates the last hit timestamp for a given prefix.
 
-        return dict(self.prefix_cache.items())
+        Args:
+            prefix_artifacts (list | str): The ordered prefix artifacts that had a cache hit,
+                or a prefix string as returned by RagOptimizer.optimize_rag_for_caching.
+        """
+        self.prefix_cache.set_prefix_hit(
+            self.get_prefix_key(prefix_artifacts), time.time()
+        )
 
-    def update_prefix_hit(self, prefix_artifacts: list):
+    def record_prefix_result(self, prefix_artifacts, hit: bool):
         """
-        Updates the last hit timestamp for a given prefix.
+        Records whether the provider actually served a reused prefix from its cache, and
+        refreshes its timestamp, since the request wrote it to the cache either way.
 
         Args:
-            prefix_artifacts (list): The prefix artifacts that had a cache hit.
+            prefix_artifacts (list | str): The ordered prefix artifacts that were reused.
+            hit (bool): Whether the provider reported cached prompt tokens for the prefix.
         """
-        # Convert list to a canonical string representation for use as a key
-        prefix_string = json.dumps(sorted(prefix_artifacts))
-        self.prefix_cache[prefix_string] = {"last_hit_timestamp": time.time()}
+        self.prefix_cache.record_prefix_result(
+            self.get_prefix_key(prefix_artifacts), time.time(), hit
+        )
 
-    def add_prompt_to_history(self, prompt_string: str, ordered_artifacts: list):
+    def get_prefix_key(self, prefix_artifacts) -> str:
+        # Keys use the optimizer's separator and keep artifact order, since a prefix
+        # only matches a provider cache when its order is identical.
+        if isinstance(prefix_artifacts, str):
+            return prefix_artifacts
+        return RagOptimizer.ARTIFACT_SEPARATOR.join(prefix_artifacts)
+
+    def add_prompt_to_history(
+        self, prompt_string: str, ordered_artifacts: list, candidates: list = None
+    ):
         """
         Adds a processed prompt and its associated artifacts to the history.
 
         Args:
             prompt_string (str): The full prompt string sent to the LLM.
             ordered_artifacts (list): A list of artifact IDs (chunk texts) in the order they appeared.
+            candidates (list): Optional (artifact ID, distance) pairs that were given to the
+                optimizer, so the prompt can be replayed offline.
         """
-        timestamp = time.time()
-        # Use a unique key, like timestamp, for each entry
-        self.prompt_history[str(timestamp)] = {
-            "prompt": prompt_string,
-            "artifacts": ordered_artifacts,
-        }
+        self.prompt_history.add_prompt(
+            time.time(), prompt_string, ordered_artifacts, candidates
+        )
 
     def get_prompt_history(self) -> list:
         """
@@ -87,13 +96,7 @@ class CacheManager:
         Returns:
             list: A list of all prompt history entries.
         """
-        # Sorting by the key (timestamp) to maintain order
-        return [
-            item
-            for _, item in sorted(
-                self.prompt_history.items(), key=lambda x: float(x[0])
-            )
-        ]
+        return self.prompt_history.get_prompts()
 
     def compute_artifact_metadata_from_history(self) -> dict:
         """
@@ -103,8 +106,7 @@ class CacheManager:
             dict: A dictionary of {artifact_id: {'frequency': int, 'positions': list}}.
         """
         artifact_stats = defaultdict(lambda: {"frequency": 0, "positions": []})
-        for _, entry in self.prompt_history.items():
-            artifacts = entry.get("artifacts", [])
+        for artifacts in self.prompt_history.iter_artifact_lists():
             for i, artifact_id in enumerate(artifacts):
                 artifact_stats[artifact_id]["frequency"] += 1
                 artifact_stats[artifact_id]["positions"].append(i)
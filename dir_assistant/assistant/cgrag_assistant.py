@@ -4,6 +4,16 @@ import sys
 from colorama import Fore, Style
 
 from dir_assistant.assistant.base_assistant import BaseAssistant
+from dir_assistant.assistant.cgrag_stream import StreamingRetrieval
+from dir_assistant.assistant.index import get_embed_config
+from dir_assistant.assistant.profiler import span
+from dir_assistant.assistant.retrieval_cache import (
+    MATCH_EXACT,
+    RetrievalCache,
+    create_cache_key,
+)
+from dir_assistant.assistant.storage import IndexStore
+from dir_assistant.cli.config import CACHE_PATH, INDEX_CACHE_FILENAME, get_file_path
 
 
 class CGRAGAssistant(BaseAssistant):
@@ -28,6 +38,13 @@ class CGRAGAssistant(BaseAssistant):
         hide_thinking,
         thinking_start_pattern,
         thinking_end_pattern,
+        context_layout="per_turn",
+        cgrag_streaming=False,
+        cgrag_streaming_batch_size=5,
+        cgrag_streaming_max_tokens=0,
+        cgrag_streaming_max_seconds=0.0,
+        use_retrieval_cache=True,
+        retrieval_cache_similarity=0.98,
     ):
         super().__init__(
             system_instructions,
@@ -47,9 +64,17 @@ class CGRAGAssistant(BaseAssistant):
             hide_thinking,
             thinking_start_pattern,
             thinking_end_pattern,
+            context_layout,
         )
         self.use_cgrag = use_cgrag
         self.print_cgrag = print_cgrag
+        self.cgrag_streaming = cgrag_streaming
+        self.cgrag_streaming_batch_size = cgrag_streaming_batch_size
+        self.cgrag_streaming_max_tokens = cgrag_streaming_max_tokens
+        self.cgrag_streaming_max_seconds = cgrag_streaming_max_seconds
+        self.use_retrieval_cache = use_retrieval_cache
+        self.retrieval_cache_similarity = retrieval_cache_similarity
+        self.retrieval_cache = None
 
     def write_assistant_thinking_message(self):
         # Display the assistant thinking message
@@ -110,53 +135,201 @@ prompt. Keep the list length to around 20 items. If the prompt is referencing co
 function, and variable names as applicable to answering the user prompt.
 """
 
-    def run_stream_processes(self, user_input, one_off=False):
-        if self.use_cgrag:
-            original_context_size = self.context_size
-            # Check if a separate CGRAG context size is available and valid
-            cgrag_context_size_available = (
-                hasattr(self, "cgrag_context_size") and self.cgrag_context_size
+    def build_turn_context(self, user_input, timeline):
+        # Retrieval over a partial index is not worth reusing
+        retrieval_cache = (
+            self.get_retrieval_cache() if self.is_index_complete() else None
+        )
+        cache_key = self.get_retrieval_cache_key() if retrieval_cache else None
+        cached = None
+        if retrieval_cache:
+            with timeline.stage("retrieval cache", ["query embedding"]):
+                cached = retrieval_cache.lookup(
+                    cache_key,
+                    user_input,
+                    self.get_query_embedding(user_input),
+                    self.chunks,
+                )
+        streaming_retrieval = None
+        source_files = set()
+        self.last_retrieval_cache_match = None
+        if cached:
+            guidance, k_nearest_neighbors, match = cached
+            self.last_retrieval_cache_match = match
+            self.write_retrieval_cache_hit(match)
+            if guidance is not None and self.print_cgrag and self.chat_mode:
+                sys.stdout.write(guidance)
+            dependency = "retrieval cache"
+        elif self.use_cgrag:
+            guidance, streaming_retrieval, source_files = self.run_cgrag_guidance(
+                user_input, timeline
             )
-
-            try:
-                # Temporarily set the context size for the CGRAG guidance step
-                if cgrag_context_size_available:
-                    self.context_size = self.cgrag_context_size
-
-                cgrag_relevant_full_text = self.build_relevant_full_text(
-                    user_input, self.artifact_cosine_cgrag_cutoff
+            dependency = "cgrag guidance"
+        else:
+            guidance = None
+            dependency = "query embedding"
+        query = (
+            f"Original prompt:\n{user_input}\nNeeded information:\n{guidance}"
+            if guidance is not None
+            else user_input
+        )
+        with timeline.stage("retrieval", [dependency]):
+            if cached:
+                pass
+            elif streaming_retrieval:
+                with span("cgrag streaming search finish"):
+                    k_nearest_neighbors = streaming_retrieval.finish(guidance)[
+                        : self.get_max_k()
+                    ]
+                self.write_streaming_retrieval_report(streaming_retrieval)
+            else:
+                k_nearest_neighbors = self.search_neighbors(
+                    query, self.artifact_cosine_cutoff
                 )
-                cgrag_prompt = self.create_cgrag_prompt(user_input)
-                cgrag_history = copy.deepcopy(self.chat_history)
-                cgrag_prompt_history = self.create_user_history(
-                    cgrag_prompt, cgrag_relevant_full_text
+            if retrieval_cache and not cached:
+                retrieval_cache.save(
+                    cache_key,
+                    user_input,
+                    self.get_query_embedding(user_input),
+                    guidance,
+                    k_nearest_neighbors,
+                    source_files,
                 )
-                cgrag_history.append(cgrag_prompt_history)
-                self.cull_history_list(cgrag_history)
+            relevant_full_text = self.build_relevant_full_text(
+                query,
+                self.artifact_cosine_cutoff,
+                k_nearest_neighbors=k_nearest_neighbors,
+            )
+        if guidance is not None:
+            self.print_cgrag_output(guidance)
+        return relevant_full_text
+
+    def run_cgrag_guidance(self, user_input, timeline):
+        """
+        Returns:
+            tuple: The guidance, the streaming retrieval if CGRAG streaming is on, and the
+                files of the context the guidance was generated with.
+        """
+        # The CGRAG guidance step uses a separate context size if one is set. It is passed
+        # down rather than set on the assistant, as the prompt is created concurrently.
+        cgrag_context_size = getattr(self, "cgrag_context_size", None)
+        with timeline.stage("cgrag retrieval", ["query embedding"]):
+            cgrag_relevant_full_text = self.build_relevant_full_text(
+                user_input, self.artifact_cosine_cgrag_cutoff, cgrag_context_size
+            )
+            chunk_map = {c["text"]: c for c in self.chunks}
+            source_files = {
+                chunk_map[artifact]["filepath"]
+                for artifact in self.last_optimized_artifacts
+                if artifact in chunk_map
+            }
+        with timeline.stage("cgrag guidance", ["cgrag retrieval"]):
+            cgrag_prompt = self.create_cgrag_prompt(user_input)
+            cgrag_history = copy.deepcopy(self.chat_history)
+            cgrag_prompt_history = self.create_user_history(
+                cgrag_prompt, cgrag_relevant_full_text
+            )
+            cgrag_history.append(cgrag_prompt_history)
+            self.cull_history_list(cgrag_history, cgrag_context_size)
+            streaming_retrieval = (
+                self.create_streaming_retrieval(user_input)
+                if self.cgrag_streaming
+                else None
+            )
+            with self.completion_lock, span("cgrag generation"):
                 cgrag_generator = self.call_completion(
                     cgrag_history, is_cgrag_call=True
                 )
+                if streaming_retrieval:
+                    # The guidance is searched while it streams
+                    cgrag_generator = streaming_retrieval.watch(cgrag_generator)
                 output_history = self.create_empty_history()
                 output_history = self.run_completion_generator(
                     cgrag_generator, output_history, self.print_cgrag
                 )
-                output_history["content"] = self.remove_thinking_message(
-                    output_history["content"]
-                )
+            guidance = self.remove_thinking_message(output_history["content"])
+        return guidance, streaming_retrieval, source_files
 
-            finally:
-                # Always restore the original context size for the main response
-                if cgrag_context_size_available:
-                    self.context_size = original_context_size
+    def get_prompt_searches(self):
+        if not self.use_cgrag:
+            return super().get_prompt_searches()
+        # The answer's search uses the guidance, so only the guidance's search is known
+        return [
+            (
+                self.artifact_cosine_cgrag_cutoff,
+                getattr(self, "cgrag_context_size", None),
+            )
+        ]
 
-            combined_query = f"Original prompt:\n{user_input}\nNeeded information:\n{output_history['content']}"
-            relevant_full_text = self.build_relevant_full_text(
-                combined_query, self.artifact_cosine_cutoff
+    def get_retrieval_cache(self):
+        if self.retrieval_cache is None and self.use_retrieval_cache:
+            self.retrieval_cache = RetrievalCache(
+                IndexStore(get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME)),
+                self.retrieval_cache_similarity,
+            )
+        return self.retrieval_cache
+
+    def get_retrieval_cache_key(self):
+        # Entries are only shared between sessions with the same indexed files, embedding
+        # model, guidance model and retrieval settings. The guidance is generated with the
+        # chat history, so entries are also only shared by turns with the same history.
+        return create_cache_key(
+            [(history["role"], history["content"]) for history in self.chat_history],
+            get_embed_config(self.embed),
+            sorted({chunk["filepath"] for chunk in self.chunks}),
+            self.get_guidance_model_id(),
+            self.use_cgrag,
+            self.artifact_cosine_cutoff,
+            self.artifact_cosine_cgrag_cutoff,
+            self.context_size,
+            getattr(self, "cgrag_context_size", None),
+            self.context_file_ratio,
+        )
+
+    def get_guidance_model_id(self):
+        """Identifies the model that generates the CGRAG guidance"""
+        return self.get_tokenizer_id()
+
+    def write_retrieval_cache_hit(self, match):
+        if match == MATCH_EXACT:
+            self.write_debug_message(
+                "Retrieval cache: reused the retrieval of this prompt"
             )
-            self.print_cgrag_output(output_history["content"])
         else:
-            relevant_full_text = self.build_relevant_full_text(
-                user_input, self.artifact_cosine_cutoff
+            self.write_debug_message(
+                f"Retrieval cache: reused the retrieval of a similar prompt ({match:.3f})"
             )
-        prompt = self.create_prompt(user_input)
-        return self.run_basic_chat_stream(prompt, relevant_full_text, one_off)
+
+    def create_streaming_retrieval(self, user_input):
+        return StreamingRetrieval(
+            user_input,
+            lambda query: self.search_neighbors(query, self.artifact_cosine_cutoff),
+            self.count_chunk_tokens,
+            self.context_size * self.context_file_ratio,
+            self.cgrag_streaming_batch_size,
+            self.cgrag_streaming_max_tokens,
+            self.cgrag_streaming_max_seconds,
+            self.remove_thinking_message,
+        )
+
+    def write_streaming_retrieval_report(self, streaming_retrieval):
+        stopped = (
+            f"stopped early ({streaming_retrieval.stop_reason})"
+            if streaming_retrieval.stop_reason
+            else "completed"
+        )
+        self.write_debug_message(
+            f"CGRAG guidance {stopped} after {streaming_retrieval.streamed_tokens} tokens, "
+            f"{streaming_retrieval.searched_items} items searched in "
+            f"{streaming_retrieval.searches} batches"
+        )
+
+    def create_session(self):
+        # Sessions share the retrieval cache
+        self.get_retrieval_cache()
+        return super().create_session()
+
+    def close(self):
+        if self.retrieval_cache:
+            self.retrieval_cache.close()
+        super().close()
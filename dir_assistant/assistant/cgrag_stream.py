@@ -0,0 +1,168 @@
+import re
+import time
+
+STOP_STABLE = "context stable"
+STOP_TOKEN_BUDGET = "token budget"
+STOP_TIME_BUDGET = "time budget"
+
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s+")
+
+
+def parse_guidance_items(text, complete_only=True):
+    """
+    Splits CGRAG guidance into its list items. Lines without a list marker are items as
+    well, since LLMs do not always format the list.
+
+    Args:
+        text (str): The guidance streamed so far.
+        complete_only (bool): Leave out the last line if it may still be streaming.
+
+    Returns:
+        list: The item texts without list markers.
+    """
+    lines = text.split("\n")
+    if complete_only:
+        lines = lines[:-1]
+    items = []
+    for line in lines:
+        item = LIST_MARKER_PATTERN.sub("", line).strip()
+        if item:
+            items.append(item)
+    return items
+
+
+class StreamingRetrieval:
+    """
+    Searches the index with CGRAG guidance while the guidance is still being generated.
+    Complete list items are searched in batches together with the original prompt, and
+    the neighbors of all batches are merged. The guidance stream is cut off when a batch
+    no longer changes the chunks that fit in the context, or when the token or time
+    budget is used up.
+    """
+
+    def __init__(
+        self,
+        user_input,
+        search,
+        count_chunk_tokens,
+        target_tokens,
+        batch_size=5,
+        max_tokens=0,
+        max_seconds=0.0,
+        remove_thinking=None,
+    ):
+        """
+        Args:
+            user_input (str): The original prompt, which is part of every search query.
+            search (callable): Returns the (chunk, score) neighbors of a query.
+            count_chunk_tokens (callable): Counts the tokens of a chunk's text.
+            target_tokens (int): The number of context tokens available for chunks.
+            batch_size (int): How many new list items are searched together.
+            max_tokens (int): Stop the guidance after this many streamed tokens, 0 for none.
+            max_seconds (float): Stop the guidance after this many seconds, 0 for none.
+            remove_thinking (callable): Removes thinking from the guidance before it is
+                split into items.
+        """
+        self.user_input = user_input
+        self.search = search
+        self.count_chunk_tokens = count_chunk_tokens
+        self.target_tokens = target_tokens
+        self.batch_size = max(1, batch_size)
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.remove_thinking = remove_thinking or (lambda text: text)
+        self.scores = {}
+        self.searched_items = 0
+        self.searches = 0
+        self.streamed_tokens = 0
+        self.context_chunks = frozenset()
+        self.stop_reason = None
+
+    def create_query(self, items):
+        guidance = "\n".join(items)
+        return f"Original prompt:\n{self.user_input}\nNeeded information:\n{guidance}"
+
+    def search_items(self, items):
+        """
+        Searches a batch of items and merges its neighbors.
+
+        Returns:
+            bool: True if the chunks that fit in the context changed.
+        """
+        for chunk, score in self.search(self.create_query(items)):
+            text = chunk.get("text", "")
+            # The index is searched by inner product, so higher scores are closer
+            if text not in self.scores or score > self.scores[text][1]:
+                self.scores[text] = (chunk, score)
+        self.searched_items += len(items)
+        self.searches += 1
+        context_chunks = self.get_context_chunks()
+        changed = context_chunks != self.context_chunks
+        self.context_chunks = context_chunks
+        return changed
+
+    def get_context_chunks(self):
+        chunks = set()
+        total_tokens = 0
+        for chunk, _ in self.neighbors:
+            text = chunk.get("text", "")
+            total_tokens += self.count_chunk_tokens(text + "\n\n")
+            if total_tokens > self.target_tokens:
+                break
+            chunks.add(text)
+        return frozenset(chunks)
+
+    @property
+    def neighbors(self):
+        return sorted(self.scores.values(), key=lambda neighbor: -neighbor[1])
+
+    def watch(self, completion_output):
+        """
+        Passes the guidance stream through, searching complete items as they arrive.
+        Stops consuming the stream when the context is stable or a budget is used up.
+        """
+        start_time = time.perf_counter()
+        content = ""
+        for chunk in completion_output:
+            yield chunk
+            if not chunk["choices"]:
+                continue
+            delta = chunk["choices"][0]["delta"]
+            if delta.get("content") is None:
+                continue
+            content += delta["content"]
+            self.streamed_tokens += 1
+            items = parse_guidance_items(self.remove_thinking(content))
+            if len(items) - self.searched_items >= self.batch_size:
+                changed = self.search_items(items[self.searched_items :])
+                if not changed and self.searches > 1:
+                    self.stop_reason = STOP_STABLE
+            if self.max_tokens and self.streamed_tokens >= self.max_tokens:
+                self.stop_reason = self.stop_reason or STOP_TOKEN_BUDGET
+            if (
+                self.max_seconds
+                and time.perf_counter() - start_time >= self.max_seconds
+            ):
+                self.stop_reason = self.stop_reason or STOP_TIME_BUDGET
+            if self.stop_reason:
+                close = getattr(completion_output, "close", None)
+                if close:
+                    close()
+                break
+
+    def finish(self, guidance):
+        """
+        Searches the items that were not searched while streaming. If the guidance has
+        no items, the original prompt is searched on its own.
+
+        Returns:
+            list: The merged (chunk, score) neighbors, closest first.
+        """
+        if self.stop_reason != STOP_STABLE:
+            items = parse_guidance_items(
+                self.remove_thinking(guidance),
+                complete_only=self.stop_reason is not None,
+            )
+            if len(items) > self.searched_items or not self.searches:
+                self.search_items(items[self.searched_items :])
+        return self.neighbors
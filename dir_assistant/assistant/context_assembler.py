@@ -0,0 +1,160 @@
+import os
+import re
+
+# Matches the header process_file puts at the start of every chunk
+CHUNK_HEADER_PATTERN = re.compile(
+    r"^-+\n\nUser file '(?P<filepath>.*)' lines (?P<start>\d+)-(?P<end>\d+):\n\n"
+)
+
+
+def split_chunk_header(chunk_text):
+    """
+    Splits a chunk into its line range and its body.
+
+    Returns:
+        tuple: (start line, end line, body), or None if the chunk has no standard header.
+    """
+    match = CHUNK_HEADER_PATTERN.match(chunk_text)
+    if not match:
+        return None
+    return int(match["start"]), int(match["end"]), chunk_text[match.end() :]
+
+
+def format_block_header(filepath, start_line, end_line, base_directory):
+    try:
+        display_path = os.path.relpath(filepath, base_directory)
+    except ValueError:  # On another drive
+        display_path = filepath
+    if display_path.startswith(os.pardir):
+        display_path = filepath
+    return f"---------------\n\nUser file '{display_path}' lines {start_line}-{end_line}:\n\n"
+
+
+def group_chunks_by_file(artifacts, chunk_map, pinned_count=0):
+    """
+    Reorders the artifacts after the pinned prefix so chunks of the same file are next to
+    each other, in file order, at the position of the file's first chunk. The pinned prefix
+    is left as it is so it still matches the provider's cached prefix.
+    """
+    groups = {}
+    for artifact in artifacts[pinned_count:]:
+        filepath = chunk_map[artifact].get("filepath")
+        groups.setdefault(filepath, []).append(artifact)
+    grouped = list(artifacts[:pinned_count])
+    for group in groups.values():
+        grouped.extend(sorted(group, key=lambda a: _chunk_position(chunk_map[a])))
+    return grouped
+
+
+def _chunk_position(chunk):
+    if chunk.get("chunk_index") is not None:
+        return chunk["chunk_index"]
+    parsed = split_chunk_header(chunk["text"])
+    return parsed[0] if parsed else 0
+
+
+def _continues_block(block, chunk, start_line):
+    if block["filepath"] is None or block["filepath"] != chunk.get("filepath"):
+        return False
+    if block["chunk_index"] is not None and chunk.get("chunk_index") is not None:
+        return chunk["chunk_index"] == block["chunk_index"] + 1
+    # Chunk headers end on the line the next chunk starts on
+    return block["start_line"] <= start_line <= block["end_line"] + 1
+
+
+def _build_blocks(artifacts, chunk_map):
+    blocks = []
+    for artifact in artifacts:
+        chunk = chunk_map[artifact]
+        parsed = split_chunk_header(chunk["text"])
+        if parsed is None:
+            blocks.append(
+                {"filepath": None, "text": chunk["text"], "artifact_count": 1}
+            )
+            continue
+        start_line, end_line, body = parsed
+        if blocks and _continues_block(blocks[-1], chunk, start_line):
+            block = blocks[-1]
+            block["bodies"].append(body)
+            block["end_line"] = max(block["end_line"], end_line)
+            block["chunk_index"] = chunk.get("chunk_index")
+            block["artifact_count"] += 1
+        else:
+            blocks.append(
+                {
+                    "filepath": chunk.get("filepath"),
+                    "start_line": start_line,
+                    "end_line": end_line,
+                    "chunk_index": chunk.get("chunk_index"),
+                    "bodies": [body],
+                    "artifact_count": 1,
+                }
+            )
+    return blocks
+
+
+def _format_block_header(block, base_directory):
+    return format_block_header(
+        block["filepath"], block["start_line"], block["end_line"], base_directory
+    )
+
+
+def _get_block_length(block, base_directory):
+    if block["filepath"] is None:
+        return len(block["text"]) + 2
+    header = _format_block_header(block, base_directory)
+    return len(header) + sum(len(body) for body in block["bodies"]) + 2
+
+
+def assemble_context(artifacts, chunk_map, count_tokens, base_directory=None):
+    """
+    Builds the context text from the artifacts in order. Consecutive chunks of the same
+    file are merged into one block with a single repo-relative header. Merging only joins a
+    chunk to the block right before it, so the text of a list of artifacts is always a
+    prefix of the text of that list with more artifacts appended, except for the last block.
+
+    Args:
+        artifacts (list): Artifact IDs (chunk texts) in context order.
+        chunk_map (dict): Maps artifact IDs to chunk dicts.
+        count_tokens (callable): Counts tokens of a piece of text, ideally cached.
+        base_directory (str): The directory headers are made relative to. Defaults to
+            the current directory.
+
+    Returns:
+        tuple: (context text, context tokens, tokens saved versus unmerged chunks).
+    """
+    base_directory = base_directory or os.getcwd()
+    unmerged_tokens = sum(
+        count_tokens(chunk_map[artifact]["text"] + "\n\n") for artifact in artifacts
+    )
+    parts = []
+    total_tokens = 0
+    for block in _build_blocks(artifacts, chunk_map):
+        if block["filepath"] is None:
+            parts.append(block["text"] + "\n\n")
+            total_tokens += count_tokens(block["text"] + "\n\n")
+            continue
+        header = _format_block_header(block, base_directory)
+        parts.append(header)
+        parts.extend(block["bodies"])
+        parts.append("\n\n")
+        total_tokens += count_tokens(header)
+        total_tokens += sum(count_tokens(body) for body in block["bodies"])
+    return "".join(parts), total_tokens, max(unmerged_tokens - total_tokens, 0)
+
+
+def get_prefix_text_length(artifacts, chunk_map, prefix_count, base_directory=None):
+    """
+    Returns the length of the assembled context text made only of whole blocks from the
+    first prefix_count artifacts. This is where a provider cache breakpoint for that
+    artifact prefix can be placed.
+    """
+    base_directory = base_directory or os.getcwd()
+    length = 0
+    artifact_count = 0
+    for block in _build_blocks(artifacts, chunk_map):
+        artifact_count += block["artifact_count"]
+        if artifact_count > prefix_count:
+            break
+        length += _get_block_length(block, base_directory)
+    return length
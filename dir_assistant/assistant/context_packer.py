@@ -0,0 +1,53 @@
+def pack_context(candidates, budget, pinned_count=0):
+    """
+    Selects the chunks that go into the context. The leading pinned candidates (a matched
+    cache prefix) are kept first and in order for as long as they fit. The rest are chosen
+    greedily by relevance per token, skipping chunks that don't fit instead of stopping at
+    them, with a fallback to the single most relevant chunk that fits if it beats the greedy
+    choice. Selected chunks keep their preference order so the context stays cache-friendly.
+
+    Args:
+        candidates (list): (artifact_id, tokens, relevance) tuples in order of preference.
+            Repeated artifact IDs are ignored.
+        budget (float): The maximum total number of tokens.
+        pinned_count (int): The number of leading candidates to keep first.
+
+    Returns:
+        tuple: (selected artifact IDs, total tokens of the selection).
+    """
+    seen = set()
+    unique_candidates = []
+    for candidate in candidates:
+        if candidate[0] not in seen:
+            seen.add(candidate[0])
+            unique_candidates.append(candidate)
+    pinned = []
+    used_tokens = 0
+    for artifact_id, tokens, _ in unique_candidates[:pinned_count]:
+        if used_tokens + tokens > budget:
+            break
+        pinned.append(artifact_id)
+        used_tokens += tokens
+    remaining_budget = budget - used_tokens
+    rest = list(enumerate(unique_candidates[len(pinned) :]))
+    by_density = sorted(
+        rest,
+        key=lambda item: (-item[1][2] / max(item[1][1], 1), item[0]),
+    )
+    selected = []
+    selected_tokens = selected_relevance = 0
+    for order, (artifact_id, tokens, relevance) in by_density:
+        if selected_tokens + tokens <= remaining_budget:
+            selected.append(order)
+            selected_tokens += tokens
+            selected_relevance += relevance
+    fitting = [item for item in rest if item[1][1] <= remaining_budget]
+    if fitting:
+        order, (_, tokens, relevance) = max(fitting, key=lambda item: item[1][2])
+        if relevance > selected_relevance:
+            selected, selected_tokens = [order], tokens
+    selected.sort()
+    return (
+        pinned + [rest[order][1][0] for order in selected],
+        used_tokens + selected_tokens,
+    )
@@ -0,0 +1,50 @@
+import json
+import threading
+
+
+class JsonEventWriter:
+    """
+    Writes events as JSON lines, one object per line with an "event" key. Events may be
+    written from several threads.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write_event(self, event, **data):
+        line = json.dumps({"event": event, **data}, default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class TokenEventStream:
+    """A text stream that writes each write as a token event"""
+
+    def __init__(self, event_writer):
+        self.event_writer = event_writer
+
+    def write(self, text):
+        self.event_writer.write_event("token", text=text)
+
+    def flush(self):
+        pass
+
+
+def get_usage_counts(usage):
+    """
+    Reads the token counts of a completion's usage, which is a dict for llama.cpp and an
+    object for LiteLLM.
+
+    Returns:
+        dict: The prompt, completion and total token counts, or None without usage.
+    """
+    if not usage:
+        return None
+    counts = {}
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        counts[key] = (
+            usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+        )
+    return counts
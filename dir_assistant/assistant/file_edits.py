@@ -0,0 +1,409 @@
+import os
+import tempfile
+
+EDIT_FORMAT_FULL_FILE = "full_file"
+EDIT_FORMAT_SEARCH_REPLACE = "search_replace"
+EDIT_FORMAT_UNIFIED_DIFF = "unified_diff"
+EDIT_FORMATS = (
+    EDIT_FORMAT_FULL_FILE,
+    EDIT_FORMAT_SEARCH_REPLACE,
+    EDIT_FORMAT_UNIFIED_DIFF,
+)
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+
+class EditError(Exception):
+    """Raised when LLM edit output can not be parsed or applied"""
+
+
+class InvalidPathError(EditError):
+    """Raised when an edit targets a path outside the project directory"""
+
+
+def validate_edit_path(filepath, base_directory=None):
+    """
+    Checks that a path from the LLM output stays within the project directory.
+
+    Returns:
+        str: The absolute path.
+    """
+    base_directory = os.path.abspath(base_directory or os.getcwd())
+    if ".." in filepath:
+        raise InvalidPathError(
+            f"Invalid file path '{filepath}'. "
+            "Path must be relative and within the project directory."
+        )
+    abs_path = os.path.abspath(os.path.join(base_directory, filepath))
+    if os.path.commonpath([abs_path, base_directory]) != base_directory:
+        raise InvalidPathError(
+            f"Invalid file path '{filepath}'. "
+            "Attempted to write outside the project directory."
+        )
+    return abs_path
+
+
+def strip_code_fences(lines):
+    """Removes blank lines and markdown code fences around LLM output"""
+    lines = list(lines)
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    if lines and lines[0].strip().startswith("```"):
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if lines and lines[-1].strip().endswith("```"):
+        lines.pop()
+    return lines
+
+
+def parse_full_file(output):
+    """
+    Parses a response made of a file path line followed by the file's entire contents.
+
+    Returns:
+        list: One (path, content) edit.
+    """
+    output_lines = output.split("\n")
+    filepath = output_lines[0].strip()
+    if not filepath:
+        raise EditError("The response does not start with a file path.")
+    return [(filepath, "\n".join(strip_code_fences(output_lines[1:])))]
+
+
+def parse_search_replace(output):
+    """
+    Parses search/replace blocks. Each block follows a line with the path of its file:
+
+        path/to/file.py
+        <<<<<<< SEARCH
+        lines to find
+        =======
+        lines to put in their place
+        >>>>>>> REPLACE
+
+    Returns:
+        list: (path, search text, replace text) edits in response order.
+    """
+    edits = []
+    filepath = None
+    lines = output.split("\n")
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if stripped == SEARCH_MARKER:
+            if not filepath:
+                raise EditError("A SEARCH block is not preceded by a file path.")
+            search_lines, i = _read_until(lines, i + 1, DIVIDER_MARKER)
+            replace_lines, i = _read_until(lines, i + 1, REPLACE_MARKER)
+            edits.append((filepath, "\n".join(search_lines), "\n".join(replace_lines)))
+        elif stripped and not stripped.startswith("```"):
+            filepath = stripped.strip("`*")
+        i += 1
+    if not edits:
+        raise EditError("The response does not contain any SEARCH/REPLACE blocks.")
+    return edits
+
+
+def _read_until(lines, start, marker):
+    for i in range(start, len(lines)):
+        if lines[i].strip() == marker:
+            return lines[start:i], i
+    raise EditError(f"A block is missing its '{marker}' line.")
+
+
+def parse_unified_diff(output):
+    """
+    Parses a unified diff covering one or more files.
+
+    Returns:
+        list: (path, hunks) edits, where each hunk is (start index, old lines, new lines).
+            Deleted files have hunks of None.
+    """
+    edits = []
+    lines = strip_code_fences(output.split("\n"))
+    i = 0
+    while i < len(lines):
+        if not _is_file_header(lines, i):
+            i += 1
+            continue
+        old_path = _parse_diff_path(lines[i][4:])
+        new_path = _parse_diff_path(lines[i + 1][4:])
+        i += 2
+        hunks = []
+        while i < len(lines) and lines[i].startswith("@@"):
+            start_line = _parse_hunk_start(lines[i])
+            old_lines = []
+            new_lines = []
+            i += 1
+            while (
+                i < len(lines)
+                and not lines[i].startswith("@@")
+                and not _is_file_header(lines, i)
+            ):
+                line = lines[i]
+                if line.startswith("\\"):  # "\ No newline at end of file"
+                    pass
+                elif line.startswith("-"):
+                    old_lines.append(line[1:])
+                elif line.startswith("+"):
+                    new_lines.append(line[1:])
+                else:
+                    # Context lines start with a space, which LLMs sometimes leave out
+                    old_lines.append(line[1:] if line.startswith(" ") else line)
+                    new_lines.append(line[1:] if line.startswith(" ") else line)
+                i += 1
+            hunks.append((start_line, _trim_blank_tail(old_lines, new_lines)))
+        if new_path is None:
+            edits.append((old_path, None))
+        else:
+            edits.append((new_path, [(start, old, new) for start, (old, new) in hunks]))
+    if not edits:
+        raise EditError("The response does not contain a unified diff.")
+    return edits
+
+
+def _is_file_header(lines, i):
+    return (
+        lines[i].startswith("--- ")
+        and i + 1 < len(lines)
+        and lines[i + 1].startswith("+++ ")
+    )
+
+
+def _parse_diff_path(header):
+    path = header.split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith(("a/", "b/")):
+        path = path[2:]
+    return path
+
+
+def _parse_hunk_start(header):
+    """Returns the index of the first old line of a hunk from its @@ header"""
+    try:
+        old_range = header.split()[1].lstrip("-").split(",")
+        start = int(old_range[0])
+        count = int(old_range[1]) if len(old_range) > 1 else 1
+    except (IndexError, ValueError):
+        return 0
+    # Hunks without old lines insert after their start line
+    return start if count == 0 else max(start - 1, 0)
+
+
+def _trim_blank_tail(old_lines, new_lines):
+    # Blank lines between files are not part of the hunk
+    while old_lines and new_lines and old_lines[-1] == "" and new_lines[-1] == "":
+        old_lines.pop()
+        new_lines.pop()
+    return old_lines, new_lines
+
+
+def find_all_lines(lines, target):
+    """
+    Finds where the target lines occur in the lines, first exactly and then ignoring
+    trailing whitespace.
+
+    Returns:
+        list: The index of the first matching line of every occurrence.
+    """
+    if not target:
+        return []
+    for normalize in (lambda line: line, str.rstrip):
+        normalized_target = [normalize(line) for line in target]
+        normalized_lines = [normalize(line) for line in lines]
+        matches = [
+            i
+            for i in range(len(lines) - len(target) + 1)
+            if normalized_lines[i : i + len(target)] == normalized_target
+        ]
+        if matches:
+            return matches
+    return []
+
+
+def find_lines(lines, target, start_hint=0):
+    """
+    Finds where the target lines occur in the lines. The occurrence closest to the start
+    hint wins.
+
+    Returns:
+        int: The index of the first matching line, or None if the target does not occur.
+    """
+    matches = find_all_lines(lines, target)
+    if not matches:
+        return None
+    return min(matches, key=lambda i: abs(i - start_hint))
+
+
+def apply_search_replace(content, search, replace, filepath):
+    if content is None or not content.strip():
+        if search.strip():
+            raise EditError(
+                f"'{filepath}' is missing or empty, so its SEARCH block must be empty."
+            )
+        return replace + "\n" if replace else ""
+    if not search.strip():
+        raise EditError(
+            f"The SEARCH block for '{filepath}' is empty but the file is not."
+        )
+    lines = content.split("\n")
+    search_lines = search.split("\n")
+    matches = find_all_lines(lines, search_lines)
+    if not matches:
+        raise EditError(
+            f"The SEARCH block does not match the contents of '{filepath}'."
+        )
+    if len(matches) > 1:
+        raise EditError(
+            f"The SEARCH block matches {len(matches)} places in '{filepath}'. "
+            "Include more surrounding lines so it matches only one."
+        )
+    index = matches[0]
+    lines[index : index + len(search_lines)] = replace.split("\n") if replace else []
+    return "\n".join(lines)
+
+
+def apply_hunks(content, hunks, filepath):
+    lines = content.split("\n") if content else []
+    # Hunks are applied from the end so earlier line numbers stay valid
+    for start_line, old_lines, new_lines in sorted(hunks, reverse=True):
+        if not old_lines:
+            index = min(start_line, len(lines))
+        else:
+            index = find_lines(lines, old_lines, start_line)
+            if index is None:
+                raise EditError(
+                    f"A diff hunk at line {start_line + 1} does not match the contents "
+                    f"of '{filepath}'."
+                )
+        lines[index : index + len(old_lines)] = new_lines
+    new_content = "\n".join(lines)
+    if content is None and new_content and not new_content.endswith("\n"):
+        new_content += "\n"
+    return new_content
+
+
+def read_text_file(abs_path):
+    if not os.path.exists(abs_path):
+        return None
+    with open(abs_path, "r", encoding="utf-8", newline="") as text_file:
+        return text_file.read()
+
+
+def compute_file_changes(output, edit_format, base_directory=None):
+    """
+    Validates LLM edit output against the working tree in memory.
+
+    Returns:
+        dict: Maps the absolute path of each touched file to its new content, or to None if
+            the file is deleted.
+    """
+    changes = {}
+
+    def get_content(abs_path):
+        return changes[abs_path] if abs_path in changes else read_text_file(abs_path)
+
+    if edit_format == EDIT_FORMAT_FULL_FILE:
+        for filepath, content in parse_full_file(output):
+            changes[validate_edit_path(filepath, base_directory)] = content
+    elif edit_format == EDIT_FORMAT_SEARCH_REPLACE:
+        edits = parse_search_replace(output)
+        # Every path is checked before anything is read
+        abs_paths = [validate_edit_path(edit[0], base_directory) for edit in edits]
+        for abs_path, (filepath, search, replace) in zip(abs_paths, edits):
+            changes[abs_path] = apply_search_replace(
+                get_content(abs_path), search, replace, filepath
+            )
+    elif edit_format == EDIT_FORMAT_UNIFIED_DIFF:
+        edits = parse_unified_diff(output)
+        abs_paths = [validate_edit_path(edit[0], base_directory) for edit in edits]
+        for abs_path, (filepath, hunks) in zip(abs_paths, edits):
+            if hunks is None:
+                if get_content(abs_path) is None:
+                    raise EditError(f"Can not delete '{filepath}', it does not exist.")
+                changes[abs_path] = None
+            else:
+                changes[abs_path] = apply_hunks(get_content(abs_path), hunks, filepath)
+    else:
+        raise EditError(f"Unknown edit format '{edit_format}'.")
+    return changes
+
+
+def write_file_changes(changes):
+    """
+    Writes all file changes or none of them. New contents are written to temporary files
+    next to their targets first, then moved into place. If any step fails, the files that
+    were already replaced are restored.
+    """
+    originals = {}
+    temp_paths = {}
+    replaced = []
+    created_dirs = []
+    try:
+        for abs_path, content in changes.items():
+            originals[abs_path] = _read_bytes(abs_path)
+            if content is None:
+                continue
+            dir_path = os.path.dirname(abs_path)
+            if not os.path.isdir(dir_path):
+                _make_dirs(dir_path, created_dirs)
+            fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix=".dir-assistant-")
+            temp_paths[abs_path] = temp_path
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as temp_file:
+                temp_file.write(content)
+            if originals[abs_path] is not None:
+                os.chmod(temp_path, os.stat(abs_path).st_mode)
+        for abs_path, content in changes.items():
+            if content is None:
+                os.remove(abs_path)
+            else:
+                os.replace(temp_paths[abs_path], abs_path)
+                del temp_paths[abs_path]
+            replaced.append(abs_path)
+    except Exception:
+        for abs_path in replaced:
+            _restore_file(abs_path, originals[abs_path])
+        for temp_path in temp_paths.values():
+            _remove_quietly(temp_path)
+        for dir_path in reversed(created_dirs):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
+        raise
+
+
+def _read_bytes(abs_path):
+    if not os.path.exists(abs_path):
+        return None
+    with open(abs_path, "rb") as original_file:
+        return original_file.read()
+
+
+def _make_dirs(dir_path, created_dirs):
+    missing = []
+    while dir_path and not os.path.isdir(dir_path):
+        missing.append(dir_path)
+        dir_path = os.path.dirname(dir_path)
+    for path in reversed(missing):
+        os.mkdir(path)
+        created_dirs.append(path)
+
+
+def _restore_file(abs_path, original):
+    if original is None:
+        _remove_quietly(abs_path)
+        return
+    with open(abs_path, "wb") as restored_file:
+        restored_file.write(original)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -6,6 +6,53 @@ from colorama import Fore, Style
 from prompt_toolkit import prompt
 
 from dir_assistant.assistant.cgrag_assistant import CGRAGAssistant
+from dir_assistant.assistant.file_edits import (
+    EDIT_FORMAT_SEARCH_REPLACE,
+    EDIT_FORMAT_UNIFIED_DIFF,
+    EditError,
+    InvalidPathError,
+    compute_file_changes,
+    write_file_changes,
+)
+from dir_assistant.assistant.index import get_embed_config
+from dir_assistant.assistant.intent_classifier import IntentClassifier
+from dir_assistant.assistant.storage import IndexStore
+from dir_assistant.cli.config import CACHE_PATH, INDEX_CACHE_FILENAME, get_file_path
+
+SEARCH_REPLACE_INSTRUCTIONS = """Given the user prompt and included file snippets above, respond with SEARCH/REPLACE blocks
+that make the changes the user prompt requested. Each block starts with the path of the file it changes on its own
+line, followed by the lines to find in the file and the lines to replace them with. The SEARCH lines must match the
+current file exactly, including white space, and should be just long enough to be unique in the file. Use one block
+per change and as many blocks as needed across one or more files. To create a new file, use an empty SEARCH section.
+Do not provide an introduction, summary, or conclusion. Do not write any additional text other than the blocks.
+Example response:
+<---------------------------->
+/home/user/hello_project/hello_world.py
+<<<<<<< SEARCH
+    print("Hello, World!")
+=======
+    print("Hello, Universe!")
+>>>>>>> REPLACE
+<---------------------------->
+"""
+
+UNIFIED_DIFF_INSTRUCTIONS = """Given the user prompt and included file snippets above, respond with a unified diff, in the
+format of 'diff -u', that makes the changes the user prompt requested. The diff can change one or more files. Start
+the changes of each file with '--- ' and '+++ ' lines holding the file's path, then give each change as a hunk
+starting with an '@@' line. Include a few unchanged context lines around each change and make the context and
+removed lines match the current file exactly, including white space. Use '/dev/null' as the old path to create a
+new file. Do not provide an introduction, summary, or conclusion. Do not write any additional text other than the
+diff.
+Example response:
+<---------------------------->
+--- /home/user/hello_project/hello_world.py
++++ /home/user/hello_project/hello_world.py
+@@ -1,2 +1,2 @@
+ if __name__ == "__main__":
+-    print("Hello, World!")
++    print("Hello, Universe!")
+<---------------------------->
+"""
 
 
 class GitAssistant(CGRAGAssistant):
@@ -31,6 +78,15 @@ class GitAssistant(CGRAGAssistant):
         hide_thinking,
         thinking_start_pattern,
         thinking_end_pattern,
+        context_layout="per_turn",
+        git_edit_format="full_file",
+        git_intent_margin=0.03,
+        cgrag_streaming=False,
+        cgrag_streaming_batch_size=5,
+        cgrag_streaming_max_tokens=0,
+        cgrag_streaming_max_seconds=0.0,
+        use_retrieval_cache=True,
+        retrieval_cache_similarity=0.98,
     ):
         super().__init__(
             system_instructions,
@@ -52,31 +108,88 @@ class GitAssistant(CGRAGAssistant):
             hide_thinking,
             thinking_start_pattern,
             thinking_end_pattern,
+            context_layout,
+            cgrag_streaming,
+            cgrag_streaming_batch_size,
+            cgrag_streaming_max_tokens,
+            cgrag_streaming_max_seconds,
+            use_retrieval_cache,
+            retrieval_cache_similarity,
         )
         self.commit_to_git = commit_to_git
+        self.git_edit_format = git_edit_format
+        self.git_apply_error = None
+        self.git_intent_margin = git_intent_margin
+        self.intent_classifier = None
 
     def create_prompt(self, user_input):
         if not self.commit_to_git:
             return super().create_prompt(user_input)
         else:
-            # Ask the LLM if a diff commit is appropriate
-            should_diff_output = self.run_one_off_completion(
-                f"""Does the prompt below request changes to files? 
+            self.should_diff = self.classify_edit_intent(user_input)
+            if self.should_diff:
+                return self.create_edit_prompt(user_input)
+            else:
+                return user_input
+
+    def classify_edit_intent(self, user_input):
+        """
+        Decides if the prompt requests file changes. The embedding classifier answers most
+        prompts without an LLM round trip. The LLM is only asked when it is not confident.
+        """
+        classifier = self.get_intent_classifier()
+        decision = classifier.classify(user_input, self.get_query_embedding(user_input))
+        if decision is not None:
+            source = (
+                f"classifier, margin {classifier.last_margin:.3f}"
+                if classifier.last_margin is not None
+                else "classifier, cached"
+            )
+        else:
+            decision = self.ask_edit_intent(user_input)
+            source = "LLM"
+            if decision is not None:
+                classifier.learn(
+                    user_input, decision, self.get_query_embedding(user_input)
+                )
+        answer = {True: "YES", False: "NO", None: "UNCLEAR"}[decision]
+        self.write_debug_message(f"Edit intent: {answer} ({source})")
+        return decision
+
+    def get_intent_classifier(self):
+        if self.intent_classifier is None:
+            self.intent_classifier = IntentClassifier(
+                self.get_query_embedding,
+                self.git_intent_margin,
+                get_embed_config(self.embed),
+                IndexStore(get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME)),
+            )
+        return self.intent_classifier
+
+    def ask_edit_intent(self, user_input):
+        # Ask the LLM if a diff commit is appropriate
+        should_diff_output = self.run_one_off_completion(
+            f"""Does the prompt below request changes to files? 
 Respond only with one word: "YES" or "NO". Do not respond with additional words or characters, only "YES" or "NO".
 User prompt:
 <---------------------------->
 {user_input}
 <---------------------------->
 """
-            )
-            if "YES" in should_diff_output:
-                self.should_diff = True
-            elif "NO" in should_diff_output:
-                self.should_diff = False
-            else:
-                self.should_diff = None
-            if self.should_diff:
-                return f"""If this is the final part of this prompt, this is the actual request to respond to. All information
+        )
+        if "YES" in should_diff_output:
+            return True
+        elif "NO" in should_diff_output:
+            return False
+        return None
+
+    def create_edit_prompt(self, user_input):
+        if self.git_edit_format == EDIT_FORMAT_SEARCH_REPLACE:
+            edit_instructions = SEARCH_REPLACE_INSTRUCTIONS
+        elif self.git_edit_format == EDIT_FORMAT_UNIFIED_DIFF:
+            edit_instructions = UNIFIED_DIFF_INSTRUCTIONS
+        else:
+            edit_prompt = f"""If this is the final part of this prompt, this is the actual request to respond to. All information
 above should be considered supplementary to this request to help answer it.
 User Prompt (RESPOND TO THIS PROMPT BY CREATING A FILE WITH THE SPECIFICATIONS BELOW):
 <---------------------------->
@@ -95,8 +208,21 @@ if __name__ == "__main__":
     print("Hello, World!")
 <---------------------------->
 """
-            else:
-                return user_input
+            return edit_prompt + self.get_apply_error_note()
+        return f"""If this is the final part of this prompt, this is the actual request to respond to. All information
+above should be considered supplementary to this request to help answer it.
+User Prompt (RESPOND TO THIS PROMPT BY EDITING FILES WITH THE SPECIFICATIONS BELOW):
+<---------------------------->
+{user_input}
+<---------------------------->
+{edit_instructions}{self.get_apply_error_note()}"""
+
+    def get_apply_error_note(self):
+        if not self.git_apply_error:
+            return ""
+        return f"""Your previous response could not be applied to the files: {self.git_apply_error}
+Make sure the changes match the current contents of the files exactly.
+"""
 
     def run_post_stream_processes(self, user_input, stream_output):
         if (
@@ -113,46 +239,21 @@ if __name__ == "__main__":
         if self.chat_mode:
             sys.stdout.write("\n")
         if "y" in apply_changes:
-            output_lines = stream_output.split("\n")
-            changed_filepath = output_lines[0].strip()
-            # Security: Validate the filepath to prevent path traversal attacks
-            if ".." in changed_filepath:
+            try:
+                changes = compute_file_changes(stream_output, self.git_edit_format)
+            except InvalidPathError as e:
+                # Security: Paths outside the project directory are never written
                 if self.chat_mode:
-                    self.write_error_message(
-                        f"Error: Invalid file path '{changed_filepath}'. "
-                        "Path must be relative and within the project directory."
-                    )
+                    self.write_error_message(f"Error: {e}")
                 return True  # Abort the operation
-            abs_path = os.path.abspath(changed_filepath)
-            if not abs_path.startswith(os.getcwd()):
+            except EditError as e:
+                # Nothing was written. The next attempt is told what did not apply.
+                self.git_apply_error = str(e)
                 if self.chat_mode:
-                    self.write_error_message(
-                        f"Error: Invalid file path '{changed_filepath}'. "
-                        "Attempted to write outside the project directory."
-                    )
-                return True  # Abort the operation
-            file_content_lines = []
-            if len(output_lines) > 1:
-                file_content_lines = output_lines[1:]
-            # Remove leading blank lines
-            while file_content_lines and not file_content_lines[0].strip():
-                file_content_lines.pop(0)
-            # Remove leading ``` or ```language
-            if file_content_lines and file_content_lines[0].strip().startswith("```"):
-                file_content_lines.pop(0)
-            # Remove trailing blank lines
-            while file_content_lines and not file_content_lines[-1].strip():
-                file_content_lines.pop()
-            # Remove trailing ```
-            if file_content_lines and file_content_lines[-1].strip().endswith("```"):
-                file_content_lines.pop()
-            cleaned_output = "\n".join(file_content_lines)
+                    self.write_error_message(f"Error: Could not apply the changes. {e}")
+                return False
             try:
-                dir_path = os.path.dirname(changed_filepath)
-                if dir_path:
-                    os.makedirs(dir_path, exist_ok=True)
-                with open(changed_filepath, "w") as changed_file:
-                    changed_file.write(cleaned_output)
+                write_file_changes(changes)
             except Exception as e:
                 if self.chat_mode:
                     sys.stdout.write(
@@ -160,7 +261,12 @@ if __name__ == "__main__":
                     )
                     sys.stdout.flush()
                 return True
-            subprocess.run(["git", "add", "."], check=False)
+            # Only the files that were changed are staged
+            subprocess.run(
+                ["git", "add", "-A", "--"]
+                + [os.path.relpath(path) for path in changes],
+                check=False,
+            )
             commit_message = user_input.strip()
             commit_result = subprocess.run(
                 ["git", "commit", "-m", commit_message],
@@ -198,3 +304,8 @@ if __name__ == "__main__":
     def stream_chat(self, user_input):
         self.git_apply_error = None
         super().stream_chat(user_input)
+
+    def close(self):
+        if self.intent_classifier:
+            self.intent_classifier.close()
+        super().close()
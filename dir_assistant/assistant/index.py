@@ -1,17 +1,25 @@
 import hashlib
 import json
 import os
+import subprocess
 import sys
+import threading
+import time
 
 import numpy as np
 from faiss import IndexFlatIP, IndexFlatL2, normalize_L2
-from sqlitedict import SqliteDict
-from wove import denone, flatten, weave
+from wove import weave
 
+from dir_assistant.assistant.index_ledger import ChunkCheckpoint, IndexLedger
+from dir_assistant.assistant.profiler import record_span, span
+from dir_assistant.assistant.storage import IndexStore
 from dir_assistant.cli.config import (
     CACHE_PATH,
     HISTORY_FILENAME,
     INDEX_CACHE_FILENAME,
+    LEGACY_INDEX_CACHE_FILENAME,
+    LEGACY_PREFIX_CACHE_FILENAME,
+    LEGACY_PROMPT_HISTORY_FILENAME,
     PREFIX_CACHE_FILENAME,
     PROMPT_HISTORY_FILENAME,
     STORAGE_PATH,
@@ -40,68 +48,45 @@ def get_text_files(directory=".", ignore_paths=[]):
     return text_files
 
 
-def get_files_with_contents(directory, ignore_paths, cache_db, embed_config, verbose):
-    text_files = get_text_files(directory, ignore_paths)
-    files_with_contents = []
-    with SqliteDict(cache_db, autocommit=True, timeout=10, journal_mode="WAL") as cache:
-        for filepath in text_files:
-            file_stat = os.stat(filepath)
-            cache_key = f"{embed_config}-{filepath}"
-            file_info = cache.get(cache_key)
-            if file_info and file_info["mtime"] == file_stat.st_mtime:
-                files_with_contents.append(file_info)
-            else:
-                try:
-                    with open(filepath, "r") as file:
-                        contents = file.read()
-                except UnicodeDecodeError:
-                    if verbose:
-                        sys.stdout.write(
-                            f"Skipping {filepath} because it is not a text file.\n"
-                        )
-                        sys.stdout.flush()
-                file_info = {
-                    "filepath": os.path.abspath(filepath),
-                    "contents": contents,
-                    "mtime": file_stat.st_mtime,
-                }
-                cache[cache_key] = file_info
-                files_with_contents.append(file_info)
-    return files_with_contents
+def get_files_with_mtimes(directory, ignore_paths):
+    return [
+        {"filepath": os.path.abspath(filepath), "mtime": os.stat(filepath).st_mtime}
+        for filepath in get_text_files(directory, ignore_paths)
+    ]
 
 
-def create_file_index(
-    embed,
-    ignore_paths,
-    embed_chunk_size,
-    extra_dirs=[],
-    verbose=False,
-    index_concurrent_files=1,
-    index_max_files_per_minute=60,
-    index_chunk_workers=1,
-    index_max_chunk_requests_per_minute=60,
-):
+def read_file_contents(filepath, verbose):
+    try:
+        with open(filepath, "r") as file:
+            return file.read()
+    except UnicodeDecodeError:
+        if verbose:
+            sys.stdout.write(f"Skipping {filepath} because it is not a text file.\n")
+            sys.stdout.flush()
+        return None
+
+
+def get_embed_config(embed):
+    """Hashes the embedding model configuration that cached embeddings belong to"""
     config_str = json.dumps(embed.get_config(), sort_keys=True)
-    embed_config = hashlib.sha256(config_str.encode("utf-8")).hexdigest()
-    cache_db = get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME)
+    return hashlib.sha256(config_str.encode("utf-8")).hexdigest()
+
+
+def get_index_files(ignore_paths, extra_dirs=[], verbose=False):
+    """Lists the text files to index in the current directory and the extra directories"""
     # Start with current directory
-    files_with_contents = get_files_with_contents(
-        ".", ignore_paths, cache_db, embed_config, verbose
-    )
+    files_with_mtimes = get_files_with_mtimes(".", ignore_paths)
     # Add files from additional folders
     for folder in extra_dirs:
         if os.path.exists(folder):
-            folder_files = get_files_with_contents(
-                folder, ignore_paths, cache_db, embed_config, verbose
-            )
-            files_with_contents.extend(folder_files)
+            files_with_mtimes.extend(get_files_with_mtimes(folder, ignore_paths))
         else:
             if verbose:
                 sys.stdout.write(
                     f"Warning: Additional folder {folder} does not exist\n"
                 )
                 sys.stdout.flush()
-    if not files_with_contents:
+    if not files_with_mtimes:
         if verbose:
             sys.stdout.write(
                 f"Warning: No text files found, creating first-file.txt...\n"
@@ -112,67 +97,238 @@ def create_file_index(
                 "Dir-assistant requires a file to be initialized, so this one was created because "
                 "the directory was empty."
             )
-        files_with_contents = get_files_with_contents(
-            ".", ignore_paths, cache_db, verbose
+        files_with_mtimes = get_files_with_mtimes(".", ignore_paths)
+    return files_with_mtimes
+
+
+def get_git_touched_files(directory=".", commit_count=20):
+    """
+    Returns the absolute paths of the files with uncommitted changes or changed in the
+    last commits, or an empty set outside a git repository.
+    """
+    try:
+        root, status, log = (
+            subprocess.run(
+                ["git", *command],
+                cwd=directory,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            for command in (
+                ["rev-parse", "--show-toplevel"],
+                ["status", "--porcelain"],
+                ["log", f"-{commit_count}", "--name-only", "--pretty=format:"],
+            )
         )
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+    # Status lines are "XY path" or "XY old -> new" for renames
+    paths = [line[3:].split(" -> ")[-1] for line in status.splitlines()]
+    paths.extend(log.splitlines())
+    return {
+        os.path.abspath(os.path.join(root.strip(), path.strip('"')))
+        for path in paths
+        if path.strip()
+    }
+
+
+def order_files_for_indexing(files_with_mtimes, touched_files=()):
+    """Orders files so the ones touched in git come first, then the most recently modified"""
+    return sorted(
+        files_with_mtimes,
+        key=lambda item: (item["filepath"] not in touched_files, -item["mtime"]),
+    )
+
+
+def split_cached_files(files_with_mtimes, cached_files, verbose=False):
+    """
+    Returns:
+        tuple: The chunks and embeddings of the files whose cached embeddings are
+            current, and the files that need embedding.
+    """
+    chunks = []
+    embeddings = []
+    pending_files = []
+    for item in files_with_mtimes:
+        cached_chunks = cached_files.get(item["filepath"])
+        if cached_chunks and cached_chunks["mtime"] == item["mtime"]:
+            if verbose:
+                sys.stdout.write(f"Using cached embeddings for {item['filepath']}\n")
+                sys.stdout.flush()
+            chunks.extend(cached_chunks["chunks"])
+            embeddings.extend(cached_chunks["embeddings"])
+        else:
+            pending_files.append(item)
+    return chunks, embeddings, pending_files
+
+
+def index_file(
+    embed,
+    store,
+    embed_config,
+    item,
+    embed_chunk_size,
+    verbose=False,
+    index_chunk_workers=1,
+    index_max_chunk_requests_per_minute=60,
+    checkpoint=None,
+):
+    """
+    Embeds a file and saves its chunks to the store.
+
+    Returns:
+        tuple: The chunks and embeddings of the file, or None if it cannot be read.
+    """
+    contents = read_file_contents(item["filepath"], verbose)
+    if contents is None:
+        return None
+    file_chunks, file_embeddings = process_file(
+        embed,
+        item["filepath"],
+        contents,
+        embed_chunk_size,
+        verbose,
+        index_chunk_workers,
+        index_max_chunk_requests_per_minute,
+        checkpoint,
+    )
+    # The file only counts as indexed once its chunks are committed
+    store.save_file_chunks(
+        embed_config, item["filepath"], item["mtime"], file_chunks, file_embeddings
+    ).result()
+    return file_chunks, file_embeddings
+
+
+def index_files(
+    embed,
+    store,
+    embed_config,
+    ledger,
+    embed_chunk_size,
+    publish,
+    verbose=False,
+    index_concurrent_files=1,
+    index_max_files_per_minute=60,
+    index_chunk_workers=1,
+    index_max_chunk_requests_per_minute=60,
+    on_progress=None,
+):
+    """
+    Embeds the files of a ledger run. Each embedded file is passed to publish with its
+    chunks and embeddings. Files that fail are recorded in the ledger with their error,
+    and the embeddings they finished are kept for the next attempt.
+    """
     with weave() as w:
 
         @w.do(
-            files_with_contents,
+            ledger.files,
             workers=index_concurrent_files,
             limit_per_minute=index_max_files_per_minute,
         )
-        def processed_files(item):
+        def indexed_files(item):
+            checkpoint = ChunkCheckpoint(store, embed_config, item["filepath"])
             try:
-                with SqliteDict(
-                    cache_db, autocommit=True, timeout=10, journal_mode="WAL"
-                ) as cache:
-                    filepath = item["filepath"]
-                    cache_key = f"{embed_config}-{filepath}_chunks"
-                    cached_chunks = cache.get(cache_key)
-                    if cached_chunks and cached_chunks["mtime"] == item["mtime"]:
-                        if verbose:
-                            sys.stdout.write(
-                                f"Using cached embeddings for {filepath}\n"
-                            )
-                            sys.stdout.flush()
-                        return cached_chunks["chunks"], cached_chunks["embeddings"]
-                    contents = item["contents"]
-                    file_chunks, file_embeddings = process_file(
-                        embed,
-                        filepath,
-                        contents,
-                        embed_chunk_size,
-                        verbose,
-                        index_chunk_workers,
-                        index_max_chunk_requests_per_minute,
-                    )
-                    cache[cache_key] = {
-                        "chunks": file_chunks,
-                        "embeddings": file_embeddings,
-                        "mtime": item["mtime"],
-                    }
-                    return file_chunks, file_embeddings
+                result = index_file(
+                    embed,
+                    store,
+                    embed_config,
+                    item,
+                    embed_chunk_size,
+                    verbose,
+                    index_chunk_workers,
+                    index_max_chunk_requests_per_minute,
+                    checkpoint,
+                )
             except Exception as e:
-                return None
+                checkpoint.flush()
+                ledger.record_failure(item, e)
+            else:
+                if result:
+                    publish(item["filepath"], *result)
+                ledger.record_success(item)
+            if on_progress:
+                on_progress(ledger)
+
+    # Errors outside the embedding of a file, such as publishing it, stop the run
+    if w.result.exception:
+        raise w.result.exception
+
+
+def create_index_from_embeddings(embeddings_list):
+    with span("build faiss index", embeddings=len(embeddings_list)):
+        embeddings = np.array(embeddings_list).astype("float32")
+        # Big change -- embeddings are now normalized if not already
+        normalize_L2(embeddings)
+        # Big change -- use inner product (dot product) instead of L2 distance
+        index = IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+    return index
+
+
+def write_index_progress(ledger):
+    sys.stdout.write(f"\r{ledger.format_progress()}\033[K")
+    sys.stdout.flush()
+
+
+def create_file_index(
+    embed,
+    ignore_paths,
+    embed_chunk_size,
+    extra_dirs=[],
+    verbose=False,
+    index_concurrent_files=1,
+    index_max_files_per_minute=60,
+    index_chunk_workers=1,
+    index_max_chunk_requests_per_minute=60,
+    show_progress=False,
+):
+    embed_config = get_embed_config(embed)
+    store = IndexStore(get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME))
+    with span("scan"):
+        files_with_mtimes = get_index_files(ignore_paths, extra_dirs, verbose)
+    # Load every cached chunk with one query instead of one lookup per file
+    with span("load cached embeddings"):
+        all_chunks, all_embeddings, pending_files = split_cached_files(
+            files_with_mtimes, store.load_chunks(embed_config), verbose
+        )
+    ledger = IndexLedger(store, embed_config, pending_files)
+    lock = threading.Lock()
+
+    def publish(filepath, chunks, embeddings):
+        with lock:
+            all_chunks.extend(chunks)
+            all_embeddings.extend(embeddings)
 
-    # Separate the chunks and embeddings from the processed results
-    results = denone(w.result.final)
-    all_chunks = flatten([res[0] for res in results if res])
-    all_embeddings = flatten([res[1] for res in results if res])
+    index_files(
+        embed,
+        store,
+        embed_config,
+        ledger,
+        embed_chunk_size,
+        publish,
+        verbose,
+        index_concurrent_files,
+        index_max_files_per_minute,
+        index_chunk_workers,
+        index_max_chunk_requests_per_minute,
+        write_index_progress if show_progress and not verbose else None,
+    )
+    store.close()
+    if show_progress and not verbose and ledger.files:
+        sys.stdout.write("\n")
+    if (show_progress or verbose) and (ledger.failures or ledger.deferred_files):
+        sys.stdout.write(
+            f"Some files could not be indexed:\n{ledger.format_failures()}\n"
+        )
+        sys.stdout.flush()
     if verbose:
         sys.stdout.write("Creating index from embeddings...\n")
         sys.stdout.flush()
     if not all_embeddings:
         # Handle case with no embeddings to avoid error on np.array
         return None, []
-    embeddings = np.array(all_embeddings).astype("float32")
-    # Big change -- embeddings are now normalized if not already
-    normalize_L2(embeddings)
-    # Big change -- use inner product (dot product) instead of L2 distance
-    index = IndexFlatIP(embeddings.shape[1])
-    index.add(embeddings)
-    return index, all_chunks
+    return create_index_from_embeddings(all_embeddings), all_chunks
 
 
 def process_file(
@@ -183,7 +339,9 @@ def process_file(
     verbose=False,
     index_chunk_workers=1,
     index_max_chunk_requests_per_minute=60,
+    checkpoint=None,
 ):
+    chunking_start = time.perf_counter()
     lines = contents.split("\n")
     raw_chunks = []
     current_chunk = ""
@@ -225,10 +383,13 @@ def process_file(
                 "filepath": filepath,
             }
         )
+    for chunk_index, raw_chunk in enumerate(raw_chunks):
+        raw_chunk["chunk_index"] = chunk_index
+    record_span("chunking", chunking_start, filepath=filepath)
     if verbose:
         sys.stdout.write(f"Creating embeddings for {filepath}\n")
         sys.stdout.flush()
-    with weave() as w:
+    with span("embedding", filepath=filepath, chunks=len(raw_chunks)), weave() as w:
 
         @w.do(
             raw_chunks,
@@ -236,7 +397,11 @@ def process_file(
             limit_per_minute=index_max_chunk_requests_per_minute,
         )
         def create_embedding_concurrently(item):
-            embedding = embed.create_embedding(item["text"])
+            embedding = checkpoint.get(item["text"]) if checkpoint else None
+            if embedding is None:
+                embedding = embed.create_embedding(item["text"])
+                if checkpoint:
+                    checkpoint.add(item["text"], embedding)
             return item, embedding
 
     processed_chunks = []
@@ -265,16 +430,46 @@ import sys
 import numpy as np
 
 
-def search_index(embed, index, query, all_chunks, max_k=1000, max_distance=2.0):
+def search_index(
+    embed,
+    index,
+    query,
+    all_chunks,
+    max_k=1000,
+    max_distance=2.0,
+    query_embedding=None,
+):
     """
     Searches the FAISS index for vectors within a given distance and limits the results.
+    The query is embedded unless its embedding is passed in.
+    """
+    # Nothing is searchable before the first file is indexed
+    if index is None or index.ntotal == 0:
+        return []
+    if query_embedding is None:
+        query_embedding = embed.create_embedding(query)
+    return search_index_batch(
+        index, [query_embedding], all_chunks, max_k, max_distance
+    )[0]
+
+
+def search_index_batch(
+    index, query_embeddings, all_chunks, max_k=1000, max_distance=2.0
+):
+    """
+    Searches the FAISS index for several query embeddings with one range search.
+
+    Returns:
+        list: The (chunk, distance) results of each query, limited to max_k.
     """
-    query_embedding = embed.create_embedding(query)
-    query_vector = np.array([query_embedding]).astype("float32")
-    normalize_L2(query_vector)
+    if index is None or index.ntotal == 0:
+        return [[] for _ in query_embeddings]
+    query_vectors = np.array(query_embeddings).astype("float32")
+    normalize_L2(query_vectors)
 
     try:
-        lims, distances, indices = index.range_search(query_vector, max_distance)
+        with span("search_index", queries=len(query_vectors)):
+            lims, distances, indices = index.range_search(query_vectors, max_distance)
     except (AssertionError, RuntimeError) as e:
         sys.stderr.write(
             f"Error during index search: {e}. Did you change the embedding model? "
@@ -282,20 +477,19 @@ def search_index(embed, index, query, all_chunks, max_k=1000, max_distance=2.0):
         )
         raise e
 
-    # Slice both indices and distances to get the results for the first query
-    start, end = lims[0], lims[1]
-    result_indices = indices[start:end]
-    result_distances = distances[start:end]
-
-    # Use zip to correctly pair each chunk index with its distance
-    relevant_chunks = [
-        (all_chunks[int(idx)], dist)
-        for idx, dist in zip(result_indices, result_distances)
-        if idx != -1
-    ]
-
-    # Apply the max_k limit to the final list of results
-    return relevant_chunks[:max_k]
+    results = []
+    for query_number in range(len(query_vectors)):
+        # The results of each query are a slice of the indices and distances
+        start, end = lims[query_number], lims[query_number + 1]
+        # Use zip to correctly pair each chunk index with its distance
+        relevant_chunks = [
+            (all_chunks[int(idx)], dist)
+            for idx, dist in zip(indices[start:end], distances[start:end])
+            if idx != -1
+        ]
+        # Apply the max_k limit to the final list of results
+        results.append(relevant_chunks[:max_k])
+    return results
 
 
 def clear(args, config_dict):
@@ -304,6 +498,9 @@ def clear(args, config_dict):
         get_file_path(STORAGE_PATH, HISTORY_FILENAME),
         get_file_path(CACHE_PATH, PREFIX_CACHE_FILENAME),
         get_file_path(CACHE_PATH, PROMPT_HISTORY_FILENAME),
+        get_file_path(CACHE_PATH, LEGACY_INDEX_CACHE_FILENAME),
+        get_file_path(CACHE_PATH, LEGACY_PREFIX_CACHE_FILENAME),
+        get_file_path(CACHE_PATH, LEGACY_PROMPT_HISTORY_FILENAME),
     ]
     for file in files:
         if os.path.exists(file):
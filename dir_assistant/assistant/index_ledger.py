@@ -0,0 +1,172 @@
+import hashlib
+import threading
+import time
+
+# Seconds before a file that failed to index is retried, doubled after each failed attempt
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 24 * 60 * 60
+
+
+def get_text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 60 * 60:
+        return f"{seconds // 60}m"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+
+
+class IndexLedger:
+    """
+    Tracks a run over the files that need embedding. Files that fail are recorded with
+    their error and retried on a later run once their backoff has passed, or as soon as
+    they change. Progress and the time left are estimated from the files done so far.
+    """
+
+    def __init__(self, store, embed_config, files_with_mtimes, clock=time.time):
+        """
+        Args:
+            store (IndexStore): The store that holds the ledger.
+            embed_config (str): Hash of the embedding model configuration.
+            files_with_mtimes (list): The files that are not cached.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.store = store
+        self.embed_config = embed_config
+        self.clock = clock
+        self.jobs = store.load_index_jobs(embed_config)
+        self.start_time = clock()
+        self.files = []
+        self.deferred_files = []
+        for item in files_with_mtimes:
+            job = self.jobs.get(item["filepath"])
+            if (
+                job
+                and job["mtime"] == item["mtime"]
+                and job["retry_after"] > self.start_time
+            ):
+                self.deferred_files.append(item)
+            else:
+                self.files.append(item)
+        self.done_files = 0
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def record_success(self, item):
+        with self.lock:
+            self.done_files += 1
+
+    def record_failure(self, item, error):
+        """
+        Records a file that failed to index, which is retried after a backoff that
+        doubles with each failed attempt.
+
+        Returns:
+            dict: The ledger entry of the file.
+        """
+        job = self.jobs.get(item["filepath"])
+        attempts = (job["attempts"] if job else 0) + 1
+        backoff = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        job = {
+            "mtime": item["mtime"],
+            "attempts": attempts,
+            "error": f"{type(error).__name__}: {error}",
+            "retry_after": self.clock() + backoff,
+        }
+        self.store.save_index_job(self.embed_config, item["filepath"], job)
+        with self.lock:
+            self.jobs[item["filepath"]] = job
+            self.failures.append((item["filepath"], job))
+        return job
+
+    def get_progress(self):
+        """
+        Returns:
+            tuple: The number of files indexed, failed and to index in this run.
+        """
+        with self.lock:
+            return self.done_files, len(self.failures), len(self.files)
+
+    def is_finished(self):
+        done_files, failed_files, total_files = self.get_progress()
+        return done_files + failed_files >= total_files
+
+    def get_time_left(self):
+        """
+        Returns:
+            float: The estimated seconds until the run finishes, or None before the
+                first file is done.
+        """
+        done_files, failed_files, total_files = self.get_progress()
+        finished_files = done_files + failed_files
+        if not finished_files:
+            return None
+        elapsed = self.clock() - self.start_time
+        return elapsed / finished_files * (total_files - finished_files)
+
+    def format_progress(self):
+        done_files, failed_files, total_files = self.get_progress()
+        message = f"Indexed {done_files} of {total_files} files"
+        if failed_files:
+            message += f", {failed_files} failed"
+        time_left = self.get_time_left()
+        if time_left is not None and done_files + failed_files < total_files:
+            message += f", about {format_duration(time_left)} left"
+        return message
+
+    def format_failures(self):
+        lines = [
+            f"{filepath}: {job['error']} (attempt {job['attempts']}, retried in "
+            f"{format_duration(job['retry_after'] - self.clock())} or when it changes)"
+            for filepath, job in self.failures
+        ]
+        if self.deferred_files:
+            lines.append(
+                f"{len(self.deferred_files)} files that failed before are waiting to "
+                f"be retried"
+            )
+        return "\n".join(lines)
+
+
+class ChunkCheckpoint:
+    """
+    Saves the embeddings of a file's chunks in batches while the file is indexed, so an
+    interrupted run resumes without embedding them again.
+    """
+
+    def __init__(self, store, embed_config, filepath, batch_size=16):
+        self.store = store
+        self.embed_config = embed_config
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.saved = store.load_chunk_progress(embed_config, filepath)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, text):
+        """
+        Returns:
+            array: The saved embedding of a chunk, or None.
+        """
+        return self.saved.get(get_text_hash(text))
+
+    def add(self, text, embedding):
+        with self.lock:
+            self.pending[get_text_hash(text)] = embedding
+            if len(self.pending) >= self.batch_size:
+                self.flush_pending()
+
+    def flush(self):
+        with self.lock:
+            self.flush_pending()
+
+    def flush_pending(self):
+        if self.pending:
+            self.store.save_chunk_progress(
+                self.embed_config, self.filepath, self.pending
+            )
+            self.pending = {}
@@ -0,0 +1,171 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Prompts labelled True request changes to files, prompts labelled False do not
+EDIT_INTENT_EXEMPLARS = [
+    ("Add a docstring to the main function", True),
+    ("Fix the bug in the login handler", True),
+    ("Rename the variable x to count in utils.py", True),
+    ("Refactor this class to use dataclasses", True),
+    ("Create a new README file for the project", True),
+    ("Update the config to use port 8080", True),
+    ("Remove the unused imports", True),
+    ("Write unit tests for the parser", True),
+    ("Change the error message to be more descriptive", True),
+    ("Implement the missing save method", True),
+    ("Add type hints to all functions in models.py", True),
+    ("Delete the deprecated API endpoint", True),
+    ("Make the retry count configurable", True),
+    ("How does the indexing work?", False),
+    ("What does this function return?", False),
+    ("Explain the architecture of this project", False),
+    ("Where is the database connection configured?", False),
+    ("Why is this test failing?", False),
+    ("Which files handle authentication?", False),
+    ("What is the purpose of the cache manager?", False),
+    ("Can you describe how errors are handled?", False),
+    ("List the command line options", False),
+    ("Is there a memory leak in this code?", False),
+    ("What would be the best way to speed up the search?", False),
+    ("Give me an overview of the main module", False),
+]
+
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.lower().split())
+
+
+def hash_prompt(prompt):
+    return hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+
+class IntentClassifier:
+    """
+    Decides whether a prompt requests file changes by comparing its embedding with labelled
+    exemplar prompts. The score of each label is the mean similarity of its nearest
+    exemplars. When the scores are closer than the margin, the classifier has no answer and
+    the caller asks the LLM, whose answer is learned as a new exemplar.
+
+    Exemplar embeddings are persisted per embedding configuration, so the exemplars are
+    only embedded once per embedding model.
+    """
+
+    def __init__(
+        self,
+        embed_text,
+        margin=0.03,
+        embed_config=None,
+        store=None,
+        exemplars=EDIT_INTENT_EXEMPLARS,
+        neighbors=3,
+        max_decisions=256,
+    ):
+        """
+        Args:
+            embed_text (callable): Embeds a text with the index's embedding model.
+            margin (float): The smallest score difference between labels to decide on.
+            embed_config (str): Hash of the embedding configuration. Exemplar embeddings are
+                only persisted if set.
+            store (IndexStore): The store exemplar embeddings are persisted in.
+            exemplars (list): (prompt, label) pairs.
+            neighbors (int): How many of the nearest exemplars of each label are scored.
+            max_decisions (int): How many past decisions are kept in memory.
+        """
+        self.embed_text = embed_text
+        self.margin = margin
+        self.embed_config = embed_config
+        self.store = store if embed_config else None
+        self.exemplars = exemplars
+        self.neighbors = neighbors
+        self.max_decisions = max_decisions
+        self.decisions = OrderedDict()
+        self.labels = None
+        self.vectors = None
+        self.last_margin = None
+
+    def load_exemplars(self):
+        persisted = (
+            self.store.load_intent_exemplars(self.embed_config) if self.store else {}
+        )
+        default_hashes = set()
+        for prompt, label in self.exemplars:
+            text_hash = hash_prompt(prompt)
+            default_hashes.add(text_hash)
+            if text_hash not in persisted:
+                embedding = self.embed_text(prompt)
+                persisted[text_hash] = (label, embedding)
+                if self.store:
+                    self.store.save_intent_exemplar(
+                        self.embed_config, text_hash, label, embedding
+                    )
+        labels = []
+        vectors = []
+        for text_hash, (label, embedding) in persisted.items():
+            labels.append(label)
+            vectors.append(self.normalize(embedding))
+            # Learned exemplars are also exact past decisions
+            if text_hash not in default_hashes:
+                self.remember(text_hash, label)
+        self.labels = np.array(labels, dtype=bool)
+        self.vectors = np.vstack(vectors)
+
+    def normalize(self, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def remember(self, text_hash, decision):
+        self.decisions[text_hash] = decision
+        self.decisions.move_to_end(text_hash)
+        while len(self.decisions) > self.max_decisions:
+            self.decisions.popitem(last=False)
+
+    def classify(self, prompt, embedding=None):
+        """
+        Returns:
+            bool: True if the prompt requests file changes, False if it does not, or None if
+                the classifier is not confident.
+        """
+        if self.vectors is None:
+            self.load_exemplars()
+        text_hash = hash_prompt(prompt)
+        self.last_margin = None
+        if text_hash in self.decisions:
+            self.decisions.move_to_end(text_hash)
+            return self.decisions[text_hash]
+        if embedding is None:
+            embedding = self.embed_text(prompt)
+        similarities = self.vectors @ self.normalize(embedding)
+        scores = {}
+        for label in (True, False):
+            label_similarities = np.sort(similarities[self.labels == label])[::-1]
+            if not len(label_similarities):
+                return None
+            scores[label] = float(np.mean(label_similarities[: self.neighbors]))
+        self.last_margin = scores[True] - scores[False]
+        if abs(self.last_margin) < self.margin:
+            return None
+        decision = self.last_margin > 0
+        self.remember(text_hash, decision)
+        return decision
+
+    def learn(self, prompt, decision, embedding=None):
+        """Adds a prompt decided by other means, such as the LLM, as an exemplar"""
+        if self.vectors is None:
+            self.load_exemplars()
+        text_hash = hash_prompt(prompt)
+        self.remember(text_hash, decision)
+        if embedding is None:
+            embedding = self.embed_text(prompt)
+        self.labels = np.append(self.labels, decision)
+        self.vectors = np.vstack([self.vectors, self.normalize(embedding)])
+        if self.store:
+            self.store.save_intent_exemplar(
+                self.embed_config, text_hash, decision, embedding
+            )
+
+    def close(self):
+        if self.store:
+            self.store.close()
@@ -2,12 +2,19 @@ from copy import deepcopy
 from json import dumps
 from time import sleep
 
+import litellm
 from colorama import Fore, Style
 from litellm import completion
 from litellm import exceptions as litellm_exceptions
-from litellm import token_counter
+from litellm import get_llm_provider, token_counter
+from litellm.utils import supports_prompt_caching
 
 from dir_assistant.assistant.git_assistant import GitAssistant
+from dir_assistant.assistant.profiler import span, trace_stream
+
+EPHEMERAL_CACHE_CONTROL = {"type": "ephemeral"}
+
+litellm.suppress_debug_info = True
 
 
 class LiteLLMAssistant(GitAssistant):
@@ -19,6 +26,7 @@ class LiteLLMAssistant(GitAssistant):
         cgrag_lite_llm_completion_options,
         cgrag_lite_llm_context_size,
         cgrag_lite_llm_pass_through_context_size,
+        lite_llm_prompt_caching,
         system_instructions,
         embed,
         index,
@@ -39,6 +47,15 @@ class LiteLLMAssistant(GitAssistant):
         hide_thinking,
         thinking_start_pattern,
         thinking_end_pattern,
+        context_layout="per_turn",
+        git_edit_format="full_file",
+        git_intent_margin=0.03,
+        cgrag_streaming=False,
+        cgrag_streaming_batch_size=5,
+        cgrag_streaming_max_tokens=0,
+        cgrag_streaming_max_seconds=0.0,
+        use_retrieval_cache=True,
+        retrieval_cache_similarity=0.98,
     ):
         super().__init__(
             system_instructions,
@@ -61,6 +78,15 @@ class LiteLLMAssistant(GitAssistant):
             hide_thinking,
             thinking_start_pattern,
             thinking_end_pattern,
+            context_layout,
+            git_edit_format,
+            git_intent_margin,
+            cgrag_streaming,
+            cgrag_streaming_batch_size,
+            cgrag_streaming_max_tokens,
+            cgrag_streaming_max_seconds,
+            use_retrieval_cache,
+            retrieval_cache_similarity,
         )
         self.completion_options = lite_llm_completion_options
         self.context_size = lite_llm_context_size
@@ -68,6 +94,8 @@ class LiteLLMAssistant(GitAssistant):
         self.cgrag_completion_options = cgrag_lite_llm_completion_options
         self.cgrag_context_size = cgrag_lite_llm_context_size
         self.cgrag_pass_through_context_size = cgrag_lite_llm_pass_through_context_size
+        self.prompt_caching = lite_llm_prompt_caching
+        self.prompt_caching_modes = {}
         self.no_color = no_color
         if self.chat_mode and self.verbose:
             if self.no_color:
@@ -94,9 +122,18 @@ class LiteLLMAssistant(GitAssistant):
     def call_completion(self, chat_history, is_cgrag_call=False):
         # Clean "tokens" from chat history. It causes an error for mistral.
         chat_history_cleaned = deepcopy(chat_history)
-        for message in chat_history_cleaned:
+        # Only the most recent message with cache breakpoints gets them, since
+        # providers limit the number of breakpoints per request.
+        cache_breakpoints = []
+        breakpoint_message_index = None
+        for i, message in enumerate(chat_history_cleaned):
             if "tokens" in message:
                 del message["tokens"]
+            if "pinned" in message:
+                del message["pinned"]
+            if "cache_breakpoints" in message:
+                cache_breakpoints = message.pop("cache_breakpoints")
+                breakpoint_message_index = i
         # Hardcoded retry settings
         max_retries = 3
         retry_delay_seconds = 1
@@ -110,25 +147,44 @@ class LiteLLMAssistant(GitAssistant):
             if is_cgrag_call
             else self.pass_through_context_size
         )
+        uses_breakpoints, reports_cached_tokens = self.get_prompt_caching_mode(
+            options["model"]
+        )
+        if uses_breakpoints:
+            self.add_cache_breakpoints(
+                chat_history_cleaned, breakpoint_message_index, cache_breakpoints
+            )
+        if reports_cached_tokens:
+            options = {"stream_options": {"include_usage": True}, **options}
         while current_retry <= max_retries:
             try:
                 if self.verbose:
                     print(
                         f"Calling completion with chat history ({len(chat_history_cleaned)} messages, {len(dumps(chat_history_cleaned, indent=4))} characters):"
                     )
-                if pass_through_context:
-                    return completion(
-                        **options,
-                        messages=chat_history_cleaned,
-                        stream=True,
-                        num_ctx=context_size,
-                    )
-                else:
-                    return completion(
-                        **options,
-                        messages=chat_history_cleaned,
-                        stream=True,
-                    )
+                # The request returns once the provider starts streaming
+                with span(
+                    "litellm request", model=options["model"], cgrag=is_cgrag_call
+                ):
+                    if pass_through_context:
+                        stream = completion(
+                            **options,
+                            messages=chat_history_cleaned,
+                            stream=True,
+                            num_ctx=context_size,
+                        )
+                    else:
+                        stream = completion(
+                            **options,
+                            messages=chat_history_cleaned,
+                            stream=True,
+                        )
+                return trace_stream(
+                    stream,
+                    "litellm stream",
+                    model=options["model"],
+                    cgrag=is_cgrag_call,
+                )
             except litellm_exceptions.APIConnectionError as e:
                 current_retry += 1
                 if current_retry > max_retries:
@@ -150,6 +206,17 @@ class LiteLLMAssistant(GitAssistant):
             "after exhausting retries or due to an unhandled state."
         )
 
+    def warm_up(self):
+        # Loads the tokenizers and model info that litellm fetches on first use
+        for options in (self.completion_options, self.cgrag_completion_options):
+            try:
+                token_counter(
+                    model=options["model"], messages=[{"role": "user", "content": ""}]
+                )
+                self.get_prompt_caching_mode(options["model"])
+            except Exception as e:
+                self.write_debug_message(f"Could not warm up {options['model']}: {e}")
+
     def count_tokens(self, text, role="user"):
         valid_roles = ["system", "user", "assistant"]
         role_to_pass = role
@@ -162,3 +229,84 @@ class LiteLLMAssistant(GitAssistant):
             model=self.completion_options["model"],
             messages=[{"role": role_to_pass, "content": text}],
         )
+
+    def get_tokenizer_id(self):
+        return f"litellm:{self.completion_options['model']}"
+
+    def get_guidance_model_id(self):
+        return f"litellm:{self.cgrag_completion_options['model']}"
+
+    def get_prompt_caching_mode(self, model):
+        """
+        Returns whether requests to a model should carry cache_control breakpoints, and
+        whether the provider reports cached prompt tokens in its usage.
+        """
+        if not self.prompt_caching:
+            return False, False
+        if model not in self.prompt_caching_modes:
+            try:
+                provider = get_llm_provider(model)[1]
+            except Exception:
+                provider = None
+            # Anthropic models only cache prefixes marked with explicit breakpoints
+            uses_breakpoints = provider == "anthropic" or "claude" in model.lower()
+            try:
+                automatic_caching = supports_prompt_caching(model)
+            except Exception:
+                automatic_caching = False
+            self.prompt_caching_modes[model] = (
+                uses_breakpoints,
+                uses_breakpoints or automatic_caching,
+            )
+        return self.prompt_caching_modes[model]
+
+    def add_cache_breakpoints(self, messages, message_index, breakpoints):
+        """
+        Marks the system prompt and the given offsets into a user message (the end of the
+        reused artifact prefix and of the context) as cacheable. Providers allow at most
+        four breakpoints per request.
+        """
+        if not messages:
+            return
+        if messages[0]["role"] == "system" and isinstance(messages[0]["content"], str):
+            messages[0]["content"] = [
+                {
+                    "type": "text",
+                    "text": messages[0]["content"],
+                    "cache_control": EPHEMERAL_CACHE_CONTROL,
+                }
+            ]
+        if message_index is None:
+            return
+        message = messages[message_index]
+        content = message["content"]
+        if message["role"] != "user" or not isinstance(content, str):
+            return
+        offsets = sorted(
+            {offset for offset in breakpoints if 0 < offset < len(content)}
+        )
+        if not offsets:
+            return
+        parts = []
+        start = 0
+        for offset in offsets[:3]:
+            parts.append(
+                {
+                    "type": "text",
+                    "text": content[start:offset],
+                    "cache_control": EPHEMERAL_CACHE_CONTROL,
+                }
+            )
+            start = offset
+        parts.append({"type": "text", "text": content[start:]})
+        message["content"] = parts
+
+    def get_cached_prompt_tokens(self):
+        usage = self.last_completion_usage
+        if not usage:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details else None
+        if cached_tokens is None:
+            cached_tokens = getattr(usage, "cache_read_input_tokens", None)
+        return cached_tokens
@@ -1,11 +1,14 @@
 from time import sleep
 
+import litellm
 from litellm import embedding
 from litellm import exceptions as litellm_exceptions
 from litellm import token_counter
 
 from dir_assistant.assistant.base_embed import BaseEmbed
 
+litellm.suppress_debug_info = True
+
 
 class LiteLlmEmbed(BaseEmbed):
     def __init__(
@@ -16,6 +19,10 @@ class LiteLlmEmbed(BaseEmbed):
         self.delay = delay
 
     def create_embedding(self, text):
+        return self.create_embeddings([text])[0]
+
+    def create_embeddings(self, texts):
+        """Embeds several texts with one request"""
         # Hardcoded retry settings
         max_retries = 3
         retry_delay_seconds = 1
@@ -23,21 +30,20 @@ class LiteLlmEmbed(BaseEmbed):
         if self.delay:
             sleep(self.delay)
 
-        # Ensure text is not None, empty, or just whitespace,
+        # Ensure texts are not None, empty, or just whitespace,
         # as some APIs reject such inputs.
-        if not text or text.isspace():
-            text_to_embed = "--empty--"
-        else:
-            text_to_embed = text
+        texts_to_embed = [
+            "--empty--" if not text or text.isspace() else text for text in texts
+        ]
 
         current_retry = 0
         while current_retry <= max_retries:
             try:
-                # Use text_to_embed which has been sanitized
+                # Use texts_to_embed which have been sanitized
                 response = embedding(
-                    **self.lite_llm_embed_completion_options, input=text_to_embed
+                    **self.lite_llm_embed_completion_options, input=texts_to_embed
                 )
-                return response["data"][0]["embedding"]
+                return [item["embedding"] for item in response["data"]]
             except litellm_exceptions.APIConnectionError as e:
                 current_retry += 1
                 if current_retry > max_retries:
@@ -47,7 +53,7 @@ class LiteLlmEmbed(BaseEmbed):
         # This line should ideally not be reached if the loop logic is correct (always returns or raises).
         # Added for robustness in case of unforeseen loop exit.
         raise Exception(
-            f"[dir-assistant] LiteLlmEmbed Error: Embedding failed for '{text_to_embed[:50]}...' "
+            f"[dir-assistant] LiteLlmEmbed Error: Embedding failed for '{texts_to_embed[0][:50]}...' "
             "after exhausting retries or due to an unhandled state."
         )
 
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 
@@ -5,9 +6,25 @@ from colorama import Fore, Style
 
 try:
     from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
 except:
     pass
 from dir_assistant.assistant.git_assistant import GitAssistant
+from dir_assistant.assistant.llama_draft import (
+    DRAFT_DECODING_DRAFT_MODEL,
+    DRAFT_DECODING_PROMPT_LOOKUP,
+    DraftStats,
+    GenerationStats,
+    LlamaModelDraft,
+)
+from dir_assistant.assistant.llama_state_cache import (
+    LlamaStateCache,
+    longest_token_prefix,
+)
+from dir_assistant.assistant.profiler import trace_stream
+from dir_assistant.cli.config import CACHE_PATH
+
+BYTES_PER_MB = 1024 * 1024
 
 
 class suppress_stdout_stderr(object):
@@ -38,10 +55,18 @@ class suppress_stdout_stderr(object):
 
 
 class LlamaCppAssistant(GitAssistant):
+    # A llama.cpp model evaluates one sequence at a time
+    concurrent_completions = False
+
     def __init__(
         self,
         model_path,
         llama_cpp_options,
+        llama_cpp_state_cache_size,
+        llama_cpp_state_disk_cache_size,
+        llama_cpp_draft_decoding,
+        llama_cpp_draft_model_path,
+        llama_cpp_draft_tokens,
         system_instructions,
         embed,
         index,
@@ -63,6 +88,15 @@ class LlamaCppAssistant(GitAssistant):
         hide_thinking,
         thinking_start_pattern,
         thinking_end_pattern,
+        context_layout="per_turn",
+        git_edit_format="full_file",
+        git_intent_margin=0.03,
+        cgrag_streaming=False,
+        cgrag_streaming_batch_size=5,
+        cgrag_streaming_max_tokens=0,
+        cgrag_streaming_max_seconds=0.0,
+        use_retrieval_cache=True,
+        retrieval_cache_similarity=0.98,
     ):
         super().__init__(
             system_instructions,
@@ -85,8 +119,30 @@ class LlamaCppAssistant(GitAssistant):
             hide_thinking,
             thinking_start_pattern,
             thinking_end_pattern,
+            context_layout,
+            git_edit_format,
+            git_intent_margin,
+            cgrag_streaming,
+            cgrag_streaming_batch_size,
+            cgrag_streaming_max_tokens,
+            cgrag_streaming_max_seconds,
+            use_retrieval_cache,
+            retrieval_cache_similarity,
         )
+        self.draft_stats = None
+        self.generation_stats = None
         try:
+            draft_model = self.create_draft_model(
+                llama_cpp_draft_decoding,
+                llama_cpp_draft_model_path,
+                llama_cpp_draft_tokens,
+                llama_cpp_options,
+            )
+            if draft_model is not None:
+                self.draft_stats = DraftStats(draft_model)
+                llama_cpp_options = dict(
+                    llama_cpp_options, draft_model=self.draft_stats
+                )
             if self.verbose:
                 self.llm = Llama(model_path=model_path, **llama_cpp_options)
             else:
@@ -101,7 +157,17 @@ class LlamaCppAssistant(GitAssistant):
             )
             sys.stderr.flush()
             sys.exit(1)
+        self.model_path = model_path
         self.context_size = self.llm.context_params.n_ctx
+        self.state_cache = None
+        self.loaded_tokens = []
+        if llama_cpp_state_cache_size > 0:
+            self.state_cache = LlamaStateCache(
+                llama_cpp_state_cache_size * BYTES_PER_MB,
+                self.get_state_cache_path(),
+                llama_cpp_state_disk_cache_size * BYTES_PER_MB,
+            )
+            self.llm.set_cache(self.state_cache)
         self.completion_options = completion_options
         if self.verbose and self.chat_mode:
             if not self.no_color:
@@ -113,16 +179,85 @@ class LlamaCppAssistant(GitAssistant):
                 sys.stdout.write(Fore.RESET)
             sys.stdout.flush()
 
+    def create_draft_model(
+        self, draft_decoding, draft_model_path, draft_tokens, options
+    ):
+        """
+        Creates the draft model used for speculative decoding, or None if it is off.
+        Prompt lookup drafts the tokens that followed the last generated n-gram in the prompt,
+        which suits answers that copy much of the context, such as full file rewrites.
+        """
+        if draft_decoding == DRAFT_DECODING_PROMPT_LOOKUP:
+            return LlamaPromptLookupDecoding(num_pred_tokens=draft_tokens)
+        if draft_decoding == DRAFT_DECODING_DRAFT_MODEL:
+            # The draft model has to fit the same prompts as the main model
+            draft_options = {
+                key: options[key]
+                for key in ("n_ctx", "n_batch", "n_threads", "n_gpu_layers", "verbose")
+                if key in options
+            }
+            if self.verbose:
+                draft_llm = Llama(model_path=draft_model_path, **draft_options)
+            else:
+                with suppress_stdout_stderr():
+                    draft_llm = Llama(model_path=draft_model_path, **draft_options)
+            return LlamaModelDraft(draft_llm, draft_tokens)
+        return None
+
+    def get_state_cache_path(self):
+        # Saved states are only valid for the model and context size they were made with
+        model_key = f"{os.path.abspath(self.model_path)}:{self.context_size}"
+        return os.path.join(
+            CACHE_PATH,
+            "llama_states",
+            hashlib.sha256(model_key.encode("utf-8")).hexdigest()[:16],
+        )
+
     def call_completion(self, chat_history, is_cgrag_call=False):
+        if self.draft_stats:
+            self.draft_stats.reset()
+        if self.state_cache:
+            # The tokens already evaluated in the model, which llama.cpp reuses as well
+            self.loaded_tokens = self.llm.input_ids[: self.llm.n_tokens].tolist()
+            self.state_cache.last_prompt_tokens = None
         if self.verbose:
-            return self.llm.create_chat_completion(
+            stream = self.llm.create_chat_completion(
                 messages=chat_history, stream=True, **self.completion_options
             )
         else:
             with suppress_stdout_stderr():
-                return self.llm.create_chat_completion(
+                stream = self.llm.create_chat_completion(
                     messages=chat_history, stream=True, **self.completion_options
                 )
+        # The prompt is evaluated before the first chunk
+        return trace_stream(stream, "llama.cpp stream", cgrag=is_cgrag_call)
+
+    def run_completion_generator(
+        self, completion_output, output_message, write_to_stdout
+    ):
+        self.generation_stats = GenerationStats()
+        return super().run_completion_generator(
+            self.generation_stats.measure(completion_output),
+            output_message,
+            write_to_stdout,
+        )
+
+    def write_completion_report(self, cached_tokens):
+        super().write_completion_report(cached_tokens)
+        tokens_per_second = (
+            self.generation_stats.tokens_per_second if self.generation_stats else None
+        )
+        if tokens_per_second is not None:
+            self.write_debug_message(
+                f"Generation: {self.generation_stats.tokens} tokens at "
+                f"{tokens_per_second:.1f} tokens/s"
+            )
+        if self.draft_stats and self.draft_stats.acceptance_rate is not None:
+            self.write_debug_message(
+                f"Draft decoding: {self.draft_stats.accepted_tokens} of "
+                f"{self.draft_stats.proposed_tokens} drafted tokens accepted "
+                f"({self.draft_stats.acceptance_rate:.0%})"
+            )
 
     def count_tokens(
         self, text, role=None
@@ -130,3 +265,26 @@ class LlamaCppAssistant(GitAssistant):
         # Llama.cpp's tokenizer usually doesn't need a role for raw text tokenization.
         # The role is primarily for chat message structuring, which happens before this.
         return len(self.llm.tokenize(bytes(text, "utf-8")))
+
+    def get_cached_prompt_tokens(self):
+        """
+        Returns the prompt tokens of the last completion that were not evaluated again,
+        because they were already in the model or were restored from a cached state.
+        """
+        if not self.state_cache or self.state_cache.last_prompt_tokens is None:
+            return None
+        prompt_tokens = self.state_cache.last_prompt_tokens
+        reused_tokens = max(
+            self.state_cache.last_cached_prefix,
+            longest_token_prefix(self.loaded_tokens, prompt_tokens),
+        )
+        # llama.cpp always evaluates the last prompt token
+        return max(min(reused_tokens, len(prompt_tokens) - 1), 0)
+
+    def get_tokenizer_id(self):
+        return f"llama_cpp:{os.path.abspath(self.model_path)}"
+
+    def close(self):
+        if self.state_cache:
+            self.state_cache.flush()
+        super().close()
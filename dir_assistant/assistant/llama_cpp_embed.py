@@ -29,6 +29,11 @@ class LlamaCppEmbed(BaseEmbed):
     def create_embedding(self, text):
         return self.embed.create_embedding([text])["data"][0]["embedding"]
 
+    def create_embeddings(self, texts):
+        return [
+            item["embedding"] for item in self.embed.create_embedding(texts)["data"]
+        ]
+
     def get_chunk_size(self):
         return self.embed.context_params.n_ctx
 
@@ -0,0 +1,100 @@
+import time
+from itertools import islice
+
+import numpy as np
+
+DRAFT_DECODING_OFF = "off"
+DRAFT_DECODING_PROMPT_LOOKUP = "prompt_lookup"
+DRAFT_DECODING_DRAFT_MODEL = "draft_model"
+DRAFT_DECODING_MODES = (
+    DRAFT_DECODING_OFF,
+    DRAFT_DECODING_PROMPT_LOOKUP,
+    DRAFT_DECODING_DRAFT_MODEL,
+)
+
+
+class LlamaModelDraft:
+    """
+    Drafts tokens for Llama's draft_model option by greedily decoding with a small model
+    that shares the main model's vocabulary. The draft model keeps its evaluated tokens,
+    so each call only evaluates what was added since the previous one.
+    """
+
+    def __init__(self, draft_llm, num_pred_tokens=10):
+        self.draft_llm = draft_llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        tokens = input_ids.tolist()
+        if len(tokens) + self.num_pred_tokens > self.draft_llm.n_ctx():
+            return np.array([], dtype=np.intc)
+        generator = self.draft_llm.generate(tokens, temp=0.0, top_k=1)
+        try:
+            draft_tokens = list(islice(generator, self.num_pred_tokens))
+        finally:
+            generator.close()
+        return np.array(draft_tokens, dtype=np.intc)
+
+
+class DraftStats:
+    """
+    Wraps a draft model to measure how many drafted tokens the main model accepts. Llama
+    calls the draft model once per verification round with all tokens evaluated so far, so
+    the growth of the input between two calls is the drafted tokens that were accepted plus
+    the one token the main model sampled itself.
+    """
+
+    def __init__(self, draft_model):
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self):
+        self.proposed_tokens = 0
+        self.accepted_tokens = 0
+        self.last_input_length = None
+        self.last_draft_length = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        input_length = len(input_ids)
+        if self.last_input_length is not None and input_length > self.last_input_length:
+            self.proposed_tokens += self.last_draft_length
+            self.accepted_tokens += min(
+                input_length - self.last_input_length - 1, self.last_draft_length
+            )
+        draft_tokens = self.draft_model(input_ids, **kwargs)
+        self.last_input_length = input_length
+        self.last_draft_length = len(draft_tokens)
+        return draft_tokens
+
+    @property
+    def acceptance_rate(self):
+        if not self.proposed_tokens:
+            return None
+        return self.accepted_tokens / self.proposed_tokens
+
+
+class GenerationStats:
+    """Measures the output tokens per second of a streamed chat completion"""
+
+    def __init__(self):
+        self.first_token_time = None
+        self.last_token_time = None
+        self.tokens = 0
+
+    def measure(self, completion_generator):
+        for chunk in completion_generator:
+            choices = chunk.get("choices") or [{}]
+            # llama.cpp streams one content chunk per sampled token
+            if choices[0].get("delta", {}).get("content"):
+                self.last_token_time = time.perf_counter()
+                if self.first_token_time is None:
+                    self.first_token_time = self.last_token_time
+                self.tokens += 1
+            yield chunk
+
+    @property
+    def tokens_per_second(self):
+        # Timed from the first token so prompt evaluation is not included
+        if self.tokens < 2 or self.last_token_time <= self.first_token_time:
+            return None
+        return (self.tokens - 1) / (self.last_token_time - self.first_token_time)
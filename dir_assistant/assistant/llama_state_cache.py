@@ -0,0 +1,176 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+
+
+def longest_token_prefix(a, b):
+    length = min(len(a), len(b))
+    if length == 0:
+        return 0
+    mismatches = np.flatnonzero(
+        np.asarray(a[:length], dtype=np.int64) != np.asarray(b[:length], dtype=np.int64)
+    )
+    return int(mismatches[0]) if len(mismatches) else length
+
+
+class LlamaStateCache:
+    """
+    A prefix-keyed cache of llama.cpp model states for Llama.set_cache. Before evaluating a
+    prompt, llama.cpp looks the prompt's tokens up here and loads the state that shares the
+    longest token prefix with it, so only the tokens after that prefix are evaluated. After
+    each completion the model's state is saved under the prompt and completion tokens.
+
+    States are kept in memory up to a size cap, least recently used first out. If a disk
+    path is given, states evicted from memory move to disk, which has its own size cap and
+    persists across sessions.
+    """
+
+    STATE_EXTENSION = ".state"
+    TOKENS_EXTENSION = ".tokens.npy"
+
+    def __init__(self, capacity_bytes, disk_path=None, disk_capacity_bytes=0):
+        """
+        Args:
+            capacity_bytes (int): The maximum size of the states kept in memory.
+            disk_path (str): The directory of the disk tier. The tier is disabled if not set.
+            disk_capacity_bytes (int): The maximum size of the states kept on disk.
+        """
+        self.capacity_bytes = capacity_bytes
+        self.states = OrderedDict()
+        self.disk_path = disk_path if disk_path and disk_capacity_bytes > 0 else None
+        self.disk_capacity_bytes = disk_capacity_bytes
+        # Maps the tokens of each state on disk to (file stem, size), oldest first
+        self.disk_entries = OrderedDict()
+        # The tokens of the last prompt looked up and the prefix its loaded state covered
+        self.last_prompt_tokens = None
+        self.last_cached_prefix = 0
+        if self.disk_path:
+            os.makedirs(self.disk_path, exist_ok=True)
+            self.load_disk_entries()
+
+    @property
+    def cache_size(self):
+        return sum(state.llama_state_size for state in self.states.values())
+
+    @property
+    def disk_cache_size(self):
+        return sum(size for _, size in self.disk_entries.values())
+
+    def find_longest_prefix_key(self, key):
+        best_key = None
+        best_length = 0
+        for cached_key in chain(self.states, self.disk_entries):
+            length = longest_token_prefix(cached_key, key)
+            if length > best_length:
+                best_key = cached_key
+                best_length = length
+        return best_key, best_length
+
+    def __getitem__(self, key):
+        key = tuple(key)
+        self.last_prompt_tokens = key
+        self.last_cached_prefix = 0
+        cached_key, length = self.find_longest_prefix_key(key)
+        if cached_key is None:
+            raise KeyError("No cached state shares a prefix with the prompt")
+        if cached_key in self.states:
+            self.states.move_to_end(cached_key)
+            state = self.states[cached_key]
+        else:
+            state = self.read_disk_state(cached_key)
+            if state is None:
+                raise KeyError("The cached state could not be read from disk")
+            self.store_in_memory(cached_key, state)
+        self.last_cached_prefix = length
+        return state
+
+    def __contains__(self, key):
+        return self.find_longest_prefix_key(tuple(key))[0] is not None
+
+    def __setitem__(self, key, state):
+        key = tuple(key)
+        self.states.pop(key, None)
+        self.remove_disk_state(key)
+        self.store_in_memory(key, state)
+
+    def store_in_memory(self, key, state):
+        self.states[key] = state
+        while self.cache_size > self.capacity_bytes and self.states:
+            evicted_key, evicted_state = self.states.popitem(last=False)
+            self.write_disk_state(evicted_key, evicted_state)
+
+    def get_disk_stem(self, key):
+        key_bytes = np.asarray(key, dtype=np.int64).tobytes()
+        return hashlib.sha256(key_bytes).hexdigest()
+
+    def load_disk_entries(self):
+        entries = []
+        for filename in os.listdir(self.disk_path):
+            if not filename.endswith(self.TOKENS_EXTENSION):
+                continue
+            stem = filename[: -len(self.TOKENS_EXTENSION)]
+            state_path = os.path.join(self.disk_path, stem + self.STATE_EXTENSION)
+            try:
+                tokens = np.load(os.path.join(self.disk_path, filename))
+                stat = os.stat(state_path)
+            except (OSError, ValueError):
+                continue
+            entries.append((stat.st_mtime, tuple(tokens.tolist()), stem, stat.st_size))
+        for _, key, stem, size in sorted(entries):
+            self.disk_entries[key] = (stem, size)
+
+    def write_disk_state(self, key, state):
+        if not self.disk_path:
+            return
+        stem = self.get_disk_stem(key)
+        state_path = os.path.join(self.disk_path, stem + self.STATE_EXTENSION)
+        try:
+            with open(state_path + ".tmp", "wb") as state_file:
+                pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(state_path + ".tmp", state_path)
+            np.save(
+                os.path.join(self.disk_path, stem + self.TOKENS_EXTENSION),
+                np.asarray(key, dtype=np.int64),
+            )
+        except OSError:
+            return
+        self.disk_entries.pop(key, None)
+        self.disk_entries[key] = (stem, os.path.getsize(state_path))
+        while self.disk_cache_size > self.disk_capacity_bytes and self.disk_entries:
+            self.remove_disk_state(next(iter(self.disk_entries)))
+
+    def read_disk_state(self, key):
+        stem, _ = self.disk_entries[key]
+        try:
+            with open(
+                os.path.join(self.disk_path, stem + self.STATE_EXTENSION), "rb"
+            ) as state_file:
+                state = pickle.load(state_file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            state = None
+        # The state now lives in memory and is written back if it is evicted again
+        self.remove_disk_state(key)
+        return state
+
+    def remove_disk_state(self, key):
+        entry = self.disk_entries.pop(key, None)
+        if entry is None:
+            return
+        stem, _ = entry
+        for extension in (self.STATE_EXTENSION, self.TOKENS_EXTENSION):
+            try:
+                os.remove(os.path.join(self.disk_path, stem + extension))
+            except OSError:
+                pass
+
+    def flush(self):
+        """Moves the states in memory to the disk tier so they are kept across sessions"""
+        if not self.disk_path:
+            return
+        for key, state in self.states.items():
+            self.write_disk_state(key, state)
+        self.states.clear()
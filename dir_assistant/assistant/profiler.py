@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Returned by span() while profiling is off, so a disabled span costs one global lookup
+NULL_SPAN = nullcontext()
+
+profiler = None
+
+
+class Profiler:
+    """
+    Records spans: named, timed pieces of work in any thread. Spans are exported as a Chrome
+    trace (chrome://tracing or https://ui.perfetto.dev) and summarized per turn.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.pid = os.getpid()
+        self.spans = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category="dir-assistant", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), category, **args)
+
+    def record(self, name, start, end, category="dir-assistant", **args):
+        """Records a span from perf_counter times"""
+        thread = threading.current_thread()
+        with self.lock:
+            self.thread_names.setdefault(thread.ident, thread.name)
+            self.spans.append((name, category, start, end, thread.ident, args))
+
+    def get_spans(self, start=None, end=None):
+        """
+        Returns:
+            list: The spans that started within start and end, in the order they started.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        return sorted(
+            (
+                span
+                for span in spans
+                if (start is None or span[2] >= start)
+                and (end is None or span[2] <= end)
+            ),
+            key=lambda span: span[2],
+        )
+
+    def to_chrome_trace(self):
+        """
+        Returns:
+            dict: The spans as complete ("X") events of the Chrome trace event format.
+        """
+        events = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+            for thread_id, thread_name in self.thread_names.items()
+        ]
+        for name, category, start, end, thread_id, args in self.get_spans():
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self.start_time) * 1_000_000,
+                    "dur": (end - start) * 1_000_000,
+                    "pid": self.pid,
+                    "tid": thread_id,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file, default=str)
+
+    def format_summary(self, start, end):
+        """
+        Summarizes the spans that started between start and end, such as those of one turn.
+        Spans of the same name are added up. Spans may overlap, as stages run concurrently.
+        """
+        totals = {}
+        for name, _, span_start, span_end, _, _ in self.get_spans(start, end):
+            calls, total, longest = totals.get(name, (0, 0.0, 0.0))
+            duration = span_end - span_start
+            totals[name] = (calls + 1, total + duration, max(longest, duration))
+        name_width = max([len("span")] + [len(name) for name in totals])
+        lines = [
+            f"Turn profile ({end - start:.3f}s):",
+            f" {'span'.ljust(name_width)}  {'calls':>5}  {'total':>9}  {'max':>9}",
+        ]
+        for name, (calls, total, longest) in totals.items():
+            lines.append(
+                f" {name.ljust(name_width)}  {calls:>5}  {total:>8.3f}s  {longest:>8.3f}s"
+            )
+        return "\n".join(lines)
+
+
+def enable_profiling():
+    """Starts recording spans for the rest of the process"""
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def disable_profiling():
+    global profiler
+    profiler = None
+
+
+def get_profiler():
+    """
+    Returns:
+        Profiler: The profiler recording spans, or None if profiling is off.
+    """
+    return profiler
+
+
+def span(name, category="dir-assistant", **args):
+    """A context manager that records its body as a span while profiling is on"""
+    if profiler is None:
+        return NULL_SPAN
+    return profiler.span(name, category, **args)
+
+
+def record_span(name, start, category="dir-assistant", **args):
+    """Records a span from a perf_counter time until now while profiling is on"""
+    if profiler is not None:
+        profiler.record(name, start, time.perf_counter(), category, **args)
+
+
+def trace_stream(stream, name, category="dir-assistant", **args):
+    """
+    Records a completion stream as a span from now until it ends, and a "<name> first
+    chunk" span until its first chunk arrives. The stream is returned as is while
+    profiling is off.
+    """
+    if profiler is None:
+        return stream
+    return trace_stream_chunks(
+        profiler, stream, time.perf_counter(), name, category, args
+    )
+
+
+def trace_stream_chunks(active_profiler, stream, start, name, category, args):
+    first_chunk = True
+    try:
+        for chunk in stream:
+            if first_chunk:
+                active_profiler.record(
+                    f"{name} first chunk", start, time.perf_counter(), category, **args
+                )
+                first_chunk = False
+            yield chunk
+    finally:
+        active_profiler.record(name, start, time.perf_counter(), category, **args)
@@ -0,0 +1,124 @@
+import threading
+
+from dir_assistant.assistant.index import (
+    create_index_from_embeddings,
+    get_embed_config,
+    get_git_touched_files,
+    get_index_files,
+    index_files,
+    order_files_for_indexing,
+    split_cached_files,
+)
+from dir_assistant.assistant.index_ledger import IndexLedger
+from dir_assistant.assistant.profiler import span
+from dir_assistant.assistant.storage import IndexStore
+from dir_assistant.cli.config import CACHE_PATH, INDEX_CACHE_FILENAME, get_file_path
+
+
+class ProgressiveIndexer:
+    """
+    Indexes files in the background so the chat can start right away. The files with
+    current cached embeddings form the first version of the index. The other files are
+    embedded with the files touched in git and the most recently modified files first,
+    and each file is published to the index as soon as it is embedded.
+    """
+
+    def __init__(
+        self,
+        embed,
+        ignore_paths,
+        embed_chunk_size,
+        extra_dirs=[],
+        verbose=False,
+        index_concurrent_files=1,
+        index_max_files_per_minute=60,
+        index_chunk_workers=1,
+        index_max_chunk_requests_per_minute=60,
+    ):
+        self.embed = embed
+        self.ignore_paths = ignore_paths
+        self.embed_chunk_size = embed_chunk_size
+        self.extra_dirs = extra_dirs
+        self.verbose = verbose
+        self.index_concurrent_files = index_concurrent_files
+        self.index_max_files_per_minute = index_max_files_per_minute
+        self.index_chunk_workers = index_chunk_workers
+        self.index_max_chunk_requests_per_minute = index_max_chunk_requests_per_minute
+        self.embed_config = None
+        self.store = None
+        self.ledger = None
+        self.total_files = 0
+        self.cached_files = 0
+        self.thread = None
+
+    def load_cached_index(self):
+        """
+        Returns:
+            tuple: The index and chunks of the files whose cached embeddings are current.
+                The index is None if no file is cached.
+        """
+        self.embed_config = get_embed_config(self.embed)
+        self.store = IndexStore(get_file_path(CACHE_PATH, INDEX_CACHE_FILENAME))
+        with span("scan"):
+            files_with_mtimes = get_index_files(
+                self.ignore_paths, self.extra_dirs, self.verbose
+            )
+        with span("load cached embeddings"):
+            chunks, embeddings, pending_files = split_cached_files(
+                files_with_mtimes, self.store.load_chunks(self.embed_config)
+            )
+        self.ledger = IndexLedger(
+            self.store,
+            self.embed_config,
+            order_files_for_indexing(pending_files, get_git_touched_files()),
+        )
+        self.total_files = len(files_with_mtimes)
+        self.cached_files = self.total_files - len(pending_files)
+        index = create_index_from_embeddings(embeddings) if embeddings else None
+        return index, chunks
+
+    def start(self, publish):
+        """
+        Embeds the remaining files in a background thread.
+
+        Args:
+            publish (callable): Called with the path, chunks and embeddings of each file
+                once it is embedded.
+        """
+        if not self.ledger.files:
+            self.store.close()
+            return
+        self.thread = threading.Thread(target=self.run, args=(publish,), daemon=True)
+        self.thread.start()
+
+    def run(self, publish):
+        try:
+            index_files(
+                self.embed,
+                self.store,
+                self.embed_config,
+                self.ledger,
+                self.embed_chunk_size,
+                publish,
+                self.verbose,
+                self.index_concurrent_files,
+                self.index_max_files_per_minute,
+                self.index_chunk_workers,
+                self.index_max_chunk_requests_per_minute,
+            )
+        finally:
+            self.store.close()
+
+    def get_coverage(self):
+        """
+        Returns:
+            tuple: The number of files indexed so far and the number of files to index.
+        """
+        return self.cached_files + self.ledger.get_progress()[0], self.total_files
+
+    def get_time_left(self):
+        return self.ledger.get_time_left()
+
+    def is_complete(self):
+        """Files that fail are retried in a later session, so they do not count"""
+        return self.ledger.is_finished()
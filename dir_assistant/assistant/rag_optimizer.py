@@ -1,6 +1,21 @@
 import math
 import time
-from collections import defaultdict
+
+import numpy as np
+
+
+def default_scoring_function(columns, weights, current_time):
+    """
+    Scores every candidate artifact at once from its columnar metadata. Artifacts without
+    any metadata get a neutral score of 0.
+    """
+    stability = current_time - columns["last_modified"]
+    scores = (
+        weights.get("frequency", 1.0) * columns["frequency"]
+        - weights.get("position", 1.0) * columns["mean_position"]
+        + weights.get("stability", 1.0) * stability
+    )
+    return np.where(columns["has_metadata"], scores, 0.0)
 
 
 class RagOptimizer:
@@ -10,7 +25,7 @@ class RagOptimizer:
 
     ARTIFACT_SEPARATOR = "<--|-->"
 
-    def __init__(self, weights, artifact_excludable_factor):
+    def __init__(self, weights, artifact_excludable_factor, scoring_function=None):
         """
         Initializes the RagOptimizer.
         Args:
@@ -19,33 +34,62 @@ class RagOptimizer:
                             'historical_hits', and 'prefix_length'.
             artifact_excludable_factor (float): The percentile of the most distant RAG
                                                 results that can be replaced.
+            scoring_function (callable): Optional replacement for default_scoring_function.
+                                         Called as scoring_function(columns, weights,
+                                         current_time) and must return one score per
+                                         candidate.
         """
         self.weights = weights
         self.artifact_excludable_factor = artifact_excludable_factor
+        self.scoring_function = scoring_function or default_scoring_function
 
-    def _calculate_average(self, lst):
-        """Calculates the average of a list, returning 0 for an empty list."""
-        return sum(lst) / len(lst) if lst else 0
-
-    def _score_artifact(self, artifact_id, artifact_metadata, current_time):
-        """Calculates a general-purpose score for a single artifact."""
-        stats = artifact_metadata.get(artifact_id)
-        if not stats:
-            return 0  # Return a neutral score if no metadata exists
-
-        frequency = stats.get("frequency", 0)
-        positions = stats.get("positions", [])
-        last_modified = stats.get("last_modified_timestamp", current_time)
-
-        stability_score = current_time - last_modified
-        avg_position = self._calculate_average(positions)
+    def build_candidate_columns(
+        self, artifact_ids, distances, artifact_metadata, current_time
+    ):
+        """
+        Converts per-artifact metadata into columnar arrays aligned with artifact_ids.
+        Args:
+            artifact_ids (list): Candidate artifact IDs in input order.
+            distances (list): The semantic search distance of each candidate.
+            artifact_metadata (dict): {artifact_id: {'frequency', 'positions',
+                                      'last_modified_timestamp'}}.
+            current_time (float): Timestamp used for missing modification times.
+        """
+        count = len(artifact_ids)
+        columns = {
+            "frequency": np.zeros(count),
+            "mean_position": np.zeros(count),
+            "last_modified": np.full(count, current_time, dtype=np.float64),
+            "distance": np.asarray(distances, dtype=np.float64),
+            "has_metadata": np.zeros(count, dtype=bool),
+        }
+        for i, artifact_id in enumerate(artifact_ids):
+            stats = artifact_metadata.get(artifact_id)
+            if not stats:
+                continue
+            positions = stats.get("positions", [])
+            columns["has_metadata"][i] = True
+            columns["frequency"][i] = stats.get("frequency", 0)
+            columns["mean_position"][i] = (
+                sum(positions) / len(positions) if positions else 0
+            )
+            columns["last_modified"][i] = stats.get(
+                "last_modified_timestamp", current_time
+            )
+        return columns
 
-        final_score = (
-            (self.weights.get("frequency", 1.0) * frequency)
-            - (self.weights.get("position", 1.0) * avg_position)
-            + (self.weights.get("stability", 1.0) * stability_score)
+    def rank_candidates(self, columns, current_time):
+        """
+        Orders candidates by score (desc), then distance (asc), then input order, in one
+        vectorized pass. Returns the candidate indices in ranked order.
+        """
+        scores = np.asarray(
+            self.scoring_function(columns, self.weights, current_time),
+            dtype=np.float64,
         )
-        return final_score
+        input_order = np.arange(len(scores))
+        # np.lexsort sorts by the last key first
+        return np.lexsort((input_order, columns["distance"], -scores))
 
     def optimize_rag_for_caching(
         self,
@@ -53,10 +97,16 @@ class RagOptimizer:
         prompt_history,
         artifact_metadata,
         prefix_cache_metadata,
+        candidate_columns=None,
     ):
         """
         Optimizes RAG artifacts by finding the longest possible cached prefix.
 
+        Candidates are scored from columnar arrays. Callers that already hold the
+        candidate pool's metadata as columns (see build_candidate_columns) can pass them
+        as candidate_columns, aligned with the de-duplicated input order; otherwise they
+        are built from artifact_metadata.
+
         This method is reworked to provide stable ordering, especially when
         metadata is not available, by using the initial semantic search
         distance as a tie-breaker.
@@ -122,12 +172,18 @@ class RagOptimizer:
         excludable_artifacts = all_initial_artifacts - core_artifacts
 
         current_time = time.time()
-
-        def sort_key(artifact_id):
-            """Defines the sorting logic: score (desc), then distance (asc)."""
-            score = self._score_artifact(artifact_id, artifact_metadata, current_time)
-            distance = artifact_distances.get(artifact_id, float("inf"))
-            return -score, distance
+        candidate_ids = list(artifact_distances.keys())
+        if candidate_columns is None:
+            candidate_columns = self.build_candidate_columns(
+                candidate_ids,
+                [artifact_distances[art_id] for art_id in candidate_ids],
+                artifact_metadata,
+                current_time,
+            )
+        ranked_artifacts = [
+            candidate_ids[i]
+            for i in self.rank_candidates(candidate_columns, current_time)
+        ]
 
         # ------------------------------------------------------------------
         # 1. Find the best cached prefix by allowing artifact swaps.
@@ -177,9 +233,13 @@ class RagOptimizer:
                             count += 1
                     return count
 
+                # Then by how often the provider actually served the prefix from cache
                 best_prefix = max(
                     longest_candidates,
-                    key=get_historical_hits,
+                    key=lambda p: (
+                        get_historical_hits(p),
+                        prefix_cache_metadata[p].get("hits", 0),
+                    ),
                 )
 
         if best_prefix:
@@ -190,8 +250,12 @@ class RagOptimizer:
             remaining_slots = num_artifacts - len(final_artifacts)
 
             if remaining_slots > 0:
-                candidates_for_remainder = all_initial_artifacts - set(prefix_artifacts)
-                sorted_candidates = sorted(list(candidates_for_remainder), key=sort_key)
+                prefix_artifacts_set = set(prefix_artifacts)
+                sorted_candidates = [
+                    art_id
+                    for art_id in ranked_artifacts
+                    if art_id not in prefix_artifacts_set
+                ]
                 final_artifacts.extend(sorted_candidates[:remaining_slots])
 
             return final_artifacts[:num_artifacts], best_prefix
@@ -199,5 +263,4 @@ class RagOptimizer:
         # ------------------------------------------------------------------
         # 2. No suitable prefix found -> sort all initial artifacts and return.
         # ------------------------------------------------------------------
-        fallback_sorted_artifacts = sorted(list(all_initial_artifacts), key=sort_key)
-        return fallback_sorted_artifacts, ""
+        return ranked_artifacts, ""
@@ -0,0 +1,187 @@
+import itertools
+from collections import defaultdict
+
+from dir_assistant.assistant.rag_optimizer import RagOptimizer
+
+# Weights searched by the tuner. Only weights read by the scoring function change ordering.
+# Stability is not searched because the recorded history has no file modification times,
+# so it cannot change the order of a replay. The configured stability weight is kept.
+DEFAULT_WEIGHT_GRID = {
+    "frequency": [0.0, 0.5, 1.0, 2.0, 4.0],
+    "position": [0.0, 0.5, 1.0, 2.0, 4.0],
+}
+DEFAULT_EXCLUDABLE_FACTOR_GRID = [0.0, 0.05, 0.1, 0.2, 0.3, 0.5]
+
+
+def estimate_tokens(text):
+    """A tokenizer-free estimate (about four characters per token) for offline replay."""
+    return max(1, len(text) // 4)
+
+
+class _PrefixTrieNode:
+    __slots__ = ("children", "last_used")
+
+    def __init__(self):
+        self.children = {}
+        self.last_used = float("-inf")
+
+
+class ProviderPrefixCache:
+    """
+    Simulates a provider-side prompt prefix cache. Every request's artifact sequence is
+    cached, and a later request reuses the longest previously sent prefix that has been
+    used within the TTL. Hits refresh the TTL, like provider caches do.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.root = _PrefixTrieNode()
+
+    def request(self, artifacts, timestamp):
+        """
+        Sends an artifact sequence through the cache.
+
+        Returns:
+            int: The number of leading artifacts served from the cache.
+        """
+        node = self.root
+        hit_length = 0
+        matching = True
+        for artifact in artifacts:
+            child = node.children.get(artifact)
+            if child is None:
+                child = node.children[artifact] = _PrefixTrieNode()
+            if matching and timestamp - child.last_used < self.ttl:
+                hit_length += 1
+            else:
+                matching = False
+            child.last_used = timestamp
+            node = child
+        return hit_length
+
+
+def simulate_history(
+    prompt_history,
+    weights,
+    artifact_excludable_factor,
+    api_context_cache_ttl,
+    count_tokens=estimate_tokens,
+):
+    """
+    Replays recorded prompts through a RagOptimizer and a simulated provider prefix cache.
+
+    Each prompt's recorded optimizer candidates are re-optimized with the given settings
+    using only the history that preceded it, then sent through the simulated cache at its
+    original timestamp. Prompts recorded before candidates were stored are replayed from
+    their final artifact list, in order, as the candidates.
+
+    Returns:
+        dict: prompts, hit_ratio (share of prompts with any cache hit), reused_tokens,
+            total_tokens, token_hit_ratio and relevance_loss (mean share of the most
+            relevant candidates that were swapped out).
+    """
+    optimizer = RagOptimizer(weights, artifact_excludable_factor)
+    provider_cache = ProviderPrefixCache(api_context_cache_ttl)
+    prefix_cache_metadata = {}
+    replayed_history = []
+    artifact_stats = defaultdict(lambda: {"frequency": 0, "positions": []})
+    token_counts = {}
+    prompts = hits = reused_tokens = total_tokens = 0
+    relevance_loss = 0.0
+    for entry in prompt_history:
+        timestamp = entry.get("timestamp", 0.0)
+        sent_artifacts = entry.get("artifacts", [])
+        candidates = entry.get("candidates") or [
+            (artifact, i) for i, artifact in enumerate(sent_artifacts)
+        ]
+        candidates = [tuple(candidate) for candidate in candidates]
+        if not candidates:
+            continue
+        non_expired_prefixes = {
+            prefix: metadata
+            for prefix, metadata in prefix_cache_metadata.items()
+            if timestamp - metadata["last_hit_timestamp"] < api_context_cache_ttl
+        }
+        ordered_artifacts, matched_prefix = optimizer.optimize_rag_for_caching(
+            candidates,
+            replayed_history,
+            artifact_stats,
+            non_expired_prefixes,
+        )
+        # The live context builder sends as many artifacts as fit in the token budget
+        ordered_artifacts = ordered_artifacts[: max(len(sent_artifacts), 1)]
+        hit_length = provider_cache.request(ordered_artifacts, timestamp)
+        for artifact in ordered_artifacts:
+            if artifact not in token_counts:
+                token_counts[artifact] = count_tokens(artifact)
+        prompts += 1
+        hits += 1 if hit_length else 0
+        reused_tokens += sum(token_counts[a] for a in ordered_artifacts[:hit_length])
+        total_tokens += sum(token_counts[a] for a in ordered_artifacts)
+        most_relevant = {
+            artifact for artifact, _ in candidates[: len(ordered_artifacts)]
+        }
+        kept = most_relevant.intersection(ordered_artifacts)
+        relevance_loss += 1.0 - len(kept) / len(most_relevant)
+        # Record the turn the same way BaseAssistant.run_basic_chat_stream does
+        separator = RagOptimizer.ARTIFACT_SEPARATOR
+        if matched_prefix:
+            prefix_cache_metadata[matched_prefix] = {"last_hit_timestamp": timestamp}
+        prefix_cache_metadata[separator.join(ordered_artifacts)] = {
+            "last_hit_timestamp": timestamp
+        }
+        replayed_history.append({"artifacts": ordered_artifacts})
+        for i, artifact in enumerate(ordered_artifacts):
+            artifact_stats[artifact]["frequency"] += 1
+            artifact_stats[artifact]["positions"].append(i)
+    return {
+        "prompts": prompts,
+        "hit_ratio": hits / prompts if prompts else 0.0,
+        "reused_tokens": reused_tokens,
+        "total_tokens": total_tokens,
+        "token_hit_ratio": reused_tokens / total_tokens if total_tokens else 0.0,
+        "relevance_loss": relevance_loss / prompts if prompts else 0.0,
+    }
+
+
+def tune_optimizer(
+    prompt_history,
+    base_weights,
+    api_context_cache_ttl,
+    max_relevance_loss,
+    weight_grid=None,
+    excludable_factor_grid=None,
+    count_tokens=estimate_tokens,
+):
+    """
+    Grid-searches optimizer weights and ARTIFACT_EXCLUDABLE_FACTOR for the highest simulated
+    token hit ratio whose relevance loss stays within max_relevance_loss.
+
+    Returns:
+        tuple: (best weights, best excludable factor, best simulation result), or
+            (None, None, None) if no setting satisfies the relevance bound.
+    """
+    weight_grid = weight_grid or DEFAULT_WEIGHT_GRID
+    excludable_factor_grid = excludable_factor_grid or DEFAULT_EXCLUDABLE_FACTOR_GRID
+    weight_names = list(weight_grid.keys())
+    best = (None, None, None)
+    for values in itertools.product(*(weight_grid[name] for name in weight_names)):
+        weights = dict(base_weights)
+        weights.update(zip(weight_names, values))
+        for excludable_factor in excludable_factor_grid:
+            result = simulate_history(
+                prompt_history,
+                weights,
+                excludable_factor,
+                api_context_cache_ttl,
+                count_tokens,
+            )
+            if result["relevance_loss"] > max_relevance_loss:
+                continue
+            best_result = best[2]
+            if best_result is None or (
+                result["token_hit_ratio"],
+                -result["relevance_loss"],
+            ) > (best_result["token_hit_ratio"], -best_result["relevance_loss"]):
+                best = (weights, excludable_factor, result)
+    return best
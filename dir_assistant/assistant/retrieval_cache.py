@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from dir_assistant.assistant.intent_classifier import hash_prompt
+
+MATCH_EXACT = "exact"
+
+
+def create_cache_key(*parts):
+    """Hashes the settings a retrieval depends on"""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def get_file_mtimes(filepaths):
+    mtimes = {}
+    for filepath in filepaths:
+        try:
+            mtimes[filepath] = os.path.getmtime(filepath)
+        except OSError:
+            mtimes[filepath] = None
+    return mtimes
+
+
+class RetrievalCache:
+    """
+    Caches the CGRAG guidance and retrieved artifacts of prompts, so repeated prompts and
+    retries skip the guidance completion and the searches. Entries are looked up by the
+    normalized prompt first, then by the most similar prompt embedding if it is at least
+    as similar as the similarity threshold.
+
+    An entry records the modification time of every file its guidance context and
+    artifacts came from, and is dropped when any of them changed. Sessions share a cache,
+    so its entries are only read and changed while holding its lock.
+    """
+
+    def __init__(self, store, similarity=0.98, max_entries=256):
+        """
+        Args:
+            store (IndexStore): The store entries are persisted in.
+            similarity (float): The smallest cosine similarity for reusing the entry of a
+                different prompt. Above 1, only exact prompts are reused.
+            max_entries (int): How many entries are kept per cache key.
+        """
+        self.store = store
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_entries(self, cache_key):
+        if cache_key not in self.entries:
+            self.entries[cache_key] = self.store.load_retrieval_entries(cache_key)
+        return self.entries[cache_key]
+
+    def find_entry(self, entries, prompt_hash, embedding):
+        if prompt_hash in entries:
+            return prompt_hash, MATCH_EXACT
+        if self.similarity > 1 or not entries:
+            return None, None
+        prompt_hashes = list(entries)
+        vectors = np.vstack([entries[h]["embedding"] for h in prompt_hashes])
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity:
+            return None, None
+        return prompt_hashes[best], float(similarities[best])
+
+    def lookup(self, cache_key, prompt, embedding, chunks):
+        """
+        Returns:
+            tuple: The cached guidance (None without CGRAG), the (chunk, distance)
+                neighbors and how the entry matched (MATCH_EXACT or the similarity of its
+                prompt), or None if there is no valid entry.
+        """
+        chunks_by_location = {
+            (chunk.get("filepath"), chunk.get("chunk_index")): chunk for chunk in chunks
+        }
+        with self.lock:
+            entries = self.get_entries(cache_key)
+            prompt_hash, match = self.find_entry(
+                entries, hash_prompt(prompt), embedding
+            )
+            if prompt_hash is None:
+                return None
+            entry = entries[prompt_hash]
+            neighbors = [
+                (chunks_by_location.get((filepath, chunk_index)), distance)
+                for filepath, chunk_index, distance in entry["neighbors"]
+            ]
+            if get_file_mtimes(entry["file_mtimes"]) != entry["file_mtimes"] or any(
+                chunk is None for chunk, _ in neighbors
+            ):
+                # A contributing file changed since the entry was made
+                self.remove_entry(entries, cache_key, prompt_hash)
+                return None
+            entry["last_used"] = time.time()
+            self.store.touch_retrieval_entry(cache_key, prompt_hash, entry["last_used"])
+            return entry["guidance"], neighbors, match
+
+    def save(self, cache_key, prompt, embedding, guidance, neighbors, source_files=()):
+        """
+        Args:
+            guidance (str): The CGRAG guidance, or None without CGRAG.
+            neighbors (list): The (chunk, distance) neighbors the context is built from.
+            source_files (iterable): Other files the guidance depended on.
+        """
+        if any(chunk.get("chunk_index") is None for chunk, _ in neighbors):
+            return
+        filepaths = {chunk["filepath"] for chunk, _ in neighbors} | set(source_files)
+        prompt_hash = hash_prompt(prompt)
+        entry = {
+            "embedding": np.asarray(embedding, dtype=np.float32),
+            "guidance": guidance,
+            "neighbors": [
+                (chunk["filepath"], chunk["chunk_index"], float(distance))
+                for chunk, distance in neighbors
+            ],
+            "file_mtimes": get_file_mtimes(sorted(filepaths)),
+            "last_used": time.time(),
+        }
+        with self.lock:
+            entries = self.get_entries(cache_key)
+            entries[prompt_hash] = entry
+            self.store.save_retrieval_entry(cache_key, prompt_hash, entry)
+            while len(entries) > self.max_entries:
+                oldest = min(entries, key=lambda h: entries[h]["last_used"])
+                self.remove_entry(entries, cache_key, oldest)
+
+    def remove(self, cache_key, prompt_hash):
+        with self.lock:
+            self.remove_entry(self.get_entries(cache_key), cache_key, prompt_hash)
+
+    def remove_entry(self, entries, cache_key, prompt_hash):
+        """Removes an entry while the lock is held"""
+        entries.pop(prompt_hash, None)
+        self.store.delete_retrieval_entry(cache_key, prompt_hash)
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,75 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from dir_assistant.assistant.profiler import get_profiler
+
+
+class StageTimeline:
+    """
+    Records when each stage of a turn starts and ends relative to the start of the turn.
+    Stages may run concurrently in different threads. Each stage names the stages it
+    waited for, which is used to find the critical path: the chain of stages that
+    determined when the last stage finished.
+    """
+
+    def __init__(self, start_time=None, on_record=None):
+        """
+        Args:
+            start_time (float): The perf_counter time of the start of the turn.
+            on_record (callable): Called with the name, start and end of each finished
+                stage.
+        """
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.on_record = on_record
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, depends_on=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), depends_on)
+
+    def record(self, name, start, end, depends_on=()):
+        stage = (start - self.start_time, end - self.start_time, tuple(depends_on))
+        with self.lock:
+            self.stages[name] = stage
+        profiler = get_profiler()
+        if profiler:
+            profiler.record(name, start, end, "stage")
+        if self.on_record:
+            self.on_record(name, stage[0], stage[1])
+
+    def critical_path(self):
+        """
+        Returns:
+            list: Stage names from the first stage to the last finishing stage.
+        """
+        if not self.stages:
+            return []
+        name = max(self.stages, key=lambda stage_name: self.stages[stage_name][1])
+        path = [name]
+        while True:
+            dependencies = [d for d in self.stages[name][2] if d in self.stages]
+            if not dependencies:
+                break
+            name = max(dependencies, key=lambda d: self.stages[d][1])
+            path.append(name)
+        return path[::-1]
+
+    def format(self):
+        critical_stages = set(self.critical_path())
+        name_width = max((len(name) for name in self.stages), default=0)
+        lines = ["Turn timeline (* marks the critical path):"]
+        for name, (start, end, _) in sorted(
+            self.stages.items(), key=lambda item: item[1][0]
+        ):
+            marker = "*" if name in critical_stages else " "
+            lines.append(
+                f" {marker} {name.ljust(name_width)}  {start:6.2f}s - {end:6.2f}s"
+                f"  ({end - start:.2f}s)"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,692 @@
+import atexit
+import json
+import pickle
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class SqliteStore:
+    """
+    A SQLite database with a typed schema. Writes are queued and committed by a single
+    background writer thread in batched transactions. Reads use a small pool of
+    connections so concurrent readers never share a cursor.
+    """
+
+    # Ordered schema migrations. Index i upgrades a database from user_version i to i + 1.
+    MIGRATIONS = []
+
+    def __init__(self, path: str, read_pool_size: int = 4, write_batch_size: int = 512):
+        """
+        Opens (and if needed creates or upgrades) the database.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            read_pool_size (int): Maximum number of idle read connections to keep.
+            write_batch_size (int): Maximum number of queued writes committed per transaction.
+        """
+        self.path = path
+        self.write_batch_size = write_batch_size
+        self._read_pool = queue.LifoQueue(maxsize=read_pool_size)
+        self._write_queue = queue.Queue()
+        self._closed = False
+        self._writer_connection = self._connect()
+        self._migrate(self._writer_connection)
+        self._writer = threading.Thread(
+            target=self._run_writer, name=f"sqlite-writer-{path}", daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=10,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _migrate(self, connection):
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        for target_version in range(version, len(self.MIGRATIONS)):
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in self.MIGRATIONS[target_version]:
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {target_version + 1}")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _run_writer(self):
+        while True:
+            operations = [self._write_queue.get()]
+            # Drain whatever else is already queued so it shares one transaction.
+            while len(operations) < self.write_batch_size:
+                try:
+                    operations.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in operations
+            operations = [
+                operation for operation in operations if operation is not None
+            ]
+            try:
+                if operations:
+                    self._commit_operations(operations)
+            finally:
+                for _ in range(len(operations) + (1 if stop else 0)):
+                    self._write_queue.task_done()
+            if stop:
+                return
+
+    def _commit_operations(self, operations):
+        """
+        Commits a batch of operations in one transaction. Each operation runs in its own
+        savepoint, so a failing operation is rolled back alone and fails only its caller.
+        """
+        connection = self._writer_connection
+        failed = {}
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for index, (statements, _) in enumerate(operations):
+                connection.execute("SAVEPOINT operation")
+                try:
+                    for sql, params, many in statements:
+                        if many:
+                            connection.executemany(sql, params)
+                        else:
+                            connection.execute(sql, params)
+                    connection.execute("RELEASE operation")
+                except Exception as e:
+                    if not connection.in_transaction:
+                        # SQLite aborted the whole transaction, so no operation was kept
+                        raise
+                    connection.execute("ROLLBACK TO operation")
+                    connection.execute("RELEASE operation")
+                    failed[index] = e
+            connection.execute("COMMIT")
+        except Exception as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            failed = {index: e for index in range(len(operations))}
+        for index, (_, future) in enumerate(operations):
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+
+    def write(self, *statements) -> Future:
+        """
+        Queues one or more statements to be committed together in a single transaction.
+
+        Args:
+            *statements: Tuples of (sql, params) or (sql, params_sequence, True) for executemany.
+
+        Returns:
+            Future: Resolves once the statements are committed, or fails with their error.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"Cannot write to closed store {self.path}")
+        operation = [
+            (statement[0], statement[1], len(statement) > 2 and statement[2])
+            for statement in statements
+        ]
+        future = Future()
+        self._write_queue.put((operation, future))
+        return future
+
+    def flush(self):
+        """
+        Blocks until every queued write has been committed or has failed. Failures are
+        reported by the futures returned by write().
+        """
+        self._write_queue.join()
+
+    def _acquire_reader(self):
+        try:
+            return self._read_pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release_reader(self, connection):
+        try:
+            self._read_pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def read(self, sql: str, params=()) -> list:
+        """
+        Runs a query on a pooled read connection. Pending writes are committed first so
+        reads always observe earlier writes from this process.
+
+        Args:
+            sql (str): The query to run.
+            params: Query parameters.
+
+        Returns:
+            list: All result rows.
+        """
+        if self._write_queue.unfinished_tasks:
+            self.flush()
+        connection = self._acquire_reader()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            self._release_reader(connection)
+
+    def close(self):
+        """Commits pending writes and closes all connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_queue.put(None)
+        self._writer.join()
+        self._writer_connection.close()
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+        atexit.unregister(self.close)
+
+
+class IndexStore(SqliteStore):
+    """
+    Stores file chunks and their embeddings per embedding model configuration.
+    """
+
+    MIGRATIONS = [
+        [
+            """CREATE TABLE IF NOT EXISTS indexed_files (
+                embed_config TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                PRIMARY KEY (embed_config, filepath)
+            ) WITHOUT ROWID""",
+            """CREATE TABLE IF NOT EXISTS chunks (
+                embed_config TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (embed_config, filepath, chunk_index)
+            ) WITHOUT ROWID""",
+        ],
+        [
+            """CREATE TABLE IF NOT EXISTS chunk_tokens (
+                tokenizer TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (tokenizer, text_hash)
+            ) WITHOUT ROWID""",
+        ],
+        # Labelled prompts for the edit intent classifier, embedded with each embed model
+        [
+            """CREATE TABLE IF NOT EXISTS intent_exemplars (
+                embed_config TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (embed_config, text_hash)
+            ) WITHOUT ROWID""",
+        ],
+        # CGRAG guidance and retrieved artifacts of past prompts
+        [
+            """CREATE TABLE IF NOT EXISTS retrieval_cache (
+                cache_key TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                guidance TEXT,
+                neighbors TEXT NOT NULL,
+                file_mtimes TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (cache_key, prompt_hash)
+            ) WITHOUT ROWID""",
+        ],
+        # The indexing job ledger: files that failed to index and the embeddings of
+        # files whose indexing has not finished
+        [
+            """CREATE TABLE IF NOT EXISTS index_jobs (
+                embed_config TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT NOT NULL,
+                retry_after REAL NOT NULL,
+                PRIMARY KEY (embed_config, filepath)
+            ) WITHOUT ROWID""",
+            """CREATE TABLE IF NOT EXISTS chunk_progress (
+                embed_config TEXT NOT NULL,
+                filepath TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (embed_config, filepath, text_hash)
+            ) WITHOUT ROWID""",
+        ],
+    ]
+
+    SELECT_CHUNKS = """SELECT f.filepath, f.mtime, c.chunk_index, c.text, c.tokens, c.embedding
+        FROM indexed_files f
+        LEFT JOIN chunks c ON c.embed_config = f.embed_config AND c.filepath = f.filepath
+        WHERE f.embed_config = ?
+        ORDER BY f.filepath, c.chunk_index"""
+    DELETE_FILE_CHUNKS = "DELETE FROM chunks WHERE embed_config = ? AND filepath = ?"
+    INSERT_CHUNK = """INSERT INTO chunks (embed_config, filepath, chunk_index, text, tokens, embedding)
+        VALUES (?, ?, ?, ?, ?, ?)"""
+    UPSERT_FILE = """INSERT INTO indexed_files (embed_config, filepath, mtime, chunk_count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (embed_config, filepath) DO UPDATE SET
+            mtime = excluded.mtime, chunk_count = excluded.chunk_count"""
+    SELECT_INDEX_JOBS = """SELECT filepath, mtime, attempts, error, retry_after FROM index_jobs
+        WHERE embed_config = ?"""
+    UPSERT_INDEX_JOB = """INSERT INTO index_jobs (embed_config, filepath, mtime, attempts, error,
+        retry_after) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (embed_config, filepath) DO UPDATE SET
+            mtime = excluded.mtime, attempts = excluded.attempts, error = excluded.error,
+            retry_after = excluded.retry_after"""
+    DELETE_INDEX_JOB = "DELETE FROM index_jobs WHERE embed_config = ? AND filepath = ?"
+    SELECT_CHUNK_PROGRESS = """SELECT text_hash, embedding FROM chunk_progress
+        WHERE embed_config = ? AND filepath = ?"""
+    INSERT_CHUNK_PROGRESS = """INSERT OR REPLACE INTO chunk_progress (embed_config, filepath,
+        text_hash, embedding) VALUES (?, ?, ?, ?)"""
+    DELETE_CHUNK_PROGRESS = (
+        "DELETE FROM chunk_progress WHERE embed_config = ? AND filepath = ?"
+    )
+    SELECT_TOKEN_COUNTS = (
+        "SELECT text_hash, tokens FROM chunk_tokens WHERE tokenizer = ?"
+    )
+    UPSERT_TOKEN_COUNT = """INSERT INTO chunk_tokens (tokenizer, text_hash, tokens) VALUES (?, ?, ?)
+        ON CONFLICT (tokenizer, text_hash) DO UPDATE SET tokens = excluded.tokens"""
+    SELECT_INTENT_EXEMPLARS = """SELECT text_hash, label, embedding FROM intent_exemplars
+        WHERE embed_config = ?"""
+    UPSERT_INTENT_EXEMPLAR = """INSERT INTO intent_exemplars (embed_config, text_hash, label, embedding)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (embed_config, text_hash) DO UPDATE SET
+            label = excluded.label, embedding = excluded.embedding"""
+
+    SELECT_RETRIEVAL_ENTRIES = """SELECT prompt_hash, embedding, guidance, neighbors, file_mtimes,
+        last_used FROM retrieval_cache WHERE cache_key = ?"""
+    UPSERT_RETRIEVAL_ENTRY = """INSERT INTO retrieval_cache (cache_key, prompt_hash, embedding, guidance,
+        neighbors, file_mtimes, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (cache_key, prompt_hash) DO UPDATE SET
+            embedding = excluded.embedding, guidance = excluded.guidance,
+            neighbors = excluded.neighbors, file_mtimes = excluded.file_mtimes,
+            last_used = excluded.last_used"""
+    TOUCH_RETRIEVAL_ENTRY = "UPDATE retrieval_cache SET last_used = ? WHERE cache_key = ? AND prompt_hash = ?"
+    DELETE_RETRIEVAL_ENTRY = (
+        "DELETE FROM retrieval_cache WHERE cache_key = ? AND prompt_hash = ?"
+    )
+
+    def load_chunks(self, embed_config: str) -> dict:
+        """
+        Loads every cached file's chunks and embeddings for an embedding configuration.
+
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+
+        Returns:
+            dict: {filepath: {"mtime": float, "chunks": list, "embeddings": list}}.
+        """
+        files = {}
+        for filepath, mtime, chunk_index, text, tokens, embedding in self.read(
+            self.SELECT_CHUNKS, (embed_config,)
+        ):
+            entry = files.get(filepath)
+            if entry is None:
+                entry = files[filepath] = {
+                    "mtime": mtime,
+                    "chunks": [],
+                    "embeddings": [],
+                }
+            if text is None:
+                continue  # A file that produced no chunks
+            entry["chunks"].append(
+                {
+                    "text": text,
+                    "filepath": filepath,
+                    "tokens": tokens,
+                    "chunk_index": chunk_index,
+                }
+            )
+            entry["embeddings"].append(np.frombuffer(embedding, dtype=np.float32))
+        return files
+
+    def save_file_chunks(self, embed_config, filepath, mtime, chunks, embeddings):
+        """
+        Replaces the cached chunks of a file. The replacement is committed atomically.
+
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+            filepath (str): Absolute path of the file.
+            mtime (float): Modification time of the file contents that were chunked.
+            chunks (list): Chunk dicts with "text" and "tokens" keys.
+            embeddings (list): One embedding vector per chunk.
+
+        Returns:
+            Future: Resolves once the chunks are committed, or fails with their error.
+        """
+        rows = [
+            (
+                embed_config,
+                filepath,
+                i,
+                chunk["text"],
+                chunk.get("tokens", 0),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+        ]
+        return self.write(
+            (self.DELETE_FILE_CHUNKS, (embed_config, filepath)),
+            (self.INSERT_CHUNK, rows, True),
+            (self.UPSERT_FILE, (embed_config, filepath, mtime, len(rows))),
+            # The file is done, so its ledger entries are no longer needed
+            (self.DELETE_INDEX_JOB, (embed_config, filepath)),
+            (self.DELETE_CHUNK_PROGRESS, (embed_config, filepath)),
+        )
+
+    def load_index_jobs(self, embed_config: str) -> dict:
+        """
+        Loads the files that failed to index with an embedding configuration.
+
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+
+        Returns:
+            dict: {filepath: {"mtime": float, "attempts": int, "error": str,
+                "retry_after": float}}.
+        """
+        return {
+            filepath: {
+                "mtime": mtime,
+                "attempts": attempts,
+                "error": error,
+                "retry_after": retry_after,
+            }
+            for filepath, mtime, attempts, error, retry_after in self.read(
+                self.SELECT_INDEX_JOBS, (embed_config,)
+            )
+        }
+
+    def save_index_job(self, embed_config, filepath, job):
+        self.write(
+            (
+                self.UPSERT_INDEX_JOB,
+                (
+                    embed_config,
+                    filepath,
+                    job["mtime"],
+                    job["attempts"],
+                    job["error"],
+                    job["retry_after"],
+                ),
+            )
+        )
+
+    def load_chunk_progress(self, embed_config: str, filepath: str) -> dict:
+        """
+        Loads the embeddings saved while a file was indexed, before it finished.
+
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+            filepath (str): Absolute path of the file.
+
+        Returns:
+            dict: {text_hash: embedding}.
+        """
+        return {
+            text_hash: np.frombuffer(embedding, dtype=np.float32)
+            for text_hash, embedding in self.read(
+                self.SELECT_CHUNK_PROGRESS, (embed_config, filepath)
+            )
+        }
+
+    def save_chunk_progress(self, embed_config, filepath, embeddings):
+        """
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+            filepath (str): Absolute path of the file.
+            embeddings (dict): {text_hash: embedding} of chunks of the file.
+        """
+        rows = [
+            (
+                embed_config,
+                filepath,
+                text_hash,
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+            )
+            for text_hash, embedding in embeddings.items()
+        ]
+        self.write((self.INSERT_CHUNK_PROGRESS, rows, True))
+
+    def load_token_counts(self, tokenizer: str) -> dict:
+        """
+        Loads every cached chunk token count for an LLM tokenizer.
+
+        Args:
+            tokenizer (str): Identifier of the LLM tokenizer.
+
+        Returns:
+            dict: {text_hash: tokens}.
+        """
+        return dict(self.read(self.SELECT_TOKEN_COUNTS, (tokenizer,)))
+
+    def save_token_count(self, tokenizer: str, text_hash: str, tokens: int):
+        self.write((self.UPSERT_TOKEN_COUNT, (tokenizer, text_hash, tokens)))
+
+    def load_intent_exemplars(self, embed_config: str) -> dict:
+        """
+        Loads the labelled intent exemplars embedded with an embedding configuration.
+
+        Args:
+            embed_config (str): Hash of the embedding model configuration.
+
+        Returns:
+            dict: {text_hash: (label, embedding)}.
+        """
+        return {
+            text_hash: (bool(label), np.frombuffer(embedding, dtype=np.float32))
+            for text_hash, label, embedding in self.read(
+                self.SELECT_INTENT_EXEMPLARS, (embed_config,)
+            )
+        }
+
+    def save_intent_exemplar(self, embed_config, text_hash, label, embedding):
+        self.write(
+            (
+                self.UPSERT_INTENT_EXEMPLAR,
+                (
+                    embed_config,
+                    text_hash,
+                    int(label),
+                    np.asarray(embedding, dtype=np.float32).tobytes(),
+                ),
+            )
+        )
+
+    def load_retrieval_entries(self, cache_key: str) -> dict:
+        """
+        Loads the cached retrievals of a retrieval configuration.
+
+        Args:
+            cache_key (str): Hash of the index, model and retrieval settings.
+
+        Returns:
+            dict: {prompt_hash: {"embedding": array, "guidance": str or None,
+                "neighbors": [(filepath, chunk_index, distance)],
+                "file_mtimes": {filepath: mtime}, "last_used": float}}.
+        """
+        return {
+            prompt_hash: {
+                "embedding": np.frombuffer(embedding, dtype=np.float32),
+                "guidance": guidance,
+                "neighbors": [tuple(neighbor) for neighbor in json.loads(neighbors)],
+                "file_mtimes": json.loads(file_mtimes),
+                "last_used": last_used,
+            }
+            for prompt_hash, embedding, guidance, neighbors, file_mtimes, last_used in (
+                self.read(self.SELECT_RETRIEVAL_ENTRIES, (cache_key,))
+            )
+        }
+
+    def save_retrieval_entry(self, cache_key, prompt_hash, entry):
+        self.write(
+            (
+                self.UPSERT_RETRIEVAL_ENTRY,
+                (
+                    cache_key,
+                    prompt_hash,
+                    np.asarray(entry["embedding"], dtype=np.float32).tobytes(),
+                    entry["guidance"],
+                    json.dumps(entry["neighbors"]),
+                    json.dumps(entry["file_mtimes"]),
+                    entry["last_used"],
+                ),
+            )
+        )
+
+    def touch_retrieval_entry(self, cache_key, prompt_hash, last_used):
+        self.write((self.TOUCH_RETRIEVAL_ENTRY, (last_used, cache_key, prompt_hash)))
+
+    def delete_retrieval_entry(self, cache_key, prompt_hash):
+        self.write((self.DELETE_RETRIEVAL_ENTRY, (cache_key, prompt_hash)))
+
+
+class PrefixCacheStore(SqliteStore):
+    """
+    Stores artifact prefixes that were recently sent to the LLM and when they were last hit.
+    """
+
+    MIGRATIONS = [
+        [
+            """CREATE TABLE IF NOT EXISTS prefixes (
+                prefix TEXT PRIMARY KEY,
+                last_hit_timestamp REAL NOT NULL
+            ) WITHOUT ROWID""",
+            "CREATE INDEX IF NOT EXISTS prefixes_by_last_hit ON prefixes (last_hit_timestamp)",
+        ],
+        # Provider-reported cache hits and misses when the prefix was reused
+        [
+            "ALTER TABLE prefixes ADD COLUMN hits INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE prefixes ADD COLUMN misses INTEGER NOT NULL DEFAULT 0",
+        ],
+    ]
+
+    SELECT_SINCE = """SELECT prefix, last_hit_timestamp, hits, misses FROM prefixes
+        WHERE last_hit_timestamp > ?"""
+    DELETE_BEFORE = "DELETE FROM prefixes WHERE last_hit_timestamp <= ?"
+    UPSERT_PREFIX = """INSERT INTO prefixes (prefix, last_hit_timestamp) VALUES (?, ?)
+        ON CONFLICT (prefix) DO UPDATE SET last_hit_timestamp = excluded.last_hit_timestamp"""
+    UPSERT_PREFIX_RESULT = """INSERT INTO prefixes (prefix, last_hit_timestamp, hits, misses)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (prefix) DO UPDATE SET
+            last_hit_timestamp = excluded.last_hit_timestamp,
+            hits = hits + excluded.hits,
+            misses = misses + excluded.misses"""
+
+    def get_prefixes_since(self, timestamp: float) -> dict:
+        return {
+            prefix: {"last_hit_timestamp": last_hit, "hits": hits, "misses": misses}
+            for prefix, last_hit, hits, misses in self.read(
+                self.SELECT_SINCE, (timestamp,)
+            )
+        }
+
+    def delete_prefixes_before(self, timestamp: float):
+        self.write((self.DELETE_BEFORE, (timestamp,)))
+
+    def set_prefix_hit(self, prefix: str, timestamp: float):
+        return self.write((self.UPSERT_PREFIX, (prefix, timestamp)))
+
+    def record_prefix_result(self, prefix: str, timestamp: float, hit: bool):
+        self.write(
+            (
+                self.UPSERT_PREFIX_RESULT,
+                (prefix, timestamp, 1 if hit else 0, 0 if hit else 1),
+            )
+        )
+
+
+class PromptHistoryStore(SqliteStore):
+    """
+    Stores every prompt sent to the LLM along with the ordered artifacts it included.
+    """
+
+    MIGRATIONS = [
+        [
+            """CREATE TABLE IF NOT EXISTS prompt_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL NOT NULL,
+                prompt TEXT NOT NULL,
+                artifacts TEXT NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS prompt_history_by_timestamp ON prompt_history (timestamp)",
+        ],
+        # The (artifact, distance) candidates given to the optimizer, for offline replay
+        ["ALTER TABLE prompt_history ADD COLUMN candidates TEXT"],
+    ]
+
+    SELECT_ALL = """SELECT timestamp, prompt, artifacts, candidates FROM prompt_history
+        ORDER BY timestamp, id"""
+    SELECT_ARTIFACTS = "SELECT artifacts FROM prompt_history"
+    INSERT_PROMPT = """INSERT INTO prompt_history (timestamp, prompt, artifacts, candidates)
+        VALUES (?, ?, ?, ?)"""
+
+    def add_prompt(
+        self, timestamp: float, prompt: str, artifacts: list, candidates: list = None
+    ):
+        return self.write(
+            (
+                self.INSERT_PROMPT,
+                (
+                    timestamp,
+                    prompt,
+                    json.dumps(artifacts),
+                    None if candidates is None else json.dumps(candidates),
+                ),
+            )
+        )
+
+    def get_prompts(self) -> list:
+        return [
+            {
+                "timestamp": timestamp,
+                "prompt": prompt,
+                "artifacts": json.loads(artifacts),
+                "candidates": None if candidates is None else json.loads(candidates),
+            }
+            for timestamp, prompt, artifacts, candidates in self.read(self.SELECT_ALL)
+        ]
+
+    def iter_artifact_lists(self):
+        for (artifacts,) in self.read(self.SELECT_ARTIFACTS):
+            yield json.loads(artifacts)
+
+
+def read_legacy_sqlitedict(path):
+    """
+    Reads every entry of a cache file written by SqliteDict without depending on it.
+
+    Args:
+        path (str): Path to the legacy SqliteDict database.
+
+    Returns:
+        list: A list of (key, value) tuples.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute('SELECT key, value FROM "unnamed"').fetchall()
+    finally:
+        connection.close()
+    return [(key, pickle.loads(bytes(value))) for key, value in rows]
@@ -0,0 +1,121 @@
+import time
+
+# How many characters at the start of a response are checked for the thinking start pattern
+THINKING_START_WINDOW = 20
+
+
+def remove_thinking(content, start_pattern, end_pattern):
+    """
+    Removes every thinking block from a response in one pass. An unclosed block removes
+    the rest of the response.
+    """
+    if not start_pattern:
+        return content
+    parts = []
+    position = 0
+    while True:
+        start_index = content.find(start_pattern, position)
+        if start_index == -1:
+            parts.append(content[position:])
+            break
+        parts.append(content[position:start_index])
+        end_index = content.find(end_pattern, start_index)
+        if end_index == -1:
+            break
+        position = end_index + len(end_pattern)
+    return "".join(parts)
+
+
+class ThinkingFilter:
+    """
+    Hides the thinking at the start of a streamed response. A response is treated as
+    thinking if its first characters contain the start pattern, and is shown from the
+    end pattern onwards. Each delta is handled in time proportional to its length, and
+    patterns split across deltas are still found.
+    """
+
+    DETECTING = "detecting"
+    THINKING = "thinking"
+    VISIBLE = "visible"
+
+    def __init__(self, start_pattern, end_pattern, enabled=True):
+        self.start_pattern = start_pattern
+        self.end_pattern = end_pattern
+        self.state = self.DETECTING if enabled and start_pattern else self.VISIBLE
+        self.buffer = ""
+
+    def feed(self, delta):
+        """
+        Returns:
+            str: The part of the response that can be shown after this delta.
+        """
+        if self.state == self.VISIBLE:
+            return delta
+        self.buffer += delta
+        if self.state == self.DETECTING:
+            if len(self.buffer) <= len(self.start_pattern) + THINKING_START_WINDOW:
+                return ""
+            start_index = self.buffer.find(self.start_pattern)
+            if start_index == -1:
+                return self.show_buffer()
+            self.state = self.THINKING
+            self.buffer = self.buffer[start_index + len(self.start_pattern) :]
+        end_index = self.buffer.find(self.end_pattern)
+        if end_index == -1:
+            # Only the end of the thinking can still be part of a split end pattern
+            keep = len(self.end_pattern) - 1
+            self.buffer = self.buffer[-keep:] if keep else ""
+            return ""
+        self.buffer = self.buffer[end_index + len(self.end_pattern) :]
+        return self.show_buffer()
+
+    def show_buffer(self):
+        self.state = self.VISIBLE
+        visible, self.buffer = self.buffer, ""
+        return visible
+
+    def finish(self):
+        """
+        Returns:
+            str: The part of a short response that was held back to check for thinking.
+        """
+        if self.state != self.DETECTING:
+            return ""
+        visible = remove_thinking(self.buffer, self.start_pattern, self.end_pattern)
+        self.state = self.VISIBLE
+        self.buffer = ""
+        return visible
+
+
+class TerminalWriter:
+    """
+    Writes streamed text in frames. Text is collected and written with one pair of color
+    codes and one flush at most max_fps times per second.
+    """
+
+    def __init__(self, stream, color_prefix="", color_suffix="", max_fps=30):
+        self.stream = stream
+        self.color_prefix = color_prefix
+        self.color_suffix = color_suffix
+        self.frame_seconds = 1.0 / max_fps if max_fps else 0.0
+        self.pending = []
+        self.last_flush_time = None
+
+    def write(self, text):
+        self.pending.append(text)
+        now = time.perf_counter()
+        # The first text is shown right away, so the time to first token is not delayed
+        if (
+            self.last_flush_time is None
+            or now - self.last_flush_time >= self.frame_seconds
+        ):
+            self.flush(now)
+
+    def flush(self, now=None):
+        if self.pending:
+            self.stream.write(
+                f"{self.color_prefix}{''.join(self.pending)}{self.color_suffix}"
+            )
+            self.stream.flush()
+            self.pending = []
+        self.last_flush_time = time.perf_counter() if now is None else now
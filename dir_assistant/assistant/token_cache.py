@@ -0,0 +1,61 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Token counts kept in memory. The least recently used count is dropped beyond this.
+TOKEN_COUNT_MEMO_SIZE = 4096
+
+
+class TokenCountCache:
+    """
+    Caches the token counts of context chunks for one LLM tokenizer. Recent counts are kept
+    in memory by text hash and, when a store and tokenizer ID are given, persisted next to
+    the chunks in the index cache so each chunk is tokenized once per tokenizer across
+    sessions. Sessions share a cache, so counts are looked up while holding its lock.
+    """
+
+    def __init__(
+        self,
+        count_tokens,
+        tokenizer_id=None,
+        store=None,
+        max_counts=TOKEN_COUNT_MEMO_SIZE,
+    ):
+        """
+        Args:
+            count_tokens (callable): Counts the tokens of a text with the LLM tokenizer.
+            tokenizer_id (str): Identifies the tokenizer. Counts are only persisted if set.
+            store (IndexStore): The store the counts are persisted in.
+            max_counts (int): How many recent counts are kept in memory.
+        """
+        self.count_tokens = count_tokens
+        self.tokenizer_id = tokenizer_id
+        self.store = store if tokenizer_id else None
+        self.max_counts = max_counts
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+        self.persisted_counts = (
+            self.store.load_token_counts(tokenizer_id) if self.store else {}
+        )
+
+    def count(self, text):
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            tokens = self.counts.get(text_hash)
+            if tokens is not None:
+                self.counts.move_to_end(text_hash)
+                return tokens
+        tokens = self.persisted_counts.get(text_hash)
+        if tokens is None:
+            tokens = self.count_tokens(text)
+            if self.store:
+                self.store.save_token_count(self.tokenizer_id, text_hash, tokens)
+        with self.lock:
+            self.counts[text_hash] = tokens
+            while len(self.counts) > self.max_counts:
+                self.counts.popitem(last=False)
+        return tokens
+
+    def close(self):
+        if self.store:
+            self.store.close()
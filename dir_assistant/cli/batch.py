@@ -0,0 +1,169 @@
+import json
+import sys
+import threading
+
+from wove import weave
+
+from dir_assistant.assistant.events import get_usage_counts
+
+
+def read_batch_items(lines):
+    """
+    Reads the prompts of a batch from JSON lines. Each line is an object with a "prompt"
+    and an optional "id". Blank lines are skipped.
+
+    Returns:
+        list: The items in input order. An item that cannot be answered has an "error".
+    """
+    items = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        item = {"position": len(items), "line": line_number, "id": None, "error": None}
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            item["error"] = f"The line is not valid JSON: {e}"
+        else:
+            if not isinstance(request, dict):
+                item["error"] = "The line must be a JSON object"
+            else:
+                item["id"] = request.get("id")
+                item["prompt"] = request.get("prompt")
+                if not isinstance(item["prompt"], str) or not item["prompt"].strip():
+                    item["error"] = "'prompt' must be a non-empty string"
+        items.append(item)
+    return items
+
+
+def create_batch_result(item, answer=None, sources=None, usage=None, error=None):
+    return {
+        "line": item["line"],
+        "id": item["id"],
+        "answer": answer,
+        "sources": sources or [],
+        "usage": usage,
+        "error": error,
+    }
+
+
+class OrderedResultWriter:
+    """
+    Writes results as JSON lines in input order. A result is held until the results before
+    it are written. Results may be written from several threads.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = {}
+        self.next_position = 0
+        self.written = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def write(self, position, result):
+        with self.lock:
+            self.pending[position] = result
+            while self.next_position in self.pending:
+                result = self.pending.pop(self.next_position)
+                self.stream.write(json.dumps(result, default=str) + "\n")
+                self.next_position += 1
+                self.written += 1
+                if result["error"] is not None:
+                    self.failed += 1
+            self.stream.flush()
+
+
+def answer_batch_item(llm, item):
+    """Answers the prompt of an item in its own session. Errors are returned in the result."""
+    try:
+        session = llm.create_session()
+        answer = session.run_stream_processes(item["prompt"], one_off=True)
+        return create_batch_result(
+            item,
+            answer,
+            session.get_context_sources(),
+            get_usage_counts(session.last_completion_usage),
+        )
+    except Exception as e:
+        return create_batch_result(item, error=f"{type(e).__name__}: {e}")
+
+
+def run_batch(llm, items, writer, concurrency=1, max_requests_per_minute=None):
+    """
+    Answers the items of a batch. The prompts are embedded and searched together before
+    their completions run, up to concurrency at a time.
+    """
+    answerable_items = []
+    for item in items:
+        if item["error"] is None:
+            answerable_items.append(item)
+        else:
+            writer.write(
+                item["position"], create_batch_result(item, error=item["error"])
+            )
+    try:
+        llm.prefetch_retrieval([item["prompt"] for item in answerable_items])
+    except Exception as e:
+        # Each prompt is then embedded and searched when it is answered
+        sys.stderr.write(
+            f"Batched retrieval failed, retrieving each prompt separately: {e}\n"
+        )
+        sys.stderr.flush()
+    if not llm.concurrent_completions:
+        concurrency = 1
+    show_progress = sys.stderr.isatty()
+    with weave() as w:
+
+        @w.do(
+            answerable_items,
+            workers=concurrency,
+            limit_per_minute=max_requests_per_minute,
+        )
+        def answers(item):
+            writer.write(item["position"], answer_batch_item(llm, item))
+            if show_progress:
+                sys.stderr.write(f"\rFinished {writer.written} of {len(items)} prompts")
+                sys.stderr.flush()
+
+    if show_progress and answerable_items:
+        sys.stderr.write("\n")
+    # Answers never raise, so this is an error writing the results
+    if w.result.exception:
+        raise w.result.exception
+
+
+def batch(args, config_dict):
+    """Answers the prompts of a JSON lines file with one index and writes JSON lines results"""
+    from dir_assistant.cli.start import initialize_llm
+
+    config = config_dict["DIR_ASSISTANT"]
+    # Answers are only written to the results, and files are never changed
+    config["NO_COLOR"] = True
+    config["VERBOSE"] = False
+    config["PRINT_CGRAG"] = False
+    config["COMMIT_TO_GIT"] = False
+    args.single_prompt = None
+    if args.input == "-":
+        items = read_batch_items(sys.stdin)
+    else:
+        with open(args.input, "r") as input_file:
+            items = read_batch_items(input_file)
+    concurrency = args.concurrency or config["BATCH_CONCURRENCY"]
+    max_requests_per_minute = (
+        args.max_requests_per_minute or config["BATCH_MAX_REQUESTS_PER_MINUTE"]
+    )
+    llm = initialize_llm(args, config, chat_mode=False)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    writer = OrderedResultWriter(output)
+    try:
+        run_batch(llm, items, writer, concurrency, max_requests_per_minute)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        llm.close()
+    sys.stderr.write(
+        f"Answered {writer.written - writer.failed} of {len(items)} prompts"
+        f"{f', {writer.failed} failed' if writer.failed else ''}.\n"
+    )
+    sys.stderr.flush()
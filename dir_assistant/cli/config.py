@@ -1,19 +1,23 @@
+from copy import deepcopy
 from os import environ, getenv, makedirs
-from os.path import expanduser, join
+from os.path import exists, expanduser, join
 from platform import system
 from subprocess import run
 
 import toml
-from dynaconf import Dynaconf
 
 VERSION = "1.9.1"
 CONFIG_FILENAME = "config.toml"
 CONFIG_PATH = join(expanduser("~"), ".config", "dir-assistant")
 STORAGE_PATH = join(expanduser("~"), ".local", "share", "dir-assistant")
 CACHE_PATH = join(expanduser("~"), ".cache", "dir-assistant")
-INDEX_CACHE_FILENAME = "index_cache.sqlite"
-PREFIX_CACHE_FILENAME = "prefix_cache.sqlite"
-PROMPT_HISTORY_FILENAME = "prompt_history.sqlite"
+INDEX_CACHE_FILENAME = "index_cache.db"
+PREFIX_CACHE_FILENAME = "prefix_cache.db"
+PROMPT_HISTORY_FILENAME = "prompt_history.db"
+# SqliteDict caches written by dir-assistant 1.9.x and earlier. Use 'dir-assistant migrate' to convert them.
+LEGACY_INDEX_CACHE_FILENAME = "index_cache.sqlite"
+LEGACY_PREFIX_CACHE_FILENAME = "prefix_cache.sqlite"
+LEGACY_PROMPT_HISTORY_FILENAME = "prompt_history.sqlite"
 HISTORY_FILENAME = "history.pth"  # pth = prompt toolkit history
 CONFIG_DEFAULTS = {
     "SYSTEM_INSTRUCTIONS": "You are a helpful AI assistant.",
@@ -31,6 +35,9 @@ CONFIG_DEFAULTS = {
     "ARTIFACT_COSINE_CUTOFF": 0.3,
     "ARTIFACT_COSINE_CGRAG_CUTOFF": 0.0,
     "API_CONTEXT_CACHE_TTL": 3600,  # 1 hour
+    # "per_turn" puts each turn's files in its user message, "stable_block" keeps them in
+    # one append-only message after the system prompt so prompt prefix caches stay valid
+    "CONTEXT_LAYOUT": "per_turn",
     "RAG_OPTIMIZER_WEIGHTS": {
         "frequency": 1.0,  # how much to value artifacts that appear frequently in past prompts
         "position": 1.0,  # how much to penalize artifacts for appearing later in past prompts
@@ -43,7 +50,20 @@ CONFIG_DEFAULTS = {
     "OUTPUT_ACCEPTANCE_RETRIES": 1,
     "USE_CGRAG": True,
     "PRINT_CGRAG": False,
+    # Search the CGRAG guidance while it streams and cut it off once the context is stable
+    "CGRAG_STREAMING": False,
+    "CGRAG_STREAMING_BATCH_SIZE": 5,  # guidance items searched together
+    "CGRAG_STREAMING_MAX_TOKENS": 0,  # stop the guidance after this many tokens, 0 for no limit
+    "CGRAG_STREAMING_MAX_SECONDS": 0,  # stop the guidance after this many seconds, 0 for no limit
+    # Reuse the guidance and retrieved files of repeated prompts until one of the files changes
+    "RETRIEVAL_CACHE": True,
+    # How similar a different prompt must be to reuse its retrieval, above 1 for exact prompts only
+    "RETRIEVAL_CACHE_SIMILARITY": 0.98,
     "COMMIT_TO_GIT": False,
+    # How file changes are written when COMMIT_TO_GIT is on: "full_file", "search_replace", or "unified_diff"
+    "GIT_EDIT_FORMAT": "full_file",
+    # How clearly a prompt must resemble edit or question examples to skip asking the LLM
+    "GIT_INTENT_MARGIN": 0.03,
     "VERBOSE": False,
     "NO_COLOR": False,
     "HIDE_THINKING": True,
@@ -63,6 +83,13 @@ CONFIG_DEFAULTS = {
         "rope_scaling_type": 2,
         "rope_freq_scale": 0.75,
     },
+    # Sizes in MB of the cache of evaluated prompt states, in memory and on disk (0 disables)
+    "LLAMA_CPP_STATE_CACHE_SIZE": 2048,
+    "LLAMA_CPP_STATE_DISK_CACHE_SIZE": 0,
+    # Speculative decoding for the local LLM: "off", "prompt_lookup", or "draft_model"
+    "LLAMA_CPP_DRAFT_DECODING": "off",
+    "LLAMA_CPP_DRAFT_MODEL": "",  # A small GGUF in MODELS_PATH sharing the LLM's vocabulary
+    "LLAMA_CPP_DRAFT_TOKENS": 10,
     "LLAMA_CPP_COMPLETION_OPTIONS": {
         "frequency_penalty": 1.1,
     },
@@ -70,6 +97,7 @@ CONFIG_DEFAULTS = {
     "LITELLM_EMBED_CONTEXT_SIZE": 2_000,
     "LITELLM_MODEL_USES_SYSTEM_MESSAGE": False,
     "LITELLM_PASS_THROUGH_CONTEXT_SIZE": False,
+    "LITELLM_PROMPT_CACHING": True,  # add cache breakpoints and read cached token usage
     "LITELLM_EMBED_REQUEST_DELAY": 0,
     "LITELLM_API_KEYS": {
         "GEMINI_API_KEY": "",
@@ -95,6 +123,11 @@ CONFIG_DEFAULTS = {
     "INDEX_MAX_FILES_PER_MINUTE": 100_000_000,
     "INDEX_CHUNK_WORKERS": 20,
     "INDEX_MAX_CHUNK_REQUESTS_PER_MINUTE": 100_000_000,
+    # Start the chat before every file is embedded and index the rest in the background
+    "INDEX_IN_BACKGROUND": True,
+    # Prompts of 'dir-assistant batch' answered at the same time, and the rate they start at
+    "BATCH_CONCURRENCY": 8,
+    "BATCH_MAX_REQUESTS_PER_MINUTE": 100_000_000,
 }
 
 
@@ -149,10 +182,12 @@ def coerce_setting_string_value(value_str):
 
 
 def load_config(skip_environment_vars=False):
-    config_object = Dynaconf(
-        settings_files=[get_file_path(CONFIG_PATH, CONFIG_FILENAME)]
-    )
+    from dynaconf import Dynaconf
+
+    config_file_path = get_file_path(CONFIG_PATH, CONFIG_FILENAME)
+    config_object = Dynaconf(settings_files=[config_file_path])
     config_dict = config_object.as_dict()
+    loaded_config_dict = deepcopy(config_dict)
     # If the config file is malformed, insert the DIR_ASSISTANT key
     if "DIR_ASSISTANT" not in config_dict.keys():
         config_dict["DIR_ASSISTANT"] = {}
@@ -160,7 +195,9 @@ def load_config(skip_environment_vars=False):
     config_dict["DIR_ASSISTANT"] = check_defaults(
         config_dict["DIR_ASSISTANT"], CONFIG_DEFAULTS
     )
-    save_config(config_dict)
+    # Only rewrite the config file when it is missing or gained default options
+    if config_dict != loaded_config_dict or not exists(config_file_path):
+        save_config(config_dict)
     # Set any env-overridden config values
     config_dict = set_environment_overrides(config_dict)
     # Set LiteLLM API keys only if not already set in environment
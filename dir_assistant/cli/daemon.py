@@ -0,0 +1,337 @@
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from dir_assistant.assistant.events import JsonEventWriter
+from dir_assistant.cli.config import CACHE_PATH, get_file_path
+
+DAEMONS_PATH = os.path.join(CACHE_PATH, "daemons")
+# Seconds a client waits for a daemon to accept a connection before running in-process
+CONNECT_TIMEOUT = 0.5
+
+
+def get_daemon_paths(directory="."):
+    """
+    Returns:
+        tuple: The socket and log file paths of the daemon of a project directory.
+    """
+    project_hash = hashlib.sha256(
+        os.path.abspath(directory).encode("utf-8")
+    ).hexdigest()[:16]
+    return (
+        get_file_path(DAEMONS_PATH, f"{project_hash}.sock"),
+        get_file_path(DAEMONS_PATH, f"{project_hash}.log"),
+    )
+
+
+def get_config_hash(config):
+    """
+    Returns:
+        str: A hash of the loaded configuration. A daemon only answers clients that loaded
+            the same configuration.
+    """
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def request_daemon(socket_path, request, timeout=CONNECT_TIMEOUT):
+    """
+    Sends a request to a daemon and yields the events it answers with.
+
+    Raises:
+        OSError: If no daemon is listening on the socket.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        # Answers may take as long as the LLM does
+        connection.settimeout(None)
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with connection.makefile("r", encoding="utf-8") as events:
+            for line in events:
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+
+def run_prompt_with_daemon(args, socket_path, config_hash, stdout=sys.stdout):
+    """
+    Answers a single prompt with the project's daemon and writes the answer the way an
+    in-process run would.
+
+    Returns:
+        bool: False if no daemon could answer, so the prompt should run in-process.
+    """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return False
+    request = {
+        "command": "prompt",
+        "prompt": args.single_prompt,
+        "ignore": args.ignore or [],
+        "dirs": args.dirs or [],
+        "config": config_hash,
+    }
+    answered = False
+    try:
+        for event in request_daemon(socket_path, request):
+            if event["event"] == "error" and not answered:
+                # The daemon serves another configuration, or could not answer
+                if not args.json_events:
+                    sys.stderr.write(f"Not using the daemon: {event['message']}\n")
+                return False
+            answered = True
+            if event["event"] == "error" and not args.json_events:
+                sys.stderr.write(f"{event['message']}\n")
+                sys.exit(1)
+            if args.json_events:
+                stdout.write(json.dumps(event) + "\n")
+            elif event["event"] == "token" and args.stream:
+                stdout.write(event["text"])
+            elif event["event"] == "done":
+                if not args.stream:
+                    stdout.write(event["answer"])
+                stdout.write("\n")
+            stdout.flush()
+    except OSError:
+        if answered:
+            raise
+        return False
+    return answered
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        writer = JsonEventWriter(SocketTextStream(self.wfile))
+        try:
+            self.server.daemon.handle_request(request, writer)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            writer.write_event("error", message=f"{type(e).__name__}: {e}")
+
+
+class SocketTextStream:
+    """Writes text to the binary stream of a socket"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text.encode("utf-8"))
+
+    def flush(self):
+        self.stream.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class AssistantDaemon:
+    """
+    Keeps an assistant, its index and its models loaded for a project directory and
+    answers single prompts sent over a Unix socket. Prompts are answered one at a time,
+    each with a fresh chat history.
+    """
+
+    def __init__(
+        self, llm, socket_path, config_hash=None, ignore_paths=(), extra_dirs=()
+    ):
+        self.llm = llm
+        self.socket_path = socket_path
+        self.config_hash = config_hash
+        self.ignore_paths = list(ignore_paths)
+        self.extra_dirs = list(extra_dirs)
+        self.start_time = time.time()
+        self.prompts = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def serve(self):
+        # A socket left behind by a daemon that did not stop cleanly
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = DaemonServer(self.socket_path, DaemonRequestHandler)
+        self.server.daemon = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle_request(self, request, writer):
+        command = request.get("command")
+        if command == "status":
+            writer.write_event("status", **self.get_status())
+        elif command == "stop":
+            writer.write_event("stopping", pid=os.getpid())
+            # shutdown waits for serve_forever, so it cannot run in this request's thread
+            threading.Thread(target=self.server.shutdown).start()
+        elif command == "prompt":
+            if (
+                request.get("ignore", []) != self.ignore_paths
+                or request.get("dirs", []) != self.extra_dirs
+            ):
+                writer.write_event(
+                    "error",
+                    message="The daemon was started with other ignored paths or "
+                    "directories",
+                )
+                return
+            if request.get("config") != self.config_hash:
+                writer.write_event(
+                    "error",
+                    message="The daemon was started before the configuration "
+                    "changed. Restart it with 'dir-assistant daemon stop' and "
+                    "'dir-assistant daemon start'",
+                )
+                return
+            self.answer_prompt(request["prompt"], writer)
+        else:
+            writer.write_event("error", message=f"Unknown command {command}")
+
+    def answer_prompt(self, prompt, writer):
+        with self.lock:
+            self.llm.turn_start_time = time.perf_counter()
+            self.llm.initialize_history()
+            self.llm.event_writer = writer
+            self.llm.stream_output = True
+            try:
+                self.llm.run_stream_processes(prompt, one_off=True)
+            finally:
+                self.llm.event_writer = None
+                self.llm.stream_output = False
+                self.llm.turn_start_time = None
+            self.prompts += 1
+
+    def get_status(self):
+        return {
+            "pid": os.getpid(),
+            "directory": os.getcwd(),
+            "uptime": time.time() - self.start_time,
+            "prompts": self.prompts,
+            "files": len({chunk["filepath"] for chunk in self.llm.chunks}),
+            "chunks": len(self.llm.chunks),
+            "model": self.llm.get_tokenizer_id(),
+        }
+
+
+def daemon_run(args, config_dict):
+    """Runs the daemon of the current directory in the foreground"""
+    from dir_assistant.assistant.file_watcher import start_file_watcher
+    from dir_assistant.cli.start import initialize_llm
+
+    socket_path, _ = get_daemon_paths()
+    config = config_dict["DIR_ASSISTANT"]
+    # The daemon answers like single prompt mode
+    config["NO_COLOR"] = True
+    config["VERBOSE"] = False
+    config["PRINT_CGRAG"] = False
+    config["COMMIT_TO_GIT"] = False
+    args.single_prompt = None
+    # Hashed before the LLM is initialized, as single prompt clients do
+    config_hash = get_config_hash(config)
+    llm = initialize_llm(args, config, chat_mode=False)
+    ignore_paths = list(args.ignore or [])
+    watcher = start_file_watcher(
+        ".",
+        llm.embed,
+        ignore_paths + config["GLOBAL_IGNORES"],
+        (
+            config["LITELLM_EMBED_CONTEXT_SIZE"]
+            if not config["ACTIVE_EMBED_IS_LOCAL"]
+            else llm.embed.get_chunk_size()
+        ),
+        llm.update_index_and_chunks,
+    )
+    daemon = AssistantDaemon(
+        llm, socket_path, config_hash, ignore_paths, args.dirs or []
+    )
+    sys.stdout.write(f"dir-assistant daemon listening on {socket_path}\n")
+    sys.stdout.flush()
+    try:
+        daemon.serve()
+    finally:
+        watcher.stop()
+        llm.close()
+
+
+def daemon_start(args, config_dict):
+    socket_path, log_path = get_daemon_paths()
+    if not hasattr(socket, "AF_UNIX"):
+        sys.stdout.write("The daemon needs Unix sockets, which this platform lacks.\n")
+        return
+    if get_daemon_status(socket_path):
+        sys.stdout.write("The daemon is already running for this directory.\n")
+        return
+    command = [sys.executable, "-m", "dir_assistant.main", "daemon", "run"]
+    if args.ignore:
+        command += ["--ignore", *args.ignore]
+    if args.dirs:
+        command += ["--dirs", *args.dirs]
+    with open(log_path, "a") as log_file:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=log_file,
+            start_new_session=True,
+        )
+    sys.stdout.write(
+        f"Starting the daemon. The index and models are loading (log: {log_path})...\n"
+    )
+    sys.stdout.flush()
+    while not get_daemon_status(socket_path):
+        if process.poll() is not None:
+            sys.stdout.write(f"The daemon exited. See {log_path}\n")
+            sys.exit(1)
+        time.sleep(0.5)
+    sys.stdout.write(f"The daemon is running (pid {process.pid}).\n")
+
+
+def daemon_stop(args, config_dict):
+    socket_path, _ = get_daemon_paths()
+    try:
+        for event in request_daemon(socket_path, {"command": "stop"}):
+            sys.stdout.write(f"Stopped the daemon (pid {event['pid']}).\n")
+    except OSError:
+        sys.stdout.write("No daemon is running for this directory.\n")
+
+
+def daemon_status(args, config_dict):
+    socket_path, log_path = get_daemon_paths()
+    status = get_daemon_status(socket_path)
+    if not status:
+        sys.stdout.write("No daemon is running for this directory.\n")
+        return
+    sys.stdout.write(
+        f"The daemon is running (pid {status['pid']}) for {status['directory']}\n"
+        f"Uptime: {status['uptime']:.0f}s, prompts answered: {status['prompts']}\n"
+        f"Index: {status['files']} files, {status['chunks']} chunks\n"
+        f"Model: {status['model']}\n"
+        f"Log: {log_path}\n"
+    )
+
+
+def get_daemon_status(socket_path):
+    """
+    Returns:
+        dict: The status of the daemon listening on a socket, or None.
+    """
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        for event in request_daemon(socket_path, {"command": "status"}):
+            return event
+    except OSError:
+        return None
@@ -0,0 +1,113 @@
+import os
+import sys
+
+from dir_assistant.assistant.storage import (
+    IndexStore,
+    PrefixCacheStore,
+    PromptHistoryStore,
+    read_legacy_sqlitedict,
+)
+from dir_assistant.cli.config import (
+    CACHE_PATH,
+    INDEX_CACHE_FILENAME,
+    LEGACY_INDEX_CACHE_FILENAME,
+    LEGACY_PREFIX_CACHE_FILENAME,
+    LEGACY_PROMPT_HISTORY_FILENAME,
+    PREFIX_CACHE_FILENAME,
+    PROMPT_HISTORY_FILENAME,
+    get_file_path,
+)
+
+EMBED_CONFIG_HASH_LENGTH = 64  # sha256 hex digest
+LEGACY_CHUNKS_KEY_SUFFIX = "_chunks"
+
+
+def wait_for_writes(writes):
+    """
+    Returns:
+        int: The number of writes, once all of them are committed. Raises the first error.
+    """
+    for write in writes:
+        write.result()
+    return len(writes)
+
+
+def migrate_index_cache(legacy_path, store):
+    writes = []
+    for key, value in read_legacy_sqlitedict(legacy_path):
+        # Chunk entries are keyed "{embed_config}-{filepath}_chunks". File content entries
+        # are not needed anymore because contents are read from disk when re-chunking.
+        if not key.endswith(LEGACY_CHUNKS_KEY_SUFFIX) or not isinstance(value, dict):
+            continue
+        embed_config = key[:EMBED_CONFIG_HASH_LENGTH]
+        filepath = key[EMBED_CONFIG_HASH_LENGTH + 1 : -len(LEGACY_CHUNKS_KEY_SUFFIX)]
+        writes.append(
+            store.save_file_chunks(
+                embed_config,
+                filepath,
+                value["mtime"],
+                value["chunks"],
+                value["embeddings"],
+            )
+        )
+    return wait_for_writes(writes)
+
+
+def migrate_prefix_cache(legacy_path, store):
+    writes = []
+    for key, value in read_legacy_sqlitedict(legacy_path):
+        if isinstance(value, dict) and "last_hit_timestamp" in value:
+            writes.append(store.set_prefix_hit(key, value["last_hit_timestamp"]))
+    return wait_for_writes(writes)
+
+
+def migrate_prompt_history(legacy_path, store):
+    writes = []
+    for key, value in read_legacy_sqlitedict(legacy_path):
+        if isinstance(value, dict):
+            writes.append(
+                store.add_prompt(
+                    float(key), value.get("prompt", ""), value.get("artifacts", [])
+                )
+            )
+    return wait_for_writes(writes)
+
+
+def migrate(args, config_dict):
+    migrations = [
+        (
+            LEGACY_INDEX_CACHE_FILENAME,
+            INDEX_CACHE_FILENAME,
+            IndexStore,
+            migrate_index_cache,
+            "files",
+        ),
+        (
+            LEGACY_PREFIX_CACHE_FILENAME,
+            PREFIX_CACHE_FILENAME,
+            PrefixCacheStore,
+            migrate_prefix_cache,
+            "prefixes",
+        ),
+        (
+            LEGACY_PROMPT_HISTORY_FILENAME,
+            PROMPT_HISTORY_FILENAME,
+            PromptHistoryStore,
+            migrate_prompt_history,
+            "prompts",
+        ),
+    ]
+    for legacy_filename, filename, store_class, migrate_function, noun in migrations:
+        legacy_path = get_file_path(CACHE_PATH, legacy_filename)
+        if not os.path.exists(legacy_path):
+            sys.stdout.write(f"{legacy_path} does not exist.\n")
+            continue
+        store = store_class(get_file_path(CACHE_PATH, filename))
+        try:
+            # The legacy file is only removed once every write is committed
+            migrated = migrate_function(legacy_path, store)
+        finally:
+            store.close()
+        os.remove(legacy_path)
+        sys.stdout.write(f"Migrated {migrated} {noun} from {legacy_path}\n")
+    sys.stdout.flush()
@@ -0,0 +1,82 @@
+import sys
+
+from dir_assistant.assistant.rag_simulator import simulate_history, tune_optimizer
+from dir_assistant.assistant.storage import PromptHistoryStore
+from dir_assistant.cli.config import (
+    CACHE_PATH,
+    PROMPT_HISTORY_FILENAME,
+    get_file_path,
+    save_config,
+)
+
+
+def load_prompt_history(max_prompts):
+    store = PromptHistoryStore(get_file_path(CACHE_PATH, PROMPT_HISTORY_FILENAME))
+    try:
+        prompt_history = store.get_prompts()
+    finally:
+        store.close()
+    if max_prompts:
+        prompt_history = prompt_history[-max_prompts:]
+    return prompt_history
+
+
+def write_simulation_result(label, result):
+    sys.stdout.write(
+        f"{label}\n"
+        f"  Prompts replayed:      {result['prompts']}\n"
+        f"  Prompt hit ratio:      {result['hit_ratio']:.1%}\n"
+        f"  Reused tokens:         {result['reused_tokens']} of {result['total_tokens']} "
+        f"({result['token_hit_ratio']:.1%})\n"
+        f"  Relevance loss:        {result['relevance_loss']:.1%}\n"
+    )
+
+
+def optimizer_simulate(args, config_dict):
+    config = config_dict["DIR_ASSISTANT"]
+    prompt_history = load_prompt_history(args.max_prompts)
+    if not prompt_history:
+        sys.stdout.write("No prompt history has been recorded yet.\n")
+        return
+    result = simulate_history(
+        prompt_history,
+        config["RAG_OPTIMIZER_WEIGHTS"],
+        config["ARTIFACT_EXCLUDABLE_FACTOR"],
+        config["API_CONTEXT_CACHE_TTL"],
+    )
+    write_simulation_result("Current settings (estimated tokens)", result)
+
+
+def optimizer_tune(args, config_dict):
+    config = config_dict["DIR_ASSISTANT"]
+    prompt_history = load_prompt_history(args.max_prompts)
+    if not prompt_history:
+        sys.stdout.write("No prompt history has been recorded yet.\n")
+        return
+    current = simulate_history(
+        prompt_history,
+        config["RAG_OPTIMIZER_WEIGHTS"],
+        config["ARTIFACT_EXCLUDABLE_FACTOR"],
+        config["API_CONTEXT_CACHE_TTL"],
+    )
+    write_simulation_result("Current settings (estimated tokens)", current)
+    weights, excludable_factor, best = tune_optimizer(
+        prompt_history,
+        config["RAG_OPTIMIZER_WEIGHTS"],
+        config["API_CONTEXT_CACHE_TTL"],
+        args.max_relevance_loss,
+    )
+    if best is None:
+        sys.stdout.write(
+            f"No setting kept relevance loss under {args.max_relevance_loss:.1%}.\n"
+        )
+        return
+    write_simulation_result("Best settings (estimated tokens)", best)
+    sys.stdout.write(f"  ARTIFACT_EXCLUDABLE_FACTOR = {excludable_factor}\n")
+    sys.stdout.write(f"  RAG_OPTIMIZER_WEIGHTS = {weights}\n")
+    if args.apply:
+        config["ARTIFACT_EXCLUDABLE_FACTOR"] = excludable_factor
+        config["RAG_OPTIMIZER_WEIGHTS"] = weights
+        save_config(config_dict)
+        sys.stdout.write("Saved the best settings to the config file.\n")
+    sys.stdout.flush()
@@ -0,0 +1,343 @@
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dir_assistant.cli.config import VERSION
+
+MODEL_ID = "dir-assistant"
+# Chat histories kept in memory. The least recently used session is dropped beyond this.
+MAX_SESSIONS = 256
+# Results returned by /v1/retrieve unless the request asks for another number
+DEFAULT_RETRIEVE_RESULTS = 10
+
+
+class RequestError(Exception):
+    """A request the server cannot answer, reported to the client with status 400"""
+
+
+def get_message_text(message):
+    """
+    Returns:
+        str: The text of a chat message, whose content is a string or a list of parts.
+    """
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") for part in content if part.get("type") == "text"
+        )
+    return content or ""
+
+
+class SessionPool:
+    """
+    Keeps a chat history per session ID. Each session is an assistant created from the
+    shared assistant, so all sessions search the same index and share its models and
+    caches. A session answers one request at a time.
+    """
+
+    def __init__(self, llm, max_sessions=MAX_SESSIONS):
+        self.llm = llm
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Returns:
+            tuple: The session with an ID and the lock held while it answers. The session
+                is created if the ID is new, or a one-off session if the ID is None.
+        """
+        if session_id is None:
+            return self.llm.create_session(), threading.Lock()
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                entry = (self.llm.create_session(), threading.Lock())
+                self.sessions[session_id] = entry
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(session_id)
+            return entry
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+
+class EventCollector:
+    """Keeps the sources and done events of a turn that is not streamed"""
+
+    def __init__(self):
+        self.events = {}
+
+    def write_event(self, event, **data):
+        self.events[event] = data
+
+
+class CompletionChunkWriter:
+    """Writes the answer tokens of a turn as chat completion chunks in server-sent events"""
+
+    def __init__(self, stream, completion_id, created):
+        self.stream = stream
+        self.completion_id = completion_id
+        self.created = created
+
+    def write_event(self, event, **data):
+        if event == "token":
+            self.write_chunk({"content": data["text"]})
+
+    def write_chunk(self, delta, finish_reason=None):
+        chunk = {
+            "id": self.completion_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": MODEL_ID,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.write_data(json.dumps(chunk))
+
+    def write_data(self, data):
+        self.stream.write(f"data: {data}\n\n".encode("utf-8"))
+        self.stream.flush()
+
+
+class AssistantServer(ThreadingHTTPServer):
+    """
+    Serves an assistant over an OpenAI-compatible HTTP API. Requests are handled in their
+    own threads. Sessions answer at the same time unless the LLM runs one completion at a
+    time.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, llm, max_sessions=MAX_SESSIONS, verbose=False):
+        super().__init__(address, AssistantRequestHandler)
+        self.llm = llm
+        self.sessions = SessionPool(llm, max_sessions)
+        self.verbose = verbose
+        self.turn_lock = (
+            nullcontext() if llm.concurrent_completions else threading.Lock()
+        )
+
+    def get_chat_prompt(self, request):
+        """
+        Returns:
+            tuple: The prompt, which is the last message of the request, and the messages
+                before it.
+        """
+        messages = request.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise RequestError("'messages' must be a non-empty list")
+        if messages[-1].get("role") != "user":
+            raise RequestError("The last message must be a user message")
+        prompt = get_message_text(messages[-1])
+        if not prompt.strip():
+            raise RequestError("The last message is empty")
+        return prompt, messages[:-1]
+
+    def answer_chat(self, prompt, earlier_messages, session_id, event_writer, stream):
+        """
+        Answers a prompt in a session. A session with an ID keeps its own history, so the
+        earlier messages of the request are only used to start the history of a one-off
+        session.
+
+        Returns:
+            str: The answer.
+        """
+        session, session_lock = self.sessions.get(session_id)
+        with session_lock, self.turn_lock:
+            if session_id is None:
+                for message in earlier_messages:
+                    if message.get("role") in ("user", "assistant"):
+                        text = get_message_text(message)
+                        session.chat_history.append(
+                            {
+                                "role": message["role"],
+                                "content": text,
+                                "tokens": session.count_tokens(
+                                    text, role=message["role"]
+                                ),
+                            }
+                        )
+            session.turn_start_time = time.perf_counter()
+            session.event_writer = event_writer
+            session.stream_output = stream
+            try:
+                return session.run_stream_processes(prompt)
+            finally:
+                session.event_writer = None
+                session.stream_output = False
+                session.turn_start_time = None
+
+    def retrieve(self, request):
+        """
+        Returns:
+            list: The chunks nearest to the query of a request, with their scores.
+        """
+        query = request.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise RequestError("'query' must be a non-empty string")
+        max_results = request.get("max_results", DEFAULT_RETRIEVE_RESULTS)
+        if not isinstance(max_results, int) or max_results < 1:
+            raise RequestError("'max_results' must be a positive integer")
+        neighbors = self.llm.search_neighbors(query, self.llm.artifact_cosine_cutoff)
+        return [
+            {
+                "filepath": chunk.get("filepath"),
+                "chunk_index": chunk.get("chunk_index"),
+                "score": float(score),
+                "text": chunk["text"],
+            }
+            for chunk, score in neighbors[:max_results]
+        ]
+
+
+class AssistantRequestHandler(BaseHTTPRequestHandler):
+    server_version = f"dir-assistant/{VERSION}"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            self.send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": MODEL_ID, "object": "model", "owned_by": "dir-assistant"}
+                    ],
+                },
+            )
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        self.response_started = False
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError as e:
+                raise RequestError(f"The body is not valid JSON: {e}")
+            if not isinstance(request, dict):
+                raise RequestError("The body must be a JSON object")
+            if self.path == "/v1/chat/completions":
+                self.chat_completions(request)
+            elif self.path == "/v1/retrieve":
+                self.send_json(200, {"results": self.server.retrieve(request)})
+            else:
+                self.send_error_json(404, f"Unknown path {self.path}")
+        except RequestError as e:
+            self.send_error_json(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+            sys.stderr.write(f"Error answering {self.path}: {message}\n")
+            if self.response_started:
+                # The stream has started, so the error is its last event
+                self.wfile.write(
+                    f"data: {json.dumps({'error': {'message': message}})}\n\n".encode()
+                )
+            else:
+                self.send_error_json(500, message, "server_error")
+
+    def chat_completions(self, request):
+        prompt, earlier_messages = self.server.get_chat_prompt(request)
+        session_id = self.headers.get("X-Session-ID")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.response_started = True
+            writer = CompletionChunkWriter(self.wfile, completion_id, created)
+            writer.write_chunk({"role": "assistant", "content": ""})
+            self.server.answer_chat(prompt, earlier_messages, session_id, writer, True)
+            writer.write_chunk({}, finish_reason="stop")
+            writer.write_data("[DONE]")
+            return
+        collector = EventCollector()
+        answer = self.server.answer_chat(
+            prompt, earlier_messages, session_id, collector, False
+        )
+        self.send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": MODEL_ID,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": answer},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": collector.events.get("done", {}).get("usage"),
+                "sources": collector.events.get("sources", {}).get("sources", []),
+            },
+        )
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, error_type="invalid_request_error"):
+        self.send_json(status, {"error": {"message": message, "type": error_type}})
+
+
+def serve(args, config_dict):
+    """Serves the assistant of the current directory over HTTP until interrupted"""
+    from dir_assistant.assistant.file_watcher import start_file_watcher
+    from dir_assistant.cli.start import initialize_llm
+
+    config = config_dict["DIR_ASSISTANT"]
+    # Answers go to HTTP clients, not the terminal, and files are never changed
+    config["NO_COLOR"] = True
+    config["PRINT_CGRAG"] = False
+    config["COMMIT_TO_GIT"] = False
+    verbose = config["VERBOSE"]
+    config["VERBOSE"] = False
+    args.single_prompt = None
+    llm = initialize_llm(args, config, chat_mode=False)
+    ignore_paths = list(args.ignore or []) + config["GLOBAL_IGNORES"]
+    watcher = start_file_watcher(
+        ".",
+        llm.embed,
+        ignore_paths,
+        (
+            config["LITELLM_EMBED_CONTEXT_SIZE"]
+            if not config["ACTIVE_EMBED_IS_LOCAL"]
+            else llm.embed.get_chunk_size()
+        ),
+        llm.update_index_and_chunks,
+    )
+    server = AssistantServer((args.host, args.port), llm, verbose=verbose)
+    sys.stdout.write(
+        f"dir-assistant is serving http://{args.host}:{server.server_address[1]}/v1\n"
+    )
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        watcher.stop()
+        llm.close()
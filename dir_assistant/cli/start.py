@@ -1,22 +1,20 @@
 import os
 import sys
 
-import litellm
 from colorama import Fore, Style
-from prompt_toolkit import prompt
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.keys import Keys
+from wove import weave
 
-from dir_assistant.assistant.file_watcher import start_file_watcher
+from dir_assistant.assistant.events import JsonEventWriter
+from dir_assistant.assistant.file_edits import EDIT_FORMATS
 from dir_assistant.assistant.index import create_file_index
-from dir_assistant.assistant.lite_llm_assistant import LiteLLMAssistant
-from dir_assistant.assistant.lite_llm_embed import LiteLlmEmbed
-from dir_assistant.assistant.llama_cpp_assistant import LlamaCppAssistant
-from dir_assistant.assistant.llama_cpp_embed import LlamaCppEmbed
+from dir_assistant.assistant.llama_draft import (
+    DRAFT_DECODING_DRAFT_MODEL,
+    DRAFT_DECODING_MODES,
+)
+from dir_assistant.assistant.progressive_index import ProgressiveIndexer
+from dir_assistant.assistant.stage_timeline import StageTimeline
 from dir_assistant.cli.config import HISTORY_FILENAME, STORAGE_PATH, get_file_path
 
-litellm.suppress_debug_info = True
 MODELS_PATH = os.path.expanduser("~/.local/share/dir-assistant/models")
 
 
@@ -60,6 +58,13 @@ The user is currently working in the following directory (CWD): {os.getcwd()}"""
     llama_cpp_options = config["LLAMA_CPP_OPTIONS"]
     llama_cpp_embed_options = config["LLAMA_CPP_EMBED_OPTIONS"]
     llama_cpp_completion_options = config["LLAMA_CPP_COMPLETION_OPTIONS"]
+    llama_cpp_state_cache_size = config["LLAMA_CPP_STATE_CACHE_SIZE"]
+    llama_cpp_state_disk_cache_size = config["LLAMA_CPP_STATE_DISK_CACHE_SIZE"]
+    llama_cpp_draft_decoding = config["LLAMA_CPP_DRAFT_DECODING"]
+    llama_cpp_draft_model_path = get_file_path(
+        config["MODELS_PATH"], config["LLAMA_CPP_DRAFT_MODEL"]
+    )
+    llama_cpp_draft_tokens = config["LLAMA_CPP_DRAFT_TOKENS"]
     # LiteLLM settings
     lite_llm_context_size = config["LITELLM_CONTEXT_SIZE"]
     lite_llm_embed_context_size = config["LITELLM_EMBED_CONTEXT_SIZE"]
@@ -73,16 +78,26 @@ The user is currently working in the following directory (CWD): {os.getcwd()}"""
         "LITELLM_CGRAG_PASS_THROUGH_CONTEXT_SIZE"
     ]
     cgrag_lite_llm_completion_options = config["LITELLM_CGRAG_COMPLETION_OPTIONS"]
+    lite_llm_prompt_caching = config["LITELLM_PROMPT_CACHING"]
     # Assistant settings
     use_cgrag = config["USE_CGRAG"]
     print_cgrag = config["PRINT_CGRAG"]
     output_acceptance_retries = config["OUTPUT_ACCEPTANCE_RETRIES"]
     commit_to_git = config["COMMIT_TO_GIT"]
+    git_edit_format = config["GIT_EDIT_FORMAT"]
+    git_intent_margin = config["GIT_INTENT_MARGIN"]
+    cgrag_streaming = config["CGRAG_STREAMING"]
+    cgrag_streaming_batch_size = config["CGRAG_STREAMING_BATCH_SIZE"]
+    cgrag_streaming_max_tokens = config["CGRAG_STREAMING_MAX_TOKENS"]
+    cgrag_streaming_max_seconds = float(config["CGRAG_STREAMING_MAX_SECONDS"])
+    use_retrieval_cache = config["RETRIEVAL_CACHE"]
+    retrieval_cache_similarity = float(config["RETRIEVAL_CACHE_SIMILARITY"])
     verbose = config["VERBOSE"] or args.verbose
     no_color = config["NO_COLOR"] or args.no_color
     hide_thinking = config["HIDE_THINKING"]
     thinking_start_pattern = config["THINKING_START_PATTERN"]
     thinking_end_pattern = config["THINKING_END_PATTERN"]
+    context_layout = config["CONTEXT_LAYOUT"]
     # RAG Optimizer settings
     artifact_excludable_factor = config["ARTIFACT_EXCLUDABLE_FACTOR"]
     api_context_cache_ttl = config["API_CONTEXT_CACHE_TTL"]
@@ -94,6 +109,7 @@ The user is currently working in the following directory (CWD): {os.getcwd()}"""
     index_max_files_per_minute = config["INDEX_MAX_FILES_PER_MINUTE"]
     index_chunk_workers = config["INDEX_CHUNK_WORKERS"]
     index_max_chunk_requests_per_minute = config["INDEX_MAX_CHUNK_REQUESTS_PER_MINUTE"]
+    index_in_background = config["INDEX_IN_BACKGROUND"] and chat_mode
     if active_embed_is_local:
         index_concurrent_files = 1
         index_chunk_workers = 1
@@ -105,6 +121,21 @@ The user is currently working in the following directory (CWD): {os.getcwd()}"""
     see readme for more information. Exiting..."""
             )
             exit(1)
+        if llama_cpp_draft_decoding not in DRAFT_DECODING_MODES:
+            print(
+                f"""LLAMA_CPP_DRAFT_DECODING must be one of {", ".join(DRAFT_DECODING_MODES)}. \
+Use 'dir-assistant config open' to change it. Exiting..."""
+            )
+            exit(1)
+        if (
+            llama_cpp_draft_decoding == DRAFT_DECODING_DRAFT_MODEL
+            and config["LLAMA_CPP_DRAFT_MODEL"] == ""
+        ):
+            print(
+                """You must specify LLAMA_CPP_DRAFT_MODEL to use draft model decoding. Use \
+'dir-assistant config open' and see readme for more information. Exiting..."""
+            )
+            exit(1)
     elif (
         "model" not in lite_llm_completion_options
         or not lite_llm_completion_options["model"]
@@ -131,8 +162,14 @@ see readme for more information. Exiting..."""
 see readme for more information. Exiting..."""
         )
         exit(1)
-    ignore_paths = args.ignore if args.ignore else []
-    ignore_paths.extend(config["GLOBAL_IGNORES"])
+    if git_edit_format not in EDIT_FORMATS:
+        print(
+            f"""GIT_EDIT_FORMAT must be one of {", ".join(EDIT_FORMATS)}. Use \
+'dir-assistant config open' to change it. Exiting..."""
+        )
+        exit(1)
+    # A new list, so args.ignore keeps only the paths given on the command line
+    ignore_paths = list(args.ignore or []) + config["GLOBAL_IGNORES"]
     extra_dirs = args.dirs if args.dirs else []
     # Initialize the embedding model
     if verbose and chat_mode:
@@ -142,12 +179,17 @@ see readme for more information. Exiting..."""
         if not no_color:
             sys.stdout.write(f"{Style.RESET_ALL}")
         sys.stdout.flush()
+    # Only the selected backends are imported. litellm alone takes seconds to import.
     if active_embed_is_local:
+        from dir_assistant.assistant.llama_cpp_embed import LlamaCppEmbed
+
         embed = LlamaCppEmbed(
             model_path=embed_model_file, embed_options=llama_cpp_embed_options
         )
         embed_chunk_size = embed.get_chunk_size()
     else:
+        from dir_assistant.assistant.lite_llm_embed import LiteLlmEmbed
+
         embed = LiteLlmEmbed(
             lite_llm_embed_completion_options=lite_llm_embed_completion_options,
             lite_llm_embed_context_size=lite_llm_embed_context_size,
@@ -162,95 +204,199 @@ see readme for more information. Exiting..."""
         if not no_color:
             sys.stdout.write(f"{Style.RESET_ALL}")
         sys.stdout.flush()
-    index, chunks = create_file_index(
-        embed,
-        ignore_paths,
-        embed_chunk_size,
-        extra_dirs,
-        verbose,
-        index_concurrent_files,
-        index_max_files_per_minute,
-        index_chunk_workers,
-        index_max_chunk_requests_per_minute,
-    )
     # Set up the system instructions
     system_instructions_full = f"""{system_instructions}
 The user will ask questions relating \
 to files they will provide. Do your best to answer questions related to the these files. When \
 the user refers to files, always assume they want to know about the files they provided."""
-    # Initialize the LLM model
-    if active_model_is_local:
-        if verbose and chat_mode:
-            if not no_color:
-                sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
-            sys.stdout.write(f"Loading local LLM model...\n")
-            if not no_color:
-                sys.stdout.write(f"{Style.RESET_ALL}")
-            sys.stdout.flush()
-        llm = LlamaCppAssistant(
-            model_path,
-            llama_cpp_options,
-            system_instructions,
+
+    # The index and the LLM are independent until the first prompt, so the model loads
+    # (or litellm imports) while the files are embedded
+    indexer = None
+    if index_in_background:
+        indexer = ProgressiveIndexer(
             embed,
-            index,
-            chunks,
-            context_file_ratio,
-            artifact_excludable_factor,
-            artifact_cosine_cutoff,
-            artifact_cosine_cgrag_cutoff,
-            api_context_cache_ttl,
-            rag_optimizer_weights,
-            output_acceptance_retries,
-            use_cgrag,
-            print_cgrag,
-            commit_to_git,
-            llama_cpp_completion_options,
+            ignore_paths,
+            embed_chunk_size,
+            extra_dirs,
             verbose,
-            no_color,
-            chat_mode,
-            hide_thinking,
-            thinking_start_pattern,
-            thinking_end_pattern,
+            index_concurrent_files,
+            index_max_files_per_minute,
+            index_chunk_workers,
+            index_max_chunk_requests_per_minute,
         )
-    else:
-        if verbose and chat_mode:
-            if not no_color:
-                sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
-            sys.stdout.write(f"Loading remote LLM model...\n")
-            if not no_color:
-                sys.stdout.write(f"{Style.RESET_ALL}")
-            sys.stdout.flush()
-        llm = LiteLLMAssistant(
-            lite_llm_completion_options,
-            lite_llm_context_size,
-            lite_llm_pass_through_context_size,
-            cgrag_lite_llm_completion_options,
-            cgrag_lite_llm_context_size,
-            cgrag_lite_llm_pass_through_context_size,
-            system_instructions,
+
+    def create_index():
+        if indexer:
+            return indexer.load_cached_index()
+        return create_file_index(
             embed,
-            index,
-            chunks,
-            context_file_ratio,
-            artifact_excludable_factor,
-            artifact_cosine_cutoff,
-            artifact_cosine_cgrag_cutoff,
-            api_context_cache_ttl,
-            rag_optimizer_weights,
-            output_acceptance_retries,
-            use_cgrag,
-            print_cgrag,
-            commit_to_git,
+            ignore_paths,
+            embed_chunk_size,
+            extra_dirs,
             verbose,
-            no_color,
+            index_concurrent_files,
+            index_max_files_per_minute,
+            index_chunk_workers,
+            index_max_chunk_requests_per_minute,
             chat_mode,
-            hide_thinking,
-            thinking_start_pattern,
-            thinking_end_pattern,
         )
+
+    def create_assistant():
+        # Initialize the LLM model
+        if active_model_is_local:
+            if verbose and chat_mode:
+                if not no_color:
+                    sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
+                sys.stdout.write(f"Loading local LLM model...\n")
+                if not no_color:
+                    sys.stdout.write(f"{Style.RESET_ALL}")
+                sys.stdout.flush()
+            from dir_assistant.assistant.llama_cpp_assistant import LlamaCppAssistant
+
+            llm = LlamaCppAssistant(
+                model_path,
+                llama_cpp_options,
+                llama_cpp_state_cache_size,
+                llama_cpp_state_disk_cache_size,
+                llama_cpp_draft_decoding,
+                llama_cpp_draft_model_path,
+                llama_cpp_draft_tokens,
+                system_instructions,
+                embed,
+                None,
+                [],
+                context_file_ratio,
+                artifact_excludable_factor,
+                artifact_cosine_cutoff,
+                artifact_cosine_cgrag_cutoff,
+                api_context_cache_ttl,
+                rag_optimizer_weights,
+                output_acceptance_retries,
+                use_cgrag,
+                print_cgrag,
+                commit_to_git,
+                llama_cpp_completion_options,
+                verbose,
+                no_color,
+                chat_mode,
+                hide_thinking,
+                thinking_start_pattern,
+                thinking_end_pattern,
+                context_layout,
+                git_edit_format,
+                git_intent_margin,
+                cgrag_streaming,
+                cgrag_streaming_batch_size,
+                cgrag_streaming_max_tokens,
+                cgrag_streaming_max_seconds,
+                use_retrieval_cache,
+                retrieval_cache_similarity,
+            )
+        else:
+            if verbose and chat_mode:
+                if not no_color:
+                    sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
+                sys.stdout.write(f"Loading remote LLM model...\n")
+                if not no_color:
+                    sys.stdout.write(f"{Style.RESET_ALL}")
+                sys.stdout.flush()
+            from dir_assistant.assistant.lite_llm_assistant import LiteLLMAssistant
+
+            llm = LiteLLMAssistant(
+                lite_llm_completion_options,
+                lite_llm_context_size,
+                lite_llm_pass_through_context_size,
+                cgrag_lite_llm_completion_options,
+                cgrag_lite_llm_context_size,
+                cgrag_lite_llm_pass_through_context_size,
+                lite_llm_prompt_caching,
+                system_instructions,
+                embed,
+                None,
+                [],
+                context_file_ratio,
+                artifact_excludable_factor,
+                artifact_cosine_cutoff,
+                artifact_cosine_cgrag_cutoff,
+                api_context_cache_ttl,
+                rag_optimizer_weights,
+                output_acceptance_retries,
+                use_cgrag,
+                print_cgrag,
+                commit_to_git,
+                verbose,
+                no_color,
+                chat_mode,
+                hide_thinking,
+                thinking_start_pattern,
+                thinking_end_pattern,
+                context_layout,
+                git_edit_format,
+                git_intent_margin,
+                cgrag_streaming,
+                cgrag_streaming_batch_size,
+                cgrag_streaming_max_tokens,
+                cgrag_streaming_max_seconds,
+                use_retrieval_cache,
+                retrieval_cache_similarity,
+            )
+        llm.warm_up()
+        return llm
+
+    llm, timeline = run_startup(create_index, create_assistant)
+    if indexer:
+        llm.indexer = indexer
+        indexer.start(llm.replace_file_chunks)
+    if verbose and chat_mode:
+        if not no_color:
+            sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
+        sys.stdout.write(f"{timeline.format()}\n")
+        if not no_color:
+            sys.stdout.write(f"{Style.RESET_ALL}")
+        sys.stdout.flush()
+    if indexer and not indexer.is_complete():
+        indexed_files, total_files = indexer.get_coverage()
+        if not no_color:
+            sys.stdout.write(f"{Fore.LIGHTBLACK_EX}")
+        sys.stdout.write(
+            f"{indexed_files} of {total_files} files are indexed. The rest are indexed in "
+            f"the background.\n"
+        )
+        if not no_color:
+            sys.stdout.write(f"{Style.RESET_ALL}")
+        sys.stdout.flush()
     return llm
 
 
+def run_startup(create_index, create_assistant):
+    """
+    Creates the index and the assistant concurrently, then gives the index to the
+    assistant.
+
+    Returns:
+        tuple: The assistant and the StageTimeline of the startup.
+    """
+    timeline = StageTimeline()
+    with weave() as w:
+
+        @w.do
+        def file_index():
+            with timeline.stage("index"):
+                return create_index()
+
+        @w.do
+        def assistant():
+            with timeline.stage("model"):
+                return create_assistant()
+
+    if w.result.exception:
+        raise w.result.exception
+    llm = w.result.assistant
+    llm.index, llm.chunks = w.result.file_index
+    return llm, timeline
+
+
 def start(args, config_dict):
     single_prompt = args.single_prompt
     if single_prompt:
@@ -259,20 +405,45 @@ def start(args, config_dict):
         config_dict["VERBOSE"] = False
         config_dict["PRINT_CGRAG"] = False
         config_dict["COMMIT_TO_GIT"] = False
+        # A running daemon answers without loading the index and models again. A
+        # profiled prompt runs in-process, where its stages can be timed.
+        from dir_assistant.cli.daemon import (
+            get_config_hash,
+            get_daemon_paths,
+            run_prompt_with_daemon,
+        )
+
+        if not getattr(args, "profile", None) and run_prompt_with_daemon(
+            args, get_daemon_paths()[0], get_config_hash(config_dict)
+        ):
+            exit(0)
     llm = initialize_llm(args, config_dict, chat_mode=not single_prompt)
     llm.initialize_history()
     # If in single prompt mode, run the prompt and exit
     if single_prompt:
+        if args.json_events:
+            llm.event_writer = JsonEventWriter(sys.stdout)
+        llm.stream_output = args.stream or args.json_events
         response = llm.run_stream_processes(single_prompt, one_off=True)
-        sys.stdout.write(response)
-        sys.stdout.write("\n")
-        sys.stdout.flush()
+        if not args.json_events:
+            # A streamed answer has already been written
+            if not llm.stream_output:
+                sys.stdout.write(response)
+            sys.stdout.write("\n")
+            sys.stdout.flush()
         exit(0)
+    # The interactive chat is the only mode that needs the prompt and the file watcher
+    from prompt_toolkit import prompt
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.key_binding import KeyBindings
+    from prompt_toolkit.keys import Keys
+
+    from dir_assistant.assistant.file_watcher import start_file_watcher
+
     # Get variables needed for file watcher and startup art
     is_full_config = "DIR_ASSISTANT" in config_dict
     config = config_dict["DIR_ASSISTANT"] if is_full_config else config_dict
-    ignore_paths = args.ignore if args.ignore else []
-    ignore_paths.extend(config["GLOBAL_IGNORES"])
+    ignore_paths = list(args.ignore or []) + config["GLOBAL_IGNORES"]
     commit_to_git = config["COMMIT_TO_GIT"]
     embed = llm.embed
     active_embed_is_local = config["ACTIVE_EMBED_IS_LOCAL"]
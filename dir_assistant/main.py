@@ -1,20 +1,19 @@
 import argparse
+import atexit
 import sys
 import warnings
 
 warnings.filterwarnings("ignore")
 
-from dir_assistant.assistant.index import clear
-from dir_assistant.cli.config import VERSION, config, config_open, load_config
-from dir_assistant.cli.models import (
-    models_download_embed,
-    models_download_llm,
-    models_open,
-    models_print,
-)
-from dir_assistant.cli.platform_setup import platform
-from dir_assistant.cli.setkey import setkey
-from dir_assistant.cli.start import start
+# Subcommands are imported when they run, so commands like 'config' and 'setkey' do not
+# load the LLM backends, and a single prompt reaches its first request sooner.
+from dir_assistant.cli.config import VERSION, load_config
+
+
+def write_profile_trace(profiler, path):
+    profiler.write_trace(path)
+    sys.stderr.write(f"Wrote the profile trace to {path}\n")
+    sys.stderr.flush()
 
 
 def main():
@@ -43,6 +42,24 @@ def main():
         type=str,
         help="Run a single prompt and output the final answer.",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="With --single-prompt, write the answer as it is generated.",
+    )
+    parser.add_argument(
+        "--json-events",
+        action="store_true",
+        help="With --single-prompt, write JSON lines events with stage timings, sources, "
+        "answer tokens, token usage and cache hits.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="TRACE_FILE",
+        help="Time each stage of indexing and of every turn. A summary of each turn is "
+        "written to stderr and a Chrome trace of the run to TRACE_FILE.",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -85,6 +102,24 @@ def main():
         type=str,
         help="Run a single prompt and output the final answer.",
     )
+    start_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="With --single-prompt, write the answer as it is generated.",
+    )
+    start_parser.add_argument(
+        "--json-events",
+        action="store_true",
+        help="With --single-prompt, write JSON lines events with stage timings, sources, "
+        "answer tokens, token usage and cache hits.",
+    )
+    start_parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="TRACE_FILE",
+        help="Time each stage of indexing and of every turn. A summary of each turn is "
+        "written to stderr and a Chrome trace of the run to TRACE_FILE.",
+    )
     start_parser.add_argument(
         "-v",
         "--verbose",
@@ -180,12 +215,162 @@ vulkan    - Vulkan""",
         help="Download a local LLM model. (Phi-3.1-mini-128k-instruct-Q5_K_L.gguf)",
     )
 
+    # Optimizer
+    optimizer_parser = mode_subparsers.add_parser(
+        "optimizer",
+        help="Measure and tune the RAG optimizer's cache efficiency on recorded prompts.",
+    )
+    optimizer_subparsers = optimizer_parser.add_subparsers(
+        dest="optimizer_mode", help="Operation mode for the optimizer subcommand."
+    )
+    optimizer_simulate_parser = optimizer_subparsers.add_parser(
+        "simulate",
+        help="Replay the prompt history through a simulated provider prefix cache.",
+    )
+    optimizer_tune_parser = optimizer_subparsers.add_parser(
+        "tune",
+        help="Search optimizer weights and ARTIFACT_EXCLUDABLE_FACTOR for the best cache efficiency.",
+    )
+    for optimizer_mode_parser in [optimizer_simulate_parser, optimizer_tune_parser]:
+        optimizer_mode_parser.add_argument(
+            "--max-prompts",
+            type=int,
+            default=500,
+            help="Only replay the most recent prompts. 0 replays all of them.",
+        )
+    optimizer_tune_parser.add_argument(
+        "--max-relevance-loss",
+        type=float,
+        default=0.05,
+        help="Highest acceptable share of the most relevant artifacts that may be swapped out.",
+    )
+    optimizer_tune_parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Save the best settings to the config file.",
+    )
+
     # Clear
     clear_parser = mode_subparsers.add_parser(
         "clear",
         help="Clear the index cache. (Useful if upgrading to a new version of dir-assistant)",
     )
 
+    # Migrate
+    migrate_parser = mode_subparsers.add_parser(
+        "migrate",
+        help="Convert caches from dir-assistant 1.9.x and earlier to the current storage format.",
+    )
+
+    # Serve
+    serve_parser = mode_subparsers.add_parser(
+        "serve",
+        help="Serve the current directory over an OpenAI-compatible HTTP API.",
+    )
+    serve_parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="The address to listen on. Defaults to 127.0.0.1.",
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="The port to listen on. Defaults to 8765.",
+    )
+    serve_parser.add_argument(
+        "-i",
+        "--ignore",
+        type=str,
+        nargs="+",
+        help="A list of space-separated filepaths to ignore.",
+    )
+    serve_parser.add_argument(
+        "-d",
+        "--dirs",
+        type=str,
+        nargs="+",
+        help="A list of space-separated directories to work on. Your current directory will always be used.",
+    )
+
+    # Batch
+    batch_parser = mode_subparsers.add_parser(
+        "batch",
+        help="Answer the prompts of a JSON lines file with one index of the current directory.",
+    )
+    batch_parser.add_argument(
+        "input",
+        type=str,
+        help='A JSON lines file with one {"prompt": ..., "id": ...} object per line, or - '
+        "for stdin.",
+    )
+    batch_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="-",
+        help="The JSON lines file to write the results to, in input order. Defaults to stdout.",
+    )
+    batch_parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="The number of prompts answered at the same time. Defaults to BATCH_CONCURRENCY.",
+    )
+    batch_parser.add_argument(
+        "--max-requests-per-minute",
+        type=int,
+        help="The most prompts started per minute. Defaults to "
+        "BATCH_MAX_REQUESTS_PER_MINUTE.",
+    )
+    batch_parser.add_argument(
+        "-i",
+        "--ignore",
+        type=str,
+        nargs="+",
+        help="A list of space-separated filepaths to ignore.",
+    )
+    batch_parser.add_argument(
+        "-d",
+        "--dirs",
+        type=str,
+        nargs="+",
+        help="A list of space-separated directories to work on. Your current directory will always be used.",
+    )
+
+    # Daemon
+    daemon_parser = mode_subparsers.add_parser(
+        "daemon",
+        help="Keep the index and models of the current directory loaded in a background "
+        "process that answers single prompts.",
+    )
+    daemon_subparsers = daemon_parser.add_subparsers(
+        dest="daemon_mode", help="Operation mode for the daemon subcommand."
+    )
+    daemon_start_parser = daemon_subparsers.add_parser(
+        "start", help="Start the daemon for the current directory."
+    )
+    daemon_subparsers.add_parser("stop", help="Stop the daemon.")
+    daemon_subparsers.add_parser("status", help="Show the status of the daemon.")
+    daemon_run_parser = daemon_subparsers.add_parser(
+        "run", help="Run the daemon in the foreground."
+    )
+    for daemon_mode_parser in [daemon_start_parser, daemon_run_parser]:
+        daemon_mode_parser.add_argument(
+            "-i",
+            "--ignore",
+            type=str,
+            nargs="+",
+            help="A list of space-separated filepaths to ignore.",
+        )
+        daemon_mode_parser.add_argument(
+            "-d",
+            "--dirs",
+            type=str,
+            nargs="+",
+            help="A list of space-separated directories to work on. Your current directory will always be used.",
+        )
+
     # Setkey
     setkey_parser = mode_subparsers.add_parser("setkey", help="""Set an API key.""")
     setkey_parser.add_argument(
@@ -196,13 +381,21 @@ vulkan    - Vulkan""",
     # Parse the arguments
     args = parser.parse_args()
 
+    if args.profile:
+        from dir_assistant.assistant.profiler import enable_profiling
+
+        # The trace is written when the process exits, including after Ctrl-C
+        atexit.register(write_profile_trace, enable_profiling(), args.profile)
+
     if not (args.mode == "config" and args.config_mode == "open"):
         # Do not load the config file if the user is opening the config file.
         # The toml may be malformed, so we don't want to crash before it is opened.
         config_dict = load_config()
 
         # Print version info if verbose
-        if config_dict["DIR_ASSISTANT"]["VERBOSE"] and not args.single_prompt:
+        if config_dict["DIR_ASSISTANT"]["VERBOSE"] and not getattr(
+            args, "single_prompt", None
+        ):
             sys.stdout.write(f"dir-assistant {VERSION}\n")
             sys.stdout.write(f"Released under MIT License\n")
             sys.stdout.write(f"https://github.com/curvedinf/dir-assistant\n\n")
@@ -210,10 +403,16 @@ vulkan    - Vulkan""",
 
     # Run the user's selected mode
     if args.mode == "start" or args.mode is None:
+        from dir_assistant.cli.start import start
+
         start(args, config_dict["DIR_ASSISTANT"])
     elif args.mode == "platform":
+        from dir_assistant.cli.platform_setup import platform
+
         platform(args, config_dict["DIR_ASSISTANT"])
     elif args.mode == "config":
+        from dir_assistant.cli.config import config, config_open
+
         if args.config_mode == "print" or args.config_mode is None:
             config(args, config_dict)
         elif args.config_mode == "open":
@@ -221,6 +420,13 @@ vulkan    - Vulkan""",
         else:
             config_parser.print_help()
     elif args.mode == "models":
+        from dir_assistant.cli.models import (
+            models_download_embed,
+            models_download_llm,
+            models_open,
+            models_print,
+        )
+
         if args.models_mode == "open" or args.models_mode is None:
             models_open(args, config_dict)
         elif args.models_mode == "print":
@@ -231,9 +437,50 @@ vulkan    - Vulkan""",
             models_download_llm(args, config_dict)
         else:
             models_parser.print_help()
+    elif args.mode == "optimizer":
+        from dir_assistant.cli.optimizer import optimizer_simulate, optimizer_tune
+
+        if args.optimizer_mode == "simulate":
+            optimizer_simulate(args, config_dict)
+        elif args.optimizer_mode == "tune":
+            optimizer_tune(args, config_dict)
+        else:
+            optimizer_parser.print_help()
     elif args.mode == "clear":
+        from dir_assistant.assistant.index import clear
+
         clear(args, config_dict)
+    elif args.mode == "migrate":
+        from dir_assistant.cli.migrate import migrate
+
+        migrate(args, config_dict)
+    elif args.mode == "serve":
+        from dir_assistant.cli.serve import serve
+
+        serve(args, config_dict)
+    elif args.mode == "batch":
+        from dir_assistant.cli.batch import batch
+
+        batch(args, config_dict)
+    elif args.mode == "daemon":
+        from dir_assistant.cli.daemon import (
+            daemon_run,
+            daemon_start,
+            daemon_status,
+            daemon_stop,
+        )
+
+        if args.daemon_mode == "start":
+            daemon_start(args, config_dict)
+        elif args.daemon_mode == "stop":
+            daemon_stop(args, config_dict)
+        elif args.daemon_mode == "status" or args.daemon_mode is None:
+            daemon_status(args, config_dict)
+        elif args.daemon_mode == "run":
+            daemon_run(args, config_dict)
     elif args.mode == "setkey":
+        from dir_assistant.cli.setkey import setkey
+
         setkey(args, config_dict)
     else:
         parser.print_help()
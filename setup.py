@@ -23,7 +23,6 @@ setup(
         "faiss-cpu",
         "litellm",
         "colorama",
-        "sqlitedict",
         "prompt-toolkit",
         "watchdog",
         "google-generativeai",
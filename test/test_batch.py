@@ -0,0 +1,96 @@
+import io
+import json
+import tempfile
+import unittest
+from test.utils import FakeAssistant, FakeEmbed, create_fake_assistant
+from unittest.mock import patch
+
+from dir_assistant.cli.batch import OrderedResultWriter, read_batch_items, run_batch
+
+
+class CountingEmbed(FakeEmbed):
+    def __init__(self):
+        self.embedded_texts = []
+        self.batches = 0
+
+    def create_embedding(self, text):
+        self.embedded_texts.append(text)
+        return super().create_embedding(text)
+
+    def create_embeddings(self, texts):
+        self.batches += 1
+        return [self.create_embedding(text) for text in texts]
+
+
+class FailingAssistant(FakeAssistant):
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        if "fail" in chat_history[-1]["content"]:
+            raise RuntimeError("The provider is down")
+        return super().call_completion(chat_history, is_cgrag_call)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        cache_patch = patch(
+            "dir_assistant.assistant.base_assistant.CACHE_PATH", self.temp_dir.name
+        )
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        self.embed = CountingEmbed()
+        self.assistant = create_fake_assistant(
+            ("/repo/a.py", "/repo/b.py"), self.embed, 0.5, FailingAssistant
+        )
+        self.addCleanup(self.assistant.close)
+
+    def test_results_are_written_in_input_order(self):
+        lines = [
+            '{"id": "q1", "prompt": "first question"}',
+            "",
+            "not json",
+            '{"id": "q2", "prompt": "please fail"}',
+            '{"prompt": "third question"}',
+        ]
+        items = read_batch_items(lines)
+        output = io.StringIO()
+        writer = OrderedResultWriter(output)
+        run_batch(self.assistant, items, writer, concurrency=4)
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([result["line"] for result in results], [1, 3, 4, 5])
+        self.assertEqual(results[0]["id"], "q1")
+        self.assertEqual(results[0]["answer"], "The answer is here.")
+        self.assertEqual(results[0]["sources"][0]["filepath"], "/repo/a.py")
+        self.assertEqual(results[0]["usage"]["total_tokens"], 42)
+        self.assertIn("not valid JSON", results[1]["error"])
+        self.assertIn("The provider is down", results[2]["error"])
+        self.assertIsNone(results[3]["error"])
+        self.assertEqual(writer.failed, 2)
+        # The prompts were embedded in one batch and not again when answered
+        self.assertEqual(self.embed.batches, 1)
+        self.assertEqual(
+            self.embed.embedded_texts,
+            ["first question", "please fail", "third question"],
+        )
+
+    def test_write_errors_are_raised(self):
+        class ClosedStream(io.StringIO):
+            def write(self, text):
+                raise BrokenPipeError("The output was closed")
+
+        items = read_batch_items(['{"prompt": "first question"}'])
+        with self.assertRaises(BrokenPipeError):
+            run_batch(self.assistant, items, OrderedResultWriter(ClosedStream()))
+
+    def test_ordered_writer_holds_later_results(self):
+        output = io.StringIO()
+        writer = OrderedResultWriter(output)
+        writer.write(1, {"line": 2, "error": None})
+        self.assertEqual(output.getvalue(), "")
+        writer.write(0, {"line": 1, "error": None})
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([line["line"] for line in lines], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
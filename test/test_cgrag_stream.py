@@ -0,0 +1,86 @@
+import re
+import unittest
+
+from dir_assistant.assistant.cgrag_stream import (
+    STOP_STABLE,
+    STOP_TOKEN_BUDGET,
+    StreamingRetrieval,
+    parse_guidance_items,
+)
+
+
+def content_chunk(content):
+    return {"choices": [{"delta": {"content": content}}]}
+
+
+def stream(text):
+    # One chunk per word, like a token stream
+    return [content_chunk(word) for word in re.findall(r"\S+\s*", text)]
+
+
+class KeywordSearch:
+    """Finds the chunks named in the query, scored by their position in the alphabet"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        guidance = query.split("Needed information:\n")[1]
+        return [
+            ({"text": word}, 1.0 - (ord(word[0]) - ord("a")) / 26)
+            for word in guidance.split()
+            if len(word) == 1
+        ]
+
+
+class TestCgragStream(unittest.TestCase):
+    def create_retrieval(self, search, **kwargs):
+        return StreamingRetrieval("question", search, lambda text: 1, 3, 2, **kwargs)
+
+    def test_list_items_are_parsed_without_markers(self):
+        text = "1. first item\n- second item\n\n* third item\nfourth"
+        self.assertEqual(
+            parse_guidance_items(text), ["first item", "second item", "third item"]
+        )
+        self.assertEqual(parse_guidance_items(text, complete_only=False)[-1], "fourth")
+
+    def test_guidance_stops_when_the_context_is_stable(self):
+        search = KeywordSearch()
+        retrieval = self.create_retrieval(search)
+        # The three best chunks fit in the context. After "a b c", only worse chunks follow.
+        guidance = "- a\n- b\n- c\n- d\n- e\n- f\n- g\n- h\n- i\n"
+        chunks = stream(guidance)
+        consumed = list(retrieval.watch(iter(chunks)))
+        self.assertEqual(retrieval.stop_reason, STOP_STABLE)
+        self.assertLess(len(consumed), len(chunks))
+        neighbors = retrieval.finish(
+            "".join(c["choices"][0]["delta"]["content"] for c in consumed)
+        )
+        self.assertEqual([chunk["text"] for chunk, _ in neighbors[:3]], ["a", "b", "c"])
+        # Every search includes the original prompt
+        self.assertTrue(all("question" in query for query in search.queries))
+
+    def test_budget_stop_searches_the_remaining_items(self):
+        search = KeywordSearch()
+        retrieval = self.create_retrieval(search, max_tokens=3)
+        chunks = stream("- a\n- b\n- c\n")
+        consumed = list(retrieval.watch(iter(chunks)))
+        self.assertEqual(retrieval.stop_reason, STOP_TOKEN_BUDGET)
+        self.assertEqual(len(consumed), 3)
+        # The complete item is searched, the one still streaming is not
+        neighbors = retrieval.finish("- a\n- b")
+        self.assertEqual([chunk["text"] for chunk, _ in neighbors], ["a"])
+
+    def test_guidance_without_items_searches_the_prompt(self):
+        search = KeywordSearch()
+        retrieval = self.create_retrieval(search)
+        list(retrieval.watch(iter([])))
+        self.assertEqual(retrieval.finish(""), [])
+        self.assertEqual(
+            search.queries, ["Original prompt:\nquestion\nNeeded information:\n"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from dir_assistant.assistant.context_assembler import (
+    assemble_context,
+    group_chunks_by_file,
+)
+from dir_assistant.assistant.index import process_file
+
+
+class FakeEmbed:
+    def create_embedding(self, text):
+        return [0.0]
+
+    def count_tokens(self, text):
+        return len(text) // 4
+
+
+def count_tokens(text):
+    return len(text) // 4
+
+
+class TestContextAssembler(unittest.TestCase):
+    def setUp(self):
+        self.contents = "\n".join(f"line {i} of the file" for i in range(1, 41))
+        chunks, _ = process_file(
+            FakeEmbed(),
+            "/repo/src/module.py",
+            self.contents,
+            embed_chunk_size=60,
+            index_max_chunk_requests_per_minute=60000,
+        )
+        self.chunks = chunks
+        self.chunk_map = {chunk["text"]: chunk for chunk in chunks}
+
+    def test_consecutive_chunks_merge_into_one_block(self):
+        artifacts = [chunk["text"] for chunk in self.chunks]
+        text, tokens, saved = assemble_context(
+            artifacts, self.chunk_map, count_tokens, "/repo"
+        )
+        self.assertEqual(text.count("User file"), 1)
+        self.assertTrue(
+            text.startswith(
+                f"---------------\n\nUser file 'src/module.py' lines 1-40:\n\n"
+            )
+        )
+        self.assertIn(self.contents, text)
+        self.assertGreater(saved, 0)
+
+    def test_gaps_start_a_new_block(self):
+        artifacts = [self.chunks[0]["text"], self.chunks[2]["text"]]
+        text, _, _ = assemble_context(artifacts, self.chunk_map, count_tokens, "/repo")
+        self.assertEqual(text.count("User file"), 2)
+
+    def test_grouping_keeps_pinned_prefix(self):
+        texts = [chunk["text"] for chunk in self.chunks]
+        other = {"text": "unstructured", "filepath": "/repo/other.py"}
+        chunk_map = dict(self.chunk_map, unstructured=other)
+        grouped = group_chunks_by_file(
+            [texts[3], texts[1], "unstructured", texts[0], texts[2]], chunk_map, 1
+        )
+        self.assertEqual(
+            grouped, [texts[3], texts[0], texts[1], texts[2], "unstructured"]
+        )
+
+    def test_assembly_is_prefix_stable(self):
+        texts = [chunk["text"] for chunk in self.chunks]
+        shorter, _, _ = assemble_context(
+            [texts[2], texts[0]], self.chunk_map, count_tokens, "/repo"
+        )
+        longer, _, _ = assemble_context(
+            [texts[2], texts[0], texts[1]], self.chunk_map, count_tokens, "/repo"
+        )
+        first_block_end = shorter.index("---------------", 1)
+        self.assertEqual(longer[:first_block_end], shorter[:first_block_end])
+
+
+if __name__ == "__main__":
+    unittest.main()
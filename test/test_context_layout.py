@@ -0,0 +1,96 @@
+import unittest
+
+import faiss
+import numpy as np
+
+from dir_assistant.assistant.base_assistant import BaseAssistant
+
+
+class FakeEmbed:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def create_embedding(self, text):
+        return self.vectors[text]
+
+
+class FakeAssistant(BaseAssistant):
+    def count_tokens(self, text, role="user"):
+        return len(text) // 4
+
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        self.sent_histories.append([dict(message) for message in chat_history])
+        return iter([{"choices": [{"delta": {"content": "Answer"}}]}])
+
+
+def create_chunks(filename, count):
+    return [
+        {
+            "text": f"---------------\n\nUser file '/repo/{filename}' lines {i}-{i}:\n\n"
+            f"{filename} line {i}\n",
+            "filepath": f"/repo/{filename}",
+            "chunk_index": i - 1,
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+class TestStableContextBlock(unittest.TestCase):
+    def setUp(self):
+        self.chunks = create_chunks("a.py", 3) + create_chunks("b.py", 3)
+        vectors = np.zeros((6, 2), dtype=np.float32)
+        vectors[:3, 0] = 1.0
+        vectors[3:, 1] = 1.0
+        index = faiss.IndexFlatIP(2)
+        index.add(vectors)
+        embed = FakeEmbed(
+            {
+                "about a": np.array([1.0, 0.0], dtype=np.float32),
+                "about b": np.array([0.0, 1.0], dtype=np.float32),
+            }
+        )
+        self.assistant = FakeAssistant(
+            "System", embed, index, self.chunks, 0.5, 0.1, 0.5, 0.5, 3600, {}, 1,
+            False, True, False, False, "<think>", "</think>", "stable_block",
+        )  # fmt: skip
+        self.assistant.context_size = 400
+        self.assistant.sent_histories = []
+        self.assistant.initialize_history()
+
+    def tearDown(self):
+        self.assistant.close()
+
+    def ask(self, query):
+        relevant_full_text = self.assistant.build_relevant_full_text(query, 0.5)
+        self.assistant.run_basic_chat_stream(query, relevant_full_text, one_off=True)
+        return self.assistant.sent_histories[-1]
+
+    def test_context_is_appended_after_the_system_message(self):
+        first = self.ask("about a")
+        second = self.ask("about b")
+        self.assertEqual(
+            [m["role"] for m in second[:3]], ["system", "user", "assistant"]
+        )
+        # The earlier block content is an unchanged prefix of the new block
+        self.assertTrue(second[1]["content"].startswith(first[1]["content"]))
+        self.assertIn("b.py line 1", second[1]["content"])
+        self.assertEqual(second[1]["cache_breakpoints"][0], len(first[1]["content"]))
+        # Turns only carry the questions and answers
+        self.assertEqual(
+            [m["content"] for m in second[3:]], ["about a", "Answer", "about b"]
+        )
+
+    def test_culling_keeps_the_context_block(self):
+        self.ask("about a")
+        pinned_tokens = sum(h["tokens"] for h in self.assistant.chat_history[:3])
+        self.assistant.context_size = pinned_tokens + 1
+        history = self.ask("about a")
+        # The earlier question is culled while the context block stays in place
+        self.assertEqual([m["content"] for m in history[3:]].count("about a"), 1)
+        self.assertTrue(history[1]["pinned"])
+        self.assertTrue(history[2]["pinned"])
+        self.assertEqual(history[-1]["content"], "about a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from dir_assistant.assistant.context_packer import pack_context
+
+
+class TestContextPacker(unittest.TestCase):
+    def test_large_chunk_does_not_leave_budget_unused(self):
+        candidates = [
+            ("small-1", 30, 1.0),
+            ("large", 80, 0.5),
+            ("small-2", 30, 0.33),
+            ("small-3", 30, 0.25),
+        ]
+        selected, tokens = pack_context(candidates, 100)
+        self.assertEqual(selected, ["small-1", "small-2", "small-3"])
+        self.assertEqual(tokens, 90)
+
+    def test_pinned_prefix_stays_first(self):
+        candidates = [("p1", 10, 0.1), ("p2", 10, 0.1), ("a", 10, 1.0), ("b", 10, 0.9)]
+        selected, tokens = pack_context(candidates, 30, pinned_count=2)
+        self.assertEqual(selected, ["p1", "p2", "a"])
+        self.assertEqual(tokens, 30)
+
+    def test_single_relevant_chunk_beats_many_weak_ones(self):
+        candidates = [("weak", 1, 0.01), ("strong", 100, 1.0)]
+        selected, tokens = pack_context(candidates, 100)
+        self.assertEqual(selected, ["strong"])
+        self.assertEqual(tokens, 100)
+
+    def test_duplicates_are_ignored(self):
+        selected, tokens = pack_context([("a", 5, 1.0), ("a", 5, 0.5)], 100)
+        self.assertEqual(selected, ["a"])
+        self.assertEqual(tokens, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from argparse import Namespace
+from copy import deepcopy
+from test.utils import create_fake_assistant, patch_startup
+from unittest.mock import MagicMock, patch
+
+from dir_assistant.cli.config import CONFIG_DEFAULTS
+from dir_assistant.cli.daemon import (
+    AssistantDaemon,
+    daemon_run,
+    get_config_hash,
+    get_daemon_status,
+    request_daemon,
+    run_prompt_with_daemon,
+)
+
+
+class TestAssistantDaemon(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.temp_dir.name, "daemon.sock")
+        self.assistant = create_fake_assistant()
+        self.daemon = AssistantDaemon(
+            self.assistant, self.socket_path, "config", ["build"]
+        )
+        self.thread = threading.Thread(target=self.daemon.serve, daemon=True)
+        self.thread.start()
+        while not get_daemon_status(self.socket_path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            list(request_daemon(self.socket_path, {"command": "stop"}))
+            self.thread.join(timeout=5)
+        self.assistant.close()
+        self.temp_dir.cleanup()
+
+    def run_prompt(self, ignore=("build",), stream=False, config_hash="config"):
+        args = Namespace(
+            single_prompt="question",
+            ignore=list(ignore),
+            dirs=None,
+            stream=stream,
+            json_events=False,
+        )
+        output = io.StringIO()
+        with patch("sys.stderr"):
+            answered = run_prompt_with_daemon(
+                args, self.socket_path, config_hash, output
+            )
+        return answered, output.getvalue()
+
+    def test_prompts_are_answered_by_the_daemon(self):
+        self.assertEqual(self.run_prompt(), (True, "The answer is here.\n"))
+        self.assertEqual(self.run_prompt(stream=True), (True, "The answer is here.\n"))
+        status = get_daemon_status(self.socket_path)
+        self.assertEqual(status["prompts"], 2)
+        self.assertEqual(status["chunks"], 1)
+
+    def test_other_configurations_run_in_process(self):
+        # A daemon started with other ignored paths would search another index
+        self.assertEqual(self.run_prompt(ignore=()), (False, ""))
+        # A daemon started before the config file changed would use the old settings
+        self.assertEqual(self.run_prompt(config_hash="changed"), (False, ""))
+        list(request_daemon(self.socket_path, {"command": "stop"}))
+        self.thread.join(timeout=5)
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertEqual(self.run_prompt(), (False, ""))
+
+
+class TestDaemonRun(unittest.TestCase):
+    def test_prompts_with_ignored_paths_are_answered(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        socket_path = os.path.join(temp_dir.name, "daemon.sock")
+        config = deepcopy(CONFIG_DEFAULTS)
+        start_file_watcher = MagicMock()
+        daemon_args = Namespace(
+            ignore=["build"], dirs=None, verbose=False, no_color=False
+        )
+        with patch_startup(create_fake_assistant(), start_file_watcher), patch(
+            "dir_assistant.cli.daemon.get_daemon_paths",
+            return_value=(socket_path, None),
+        ), patch("sys.stdout"):
+            thread = threading.Thread(
+                target=daemon_run, args=(daemon_args, {"DIR_ASSISTANT": config})
+            )
+            thread.start()
+            while not get_daemon_status(socket_path):
+                time.sleep(0.01)
+            # A client loads the same config and sets the same single prompt options
+            client_config = deepcopy(CONFIG_DEFAULTS)
+            client_config.update(
+                NO_COLOR=True, VERBOSE=False, PRINT_CGRAG=False, COMMIT_TO_GIT=False
+            )
+            client_args = Namespace(
+                single_prompt="question",
+                ignore=["build"],
+                dirs=None,
+                stream=False,
+                json_events=False,
+            )
+            output = io.StringIO()
+            answered = run_prompt_with_daemon(
+                client_args, socket_path, get_config_hash(client_config), output
+            )
+            list(request_daemon(socket_path, {"command": "stop"}))
+            thread.join(timeout=5)
+        self.assertTrue(answered)
+        self.assertEqual(output.getvalue(), "The answer is here.\n")
+        self.assertEqual(daemon_args.ignore, ["build"])
+        watcher_ignores = start_file_watcher.call_args.args[2]
+        self.assertEqual(watcher_ignores, ["build"] + CONFIG_DEFAULTS["GLOBAL_IGNORES"])
+
+
+if __name__ == "__main__":
+    unittest.main()
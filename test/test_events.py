@@ -0,0 +1,38 @@
+import io
+import json
+import unittest
+from test.utils import create_fake_assistant
+
+from dir_assistant.assistant.events import JsonEventWriter
+
+
+class TestJsonEvents(unittest.TestCase):
+    def test_single_prompt_events(self):
+        assistant = create_fake_assistant()
+        output = io.StringIO()
+        assistant.event_writer = JsonEventWriter(output)
+        assistant.stream_output = True
+        assistant.initialize_history()
+        try:
+            response = assistant.run_stream_processes("question", one_off=True)
+        finally:
+            assistant.close()
+        events = [json.loads(line) for line in output.getvalue().splitlines()]
+        names = [event["event"] for event in events]
+        self.assertEqual(names[-1], "done")
+        self.assertLess(names.index("sources"), names.index("token"))
+        stages = {event["name"] for event in events if event["event"] == "stage"}
+        self.assertEqual(stages, {"query embedding", "prompt", "retrieval", "answer"})
+        sources = events[names.index("sources")]["sources"]
+        self.assertEqual(sources[0]["filepath"], "/repo/a.py")
+        self.assertAlmostEqual(sources[0]["score"], 1.0)
+        tokens = "".join(e["text"] for e in events if e["event"] == "token")
+        self.assertEqual(tokens, "The answer is here.")
+        done = events[-1]
+        self.assertEqual(done["answer"], response)
+        self.assertEqual(done["usage"]["total_tokens"], 42)
+        self.assertIsNotNone(done["time_to_first_token"])
+
+
+if __name__ == "__main__":
+    unittest.main()
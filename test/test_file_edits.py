@@ -0,0 +1,149 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from dir_assistant.assistant.file_edits import (
+    EDIT_FORMAT_SEARCH_REPLACE,
+    EDIT_FORMAT_UNIFIED_DIFF,
+    EditError,
+    InvalidPathError,
+    compute_file_changes,
+    write_file_changes,
+)
+
+
+class TestFileEdits(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base = self.temp_dir.name
+        self.write("app.py", "def main():\n    print('hello')\n\n\nmain()\n")
+        self.write("util.py", "VALUE = 1\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, filename, content):
+        with open(os.path.join(self.base, filename), "w") as f:
+            f.write(content)
+
+    def read(self, filename):
+        with open(os.path.join(self.base, filename)) as f:
+            return f.read()
+
+    def test_search_replace_blocks_across_files(self):
+        output = """```
+app.py
+<<<<<<< SEARCH
+    print('hello')
+=======
+    print('goodbye')
+>>>>>>> REPLACE
+```
+util.py
+<<<<<<< SEARCH
+VALUE = 1
+=======
+VALUE = 2
+>>>>>>> REPLACE
+new/module.py
+<<<<<<< SEARCH
+=======
+NEW = True
+>>>>>>> REPLACE
+"""
+        changes = compute_file_changes(output, EDIT_FORMAT_SEARCH_REPLACE, self.base)
+        write_file_changes(changes)
+        self.assertEqual(
+            self.read("app.py"), "def main():\n    print('goodbye')\n\n\nmain()\n"
+        )
+        self.assertEqual(self.read("util.py"), "VALUE = 2\n")
+        self.assertEqual(self.read("new/module.py"), "NEW = True\n")
+
+    def test_unified_diff_with_several_hunks(self):
+        output = """--- a/app.py
++++ b/app.py
+@@ -1,2 +1,3 @@
+ def main():
++    # Greets the user
+     print('hello')
+@@ -5,1 +6,1 @@
+-main()
++main()  # Entry point
+--- /dev/null
++++ b/notes.txt
+@@ -0,0 +1,1 @@
++Some notes
+"""
+        changes = compute_file_changes(output, EDIT_FORMAT_UNIFIED_DIFF, self.base)
+        write_file_changes(changes)
+        self.assertEqual(
+            self.read("app.py"),
+            "def main():\n    # Greets the user\n    print('hello')\n\n\nmain()  # Entry point\n",
+        )
+        self.assertEqual(self.read("notes.txt"), "Some notes\n")
+
+    def test_mismatched_edit_is_rejected_before_writing(self):
+        output = """util.py
+<<<<<<< SEARCH
+VALUE = 1
+=======
+VALUE = 2
+>>>>>>> REPLACE
+app.py
+<<<<<<< SEARCH
+    print('missing')
+=======
+    print('goodbye')
+>>>>>>> REPLACE
+"""
+        with self.assertRaises(EditError):
+            compute_file_changes(output, EDIT_FORMAT_SEARCH_REPLACE, self.base)
+        self.assertEqual(self.read("util.py"), "VALUE = 1\n")
+
+    def test_ambiguous_search_blocks_are_rejected(self):
+        self.write("repeat.py", "x = 1\ny = 2\nx = 1\n")
+        output = "repeat.py\n<<<<<<< SEARCH\nx = 1\n=======\nx = 3\n>>>>>>> REPLACE\n"
+        with self.assertRaisesRegex(EditError, "matches 2 places"):
+            compute_file_changes(output, EDIT_FORMAT_SEARCH_REPLACE, self.base)
+        # More context makes the block unique
+        output = (
+            "repeat.py\n<<<<<<< SEARCH\ny = 2\nx = 1\n=======\ny = 2\nx = 3\n"
+            ">>>>>>> REPLACE\n"
+        )
+        write_file_changes(
+            compute_file_changes(output, EDIT_FORMAT_SEARCH_REPLACE, self.base)
+        )
+        self.assertEqual(self.read("repeat.py"), "x = 1\ny = 2\nx = 3\n")
+
+    def test_paths_outside_the_project_are_rejected(self):
+        output = "../outside.py\n<<<<<<< SEARCH\n=======\nx\n>>>>>>> REPLACE\n"
+        with self.assertRaises(InvalidPathError):
+            compute_file_changes(output, EDIT_FORMAT_SEARCH_REPLACE, self.base)
+
+    def test_failed_write_restores_replaced_files(self):
+        changes = {
+            os.path.join(self.base, "util.py"): "VALUE = 2\n",
+            os.path.join(self.base, "app.py"): "broken\n",
+        }
+        real_replace = os.replace
+        calls = []
+
+        def failing_replace(source, destination):
+            calls.append(destination)
+            if len(calls) == 2:
+                raise OSError("disk full")
+            real_replace(source, destination)
+
+        with patch("dir_assistant.assistant.file_edits.os.replace", failing_replace):
+            with self.assertRaises(OSError):
+                write_file_changes(changes)
+        self.assertEqual(self.read("util.py"), "VALUE = 1\n")
+        self.assertEqual(
+            self.read("app.py"), "def main():\n    print('hello')\n\n\nmain()\n"
+        )
+        self.assertEqual(sorted(os.listdir(self.base)), ["app.py", "util.py"])
+
+
+if __name__ == "__main__":
+    unittest.main()
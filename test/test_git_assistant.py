@@ -1,4 +1,5 @@
 import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -80,6 +81,44 @@ class TestGitAssistant(unittest.TestCase):
         # Assert that the method returned True to abort the operation
         self.assertTrue(result)
 
+    @patch("dir_assistant.assistant.git_assistant.subprocess.run")
+    @patch("dir_assistant.assistant.git_assistant.prompt", return_value="y")
+    def test_search_replace_stages_only_changed_files(self, mock_prompt, mock_run):
+        mock_run.return_value = MagicMock(returncode=0)
+        self.assistant.git_edit_format = "search_replace"
+        output = (
+            "src/app.py\n<<<<<<< SEARCH\nold = 1\n=======\nnew = 1\n>>>>>>> REPLACE\n"
+        )
+        original_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                os.mkdir("src")
+                with open("src/app.py", "w") as f:
+                    f.write("old = 1\n")
+                result = self.assistant.run_post_stream_processes("test", output)
+                with open("src/app.py") as f:
+                    self.assertEqual(f.read(), "new = 1\n")
+            finally:
+                os.chdir(original_directory)
+        self.assertTrue(result)
+        self.assertEqual(
+            mock_run.call_args_list[0].args[0],
+            ["git", "add", "-A", "--", os.path.join("src", "app.py")],
+        )
+
+    @patch("dir_assistant.assistant.git_assistant.subprocess.run")
+    @patch("dir_assistant.assistant.git_assistant.prompt", return_value="y")
+    def test_unmatched_edit_is_retried(self, mock_prompt, mock_run):
+        self.assistant.git_edit_format = "search_replace"
+        self.assistant.write_error_message = MagicMock()
+        output = "missing.py\n<<<<<<< SEARCH\nold\n=======\nnew\n>>>>>>> REPLACE\n"
+        result = self.assistant.run_post_stream_processes("test", output)
+        self.assertFalse(result)
+        self.assertIn("missing.py", self.assistant.git_apply_error)
+        self.assertIn("missing.py", self.assistant.get_apply_error_note())
+        mock_run.assert_not_called()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import numpy as np
+
+from dir_assistant.assistant.index import index_files
+from dir_assistant.assistant.index_ledger import RETRY_BASE_SECONDS, IndexLedger
+from dir_assistant.assistant.storage import IndexStore
+
+
+class FlakyEmbed:
+    """Embeds chunks until a set number of embeddings, then fails"""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.embedded = []
+
+    def count_tokens(self, text):
+        return len(text)
+
+    def create_embedding(self, text):
+        if self.fail_after is not None and len(self.embedded) >= self.fail_after:
+            raise ConnectionError("provider unavailable")
+        self.embedded.append(text)
+        return np.array([len(text), 1.0], dtype=np.float32)
+
+
+class TestIndexLedger(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = IndexStore(os.path.join(self.temp_dir.name, "index.db"))
+        self.filepath = os.path.join(self.temp_dir.name, "file.txt")
+        with open(self.filepath, "w") as file:
+            file.write("\n".join(f"line {i}" for i in range(40)))
+        self.item = {"filepath": self.filepath, "mtime": 1.0}
+        self.now = 1000.0
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def run_index(self, embed, publish=None):
+        ledger = IndexLedger(self.store, "config", [self.item], lambda: self.now)
+        published = []
+        publish = publish or (
+            lambda filepath, chunks, embeddings: published.append(chunks)
+        )
+        index_files(
+            embed,
+            self.store,
+            "config",
+            ledger,
+            80,
+            publish,
+            index_max_files_per_minute=100_000_000,
+            index_max_chunk_requests_per_minute=100_000_000,
+        )
+        return ledger, published
+
+    def test_failed_files_resume_after_their_backoff(self):
+        # Chunk embeddings are saved in batches, and the rest when the file fails
+        failing_embed = FlakyEmbed(fail_after=20)
+        ledger, published = self.run_index(failing_embed)
+        self.assertEqual(published, [])
+        self.assertEqual(ledger.get_progress(), (0, 1, 1))
+        job = self.store.load_index_jobs("config")[self.filepath]
+        self.assertEqual(job["attempts"], 1)
+        self.assertIn("provider unavailable", job["error"])
+        self.assertEqual(job["retry_after"], self.now + RETRY_BASE_SECONDS)
+        # The next run waits for the backoff
+        ledger = IndexLedger(self.store, "config", [self.item], lambda: self.now)
+        self.assertEqual(ledger.files, [])
+        self.assertEqual(ledger.deferred_files, [self.item])
+        # After the backoff only the chunks that were not embedded before are embedded
+        self.now += RETRY_BASE_SECONDS
+        embed = FlakyEmbed()
+        ledger, published = self.run_index(embed)
+        self.assertEqual(ledger.get_progress(), (1, 0, 1))
+        self.assertEqual(len(published), 1)
+        self.assertEqual(len(embed.embedded), len(published[0]) - 20)
+        self.assertEqual(self.store.load_index_jobs("config"), {})
+        self.assertEqual(self.store.load_chunk_progress("config", self.filepath), {})
+
+    def test_failed_chunk_writes_are_recorded(self):
+        failed_write = Future()
+        failed_write.set_exception(sqlite3.OperationalError("disk I/O error"))
+        with patch.object(self.store, "save_file_chunks", return_value=failed_write):
+            ledger, published = self.run_index(FlakyEmbed())
+        self.assertEqual(published, [])
+        self.assertEqual(ledger.get_progress(), (0, 1, 1))
+        job = self.store.load_index_jobs("config")[self.filepath]
+        self.assertIn("disk I/O error", job["error"])
+
+    def test_publish_errors_stop_the_run(self):
+        def publish(filepath, chunks, embeddings):
+            raise MemoryError("index is full")
+
+        with self.assertRaisesRegex(MemoryError, "index is full"):
+            self.run_index(FlakyEmbed(), publish)
+
+    def test_progress_estimates_the_time_left(self):
+        items = [{"filepath": f"/file{i}", "mtime": 1.0} for i in range(4)]
+        ledger = IndexLedger(self.store, "config", items, lambda: self.now)
+        self.assertEqual(ledger.format_progress(), "Indexed 0 of 4 files")
+        self.now += 30
+        ledger.record_success(items[0])
+        ledger.record_failure(items[1], ValueError("bad"))
+        self.assertEqual(
+            ledger.format_progress(), "Indexed 1 of 4 files, 1 failed, about 30s left"
+        )
+        # Each failed attempt doubles the backoff
+        job = ledger.record_failure(items[1], ValueError("bad"))
+        self.assertEqual(job["attempts"], 2)
+        self.assertEqual(job["retry_after"], self.now + 2 * RETRY_BASE_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
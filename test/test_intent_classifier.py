@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+from dir_assistant.assistant.intent_classifier import IntentClassifier
+from dir_assistant.assistant.storage import IndexStore
+
+EXEMPLARS = [
+    ("add a function to the file", True),
+    ("fix the bug in the file", True),
+    ("rename the variable in the file", True),
+    ("what does the function do", False),
+    ("how does the indexing work", False),
+    ("why is the test failing", False),
+]
+
+
+class WordEmbed:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % 64] += 1.0
+        return vector
+
+
+class TestIntentClassifier(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.temp_dir.name, "index.db")
+        self.embed = WordEmbed()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_classifier(self, margin=0.1):
+        return IntentClassifier(
+            self.embed, margin, "embed-config", IndexStore(self.store_path), EXEMPLARS
+        )
+
+    def test_confident_prompts_are_classified(self):
+        classifier = self.create_classifier()
+        self.assertTrue(classifier.classify("fix the function in the file"))
+        self.assertFalse(classifier.classify("how does the test work"))
+        self.assertGreater(classifier.last_margin, -1.0)
+        classifier.close()
+
+    def test_unclear_prompts_are_left_to_the_caller(self):
+        classifier = self.create_classifier(margin=10.0)
+        self.assertIsNone(classifier.classify("tell me about the project"))
+        classifier.learn("tell me about the project", False)
+        # Past decisions are answered from the decision cache
+        self.assertFalse(classifier.classify("Tell me  about the project"))
+        classifier.close()
+
+    def test_exemplars_are_embedded_once_and_learned_decisions_persist(self):
+        classifier = self.create_classifier(margin=10.0)
+        classifier.classify("tell me about the project")
+        classifier.learn("tell me about the project", True)
+        classifier.close()
+        calls = self.embed.calls
+        reopened = self.create_classifier(margin=10.0)
+        self.assertTrue(reopened.classify("tell me about the project"))
+        reopened.classify("something else entirely")
+        # Only the new prompt was embedded
+        self.assertEqual(self.embed.calls, calls + 1)
+        self.assertEqual(len(reopened.labels), len(EXEMPLARS) + 1)
+        reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from unittest.mock import patch
+
+from litellm.types.utils import Usage
+
+from dir_assistant.assistant.lite_llm_assistant import LiteLLMAssistant
+
+
+def create_assistant(model, prompt_caching=True):
+    return LiteLLMAssistant(
+        lite_llm_completion_options={"model": model},
+        lite_llm_context_size=10_000,
+        lite_llm_pass_through_context_size=False,
+        cgrag_lite_llm_completion_options={"model": model},
+        cgrag_lite_llm_context_size=10_000,
+        cgrag_lite_llm_pass_through_context_size=False,
+        lite_llm_prompt_caching=prompt_caching,
+        system_instructions="Test instructions",
+        embed=None,
+        index=None,
+        chunks=[],
+        context_file_ratio=0.5,
+        artifact_excludable_factor=0.5,
+        artifact_cosine_cutoff=1.5,
+        artifact_cosine_cgrag_cutoff=1.5,
+        api_context_cache_ttl=3600,
+        rag_optimizer_weights={},
+        output_acceptance_retries=1,
+        use_cgrag=False,
+        print_cgrag=False,
+        commit_to_git=False,
+        verbose=False,
+        no_color=True,
+        chat_mode=False,
+        hide_thinking=False,
+        thinking_start_pattern="",
+        thinking_end_pattern="",
+    )
+
+
+class TestLiteLLMPromptCaching(unittest.TestCase):
+    def setUp(self):
+        self.chat_history = [
+            {"role": "system", "content": "System", "tokens": 1},
+            {
+                "role": "user",
+                "content": "prefix|rest of context|prompt",
+                "tokens": 5,
+                "cache_breakpoints": [7, 23],
+            },
+        ]
+
+    @patch("dir_assistant.assistant.lite_llm_assistant.completion")
+    def test_breakpoints_for_anthropic_models(self, mock_completion):
+        assistant = create_assistant("anthropic/claude-3-7-sonnet-latest")
+        assistant.call_completion(self.chat_history)
+        kwargs = mock_completion.call_args.kwargs
+        system, user = kwargs["messages"]
+        self.assertEqual(system["content"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(
+            [part["text"] for part in user["content"]],
+            ["prefix|", "rest of context|", "prompt"],
+        )
+        self.assertNotIn("cache_control", user["content"][2])
+        self.assertNotIn("cache_breakpoints", user)
+        self.assertEqual(kwargs["stream_options"], {"include_usage": True})
+        # The history itself is left untouched
+        self.assertIn("cache_breakpoints", self.chat_history[1])
+        assistant.close()
+
+    @patch("dir_assistant.assistant.lite_llm_assistant.completion")
+    def test_plain_messages_when_disabled(self, mock_completion):
+        assistant = create_assistant("anthropic/claude-3-7-sonnet-latest", False)
+        assistant.call_completion(self.chat_history)
+        kwargs = mock_completion.call_args.kwargs
+        self.assertEqual(
+            kwargs["messages"][1]["content"], self.chat_history[1]["content"]
+        )
+        self.assertNotIn("stream_options", kwargs)
+        assistant.close()
+
+    def test_cached_tokens_from_streamed_usage(self):
+        assistant = create_assistant("anthropic/claude-3-7-sonnet-latest")
+        stream = [
+            {"choices": [{"delta": {"content": "Hi"}}]},
+            {
+                "choices": [],
+                "usage": Usage(
+                    prompt_tokens=100,
+                    completion_tokens=1,
+                    total_tokens=101,
+                    cache_read_input_tokens=80,
+                ),
+            },
+        ]
+        output = assistant.run_completion_generator(
+            stream, assistant.create_empty_history(), False
+        )
+        self.assertEqual(output["content"], "Hi")
+        self.assertEqual(assistant.get_cached_prompt_tokens(), 80)
+        assistant.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from dir_assistant.assistant.llama_draft import DraftStats, GenerationStats
+
+
+class FixedDraft:
+    def __init__(self, num_pred_tokens):
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        return np.arange(self.num_pred_tokens, dtype=np.intc)
+
+
+def content_chunk(content):
+    return {"choices": [{"delta": {"content": content}}]}
+
+
+class TestDraftStats(unittest.TestCase):
+    def test_acceptance_is_measured_from_input_growth(self):
+        stats = DraftStats(FixedDraft(4))
+        stats(np.zeros(10, dtype=np.intc))
+        # 3 drafted tokens accepted plus the sampled token
+        stats(np.zeros(14, dtype=np.intc))
+        # No drafted tokens accepted
+        stats(np.zeros(15, dtype=np.intc))
+        self.assertEqual(stats.proposed_tokens, 8)
+        self.assertEqual(stats.accepted_tokens, 3)
+        self.assertEqual(stats.acceptance_rate, 3 / 8)
+
+    def test_reset_starts_a_new_completion(self):
+        stats = DraftStats(FixedDraft(4))
+        stats(np.zeros(10, dtype=np.intc))
+        stats.reset()
+        stats(np.zeros(20, dtype=np.intc))
+        self.assertIsNone(stats.acceptance_rate)
+
+
+class TestGenerationStats(unittest.TestCase):
+    @patch("dir_assistant.assistant.llama_draft.time.perf_counter")
+    def test_tokens_per_second_excludes_prompt_evaluation(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [5.0, 5.5, 6.0]
+        stream = [
+            {"choices": [{"delta": {"role": "assistant"}}]},
+            content_chunk("a"),
+            content_chunk("b"),
+            content_chunk("c"),
+        ]
+        stats = GenerationStats()
+        self.assertEqual(list(stats.measure(stream)), stream)
+        self.assertEqual(stats.tokens, 3)
+        self.assertEqual(stats.tokens_per_second, 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from dir_assistant.assistant.llama_state_cache import (
+    LlamaStateCache,
+    longest_token_prefix,
+)
+
+
+class FakeState:
+    def __init__(self, name, llama_state_size=10):
+        self.name = name
+        self.llama_state_size = llama_state_size
+
+
+class TestLlamaStateCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.disk_path = os.path.join(self.temp_dir.name, "states")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_longest_token_prefix(self):
+        self.assertEqual(longest_token_prefix((1, 2, 3), (1, 2, 4, 5)), 2)
+        self.assertEqual(longest_token_prefix((1, 2), (1, 2, 3)), 2)
+        self.assertEqual(longest_token_prefix((), (1,)), 0)
+
+    def test_lookup_returns_state_with_longest_shared_prefix(self):
+        cache = LlamaStateCache(100)
+        cache[(1, 2, 3, 9)] = FakeState("short")
+        cache[(1, 2, 3, 4, 5, 9)] = FakeState("long")
+        self.assertEqual(cache[(1, 2, 3, 4, 5, 6)].name, "long")
+        self.assertEqual(cache.last_prompt_tokens, (1, 2, 3, 4, 5, 6))
+        self.assertEqual(cache.last_cached_prefix, 5)
+        with self.assertRaises(KeyError):
+            cache[(7, 8)]
+        self.assertNotIn((7, 8), cache)
+
+    def test_least_recently_used_state_is_evicted(self):
+        cache = LlamaStateCache(20)
+        cache[(1, 1)] = FakeState("a")
+        cache[(2, 2)] = FakeState("b")
+        cache[(1, 1, 5)]  # Uses the first state
+        cache[(3, 3)] = FakeState("c")
+        self.assertEqual([state.name for state in cache.states.values()], ["a", "c"])
+
+    def test_evicted_states_move_to_disk_and_persist(self):
+        cache = LlamaStateCache(10, self.disk_path, 1000)
+        cache[(1, 2)] = FakeState("a")
+        cache[(3, 4)] = FakeState("b")
+        self.assertIn((1, 2), cache.disk_entries)
+        cache[(3, 4)] = FakeState("b")
+        cache.flush()
+        reopened = LlamaStateCache(10, self.disk_path, 1000)
+        self.assertEqual(reopened[(1, 2, 3)].name, "a")
+        self.assertEqual(reopened.last_cached_prefix, 2)
+        # Loaded states leave the disk tier until they are evicted again
+        self.assertNotIn((1, 2), reopened.disk_entries)
+        self.assertIn((3, 4), reopened.disk_entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
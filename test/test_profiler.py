@@ -0,0 +1,83 @@
+import tempfile
+import threading
+import unittest
+from test.utils import create_fake_assistant
+from unittest.mock import patch
+
+from dir_assistant.assistant import profiler as profiler_module
+from dir_assistant.assistant.profiler import (
+    NULL_SPAN,
+    disable_profiling,
+    enable_profiling,
+    span,
+    trace_stream,
+)
+
+
+class TestProfiler(unittest.TestCase):
+    def tearDown(self):
+        disable_profiling()
+
+    def test_disabled_spans_record_nothing(self):
+        self.assertIs(span("scan"), NULL_SPAN)
+        stream = iter([1, 2])
+        self.assertIs(trace_stream(stream, "stream"), stream)
+        self.assertIsNone(profiler_module.get_profiler())
+
+    def test_chrome_trace(self):
+        profiler = enable_profiling()
+        with span("scan", files=3):
+            pass
+
+        def embed():
+            with span("embedding"):
+                pass
+
+        worker = threading.Thread(target=embed, name="worker")
+        worker.start()
+        worker.join()
+        self.assertEqual(list(trace_stream(iter(["a", "b"]), "stream")), ["a", "b"])
+        trace = profiler.to_chrome_trace()
+        events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        names = [event["name"] for event in events]
+        self.assertEqual(names, ["scan", "embedding", "stream first chunk", "stream"])
+        self.assertEqual(events[0]["args"], {"files": 3})
+        self.assertGreaterEqual(events[0]["dur"], 0)
+        thread_names = {
+            e["args"]["name"] for e in trace["traceEvents"] if e["ph"] == "M"
+        }
+        self.assertEqual(thread_names, {"MainThread", "worker"})
+        self.assertNotEqual(events[0]["tid"], events[1]["tid"])
+
+    def test_turn_summary(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        cache_patch = patch(
+            "dir_assistant.assistant.base_assistant.CACHE_PATH", temp_dir.name
+        )
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        assistant = create_fake_assistant()
+        self.addCleanup(assistant.close)
+        assistant.initialize_history()
+        profiler = enable_profiling()
+        with patch("sys.stderr") as stderr:
+            assistant.run_stream_processes("question", one_off=True)
+        summary = "".join(call.args[0] for call in stderr.write.call_args_list)
+        names = {span[0] for span in profiler.get_spans()}
+        for name in [
+            "turn",
+            "embed query",
+            "search_index",
+            "artifact metadata",
+            "optimize_rag_for_caching",
+            "retrieval",
+            "generation",
+            "time to first token",
+        ]:
+            self.assertIn(name, names)
+            self.assertIn(name, summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
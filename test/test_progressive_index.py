@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from dir_assistant.assistant.index import order_files_for_indexing, search_index
+from dir_assistant.assistant.progressive_index import ProgressiveIndexer
+
+
+class FakeEmbed:
+    def get_config(self):
+        return {"model": "fake"}
+
+    def count_tokens(self, text):
+        return len(text) // 4
+
+    def create_embedding(self, text):
+        return np.array([len(text), 1.0], dtype=np.float32)
+
+
+class TestProgressiveIndexer(unittest.TestCase):
+    def setUp(self):
+        self.original_directory = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.files_dir = os.path.join(self.temp_dir.name, "files")
+        os.makedirs(self.files_dir)
+        os.chdir(self.files_dir)
+        for name, mtime in (("old.txt", 1000), ("new.txt", 2000)):
+            with open(name, "w") as file:
+                file.write(f"Contents of {name}\n")
+            os.utime(name, (mtime, mtime))
+        cache_patch = patch(
+            "dir_assistant.assistant.progressive_index.CACHE_PATH", self.temp_dir.name
+        )
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+
+    def tearDown(self):
+        os.chdir(self.original_directory)
+        self.temp_dir.cleanup()
+
+    def test_files_are_published_after_the_cached_index(self):
+        indexer = ProgressiveIndexer(FakeEmbed(), [], 100)
+        index, chunks = indexer.load_cached_index()
+        self.assertIsNone(index)
+        self.assertEqual(chunks, [])
+        self.assertEqual(indexer.get_coverage(), (0, 2))
+        self.assertEqual(search_index(FakeEmbed(), index, "query", chunks), [])
+        # The most recently modified file is embedded first
+        self.assertEqual(
+            [os.path.basename(item["filepath"]) for item in indexer.ledger.files],
+            ["new.txt", "old.txt"],
+        )
+        published = []
+        indexer.start(lambda filepath, *_: published.append(filepath))
+        indexer.thread.join(timeout=10)
+        self.assertEqual(len(published), 2)
+        self.assertTrue(indexer.is_complete())
+        # The next session starts with every file in the cached index
+        indexer = ProgressiveIndexer(FakeEmbed(), [], 100)
+        index, chunks = indexer.load_cached_index()
+        self.assertEqual(index.ntotal, 2)
+        self.assertEqual(indexer.ledger.files, [])
+        self.assertTrue(indexer.is_complete())
+
+    def test_git_touched_files_are_indexed_first(self):
+        files = [
+            {"filepath": "/repo/a.py", "mtime": 3},
+            {"filepath": "/repo/b.py", "mtime": 1},
+            {"filepath": "/repo/c.py", "mtime": 2},
+        ]
+        ordered = order_files_for_indexing(files, {"/repo/b.py"})
+        self.assertEqual(
+            [item["filepath"] for item in ordered],
+            ["/repo/b.py", "/repo/a.py", "/repo/c.py"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
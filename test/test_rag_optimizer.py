@@ -0,0 +1,123 @@
+import random
+import time
+import unittest
+
+import numpy as np
+
+from dir_assistant.assistant.rag_optimizer import RagOptimizer
+from dir_assistant.assistant.rag_simulator import (
+    ProviderPrefixCache,
+    simulate_history,
+    tune_optimizer,
+)
+
+
+def reference_sort_key(weights, artifact_metadata, artifact_distances, current_time):
+    """The per-artifact scoring RagOptimizer used before it was vectorized."""
+
+    def sort_key(artifact_id):
+        stats = artifact_metadata.get(artifact_id)
+        score = 0
+        if stats:
+            positions = stats.get("positions", [])
+            average = sum(positions) / len(positions) if positions else 0
+            score = (
+                weights.get("frequency", 1.0) * stats.get("frequency", 0)
+                - weights.get("position", 1.0) * average
+                + weights.get("stability", 1.0)
+                * (current_time - stats.get("last_modified_timestamp", current_time))
+            )
+        return -score, artifact_distances[artifact_id]
+
+    return sort_key
+
+
+class TestRagOptimizer(unittest.TestCase):
+    def test_ranking_matches_reference_scoring(self):
+        rng = random.Random(7)
+        weights = {"frequency": 1.5, "position": 0.5, "stability": 0.0}
+        neighbors = [(f"artifact-{i}", rng.random()) for i in range(200)]
+        metadata = {
+            artifact: {
+                "frequency": rng.randint(0, 5),
+                "positions": [rng.randint(0, 30) for _ in range(rng.randint(0, 4))],
+                "last_modified_timestamp": 0,
+            }
+            for artifact, _ in neighbors
+            if rng.random() < 0.7
+        }
+        optimizer = RagOptimizer(weights, 0.1)
+        ranked, prefix = optimizer.optimize_rag_for_caching(neighbors, [], metadata, {})
+        sort_key = reference_sort_key(weights, metadata, dict(neighbors), time.time())
+        self.assertEqual(prefix, "")
+        self.assertEqual(ranked, sorted([a for a, _ in neighbors], key=sort_key))
+
+    def test_full_ties_keep_input_order(self):
+        neighbors = [("c", 0.5), ("a", 0.5), ("b", 0.5)]
+        optimizer = RagOptimizer({}, 0.1)
+        ranked, _ = optimizer.optimize_rag_for_caching(neighbors, [], {}, {})
+        self.assertEqual(ranked, ["c", "a", "b"])
+
+    def test_pluggable_scoring_function(self):
+        def prefer_long_ids(columns, weights, current_time):
+            return np.array([len(a) for a in ["x", "yyy", "zz"]], dtype=float)
+
+        optimizer = RagOptimizer({}, 0.1, scoring_function=prefer_long_ids)
+        ranked, _ = optimizer.optimize_rag_for_caching(
+            [("x", 0.1), ("yyy", 0.2), ("zz", 0.3)], [], {}, {}
+        )
+        self.assertEqual(ranked, ["yyy", "zz", "x"])
+
+    def test_prefix_remainder_uses_ranking(self):
+        sep = RagOptimizer.ARTIFACT_SEPARATOR
+        neighbors = [("a", 0.1), ("b", 0.2), ("c", 0.3), ("d", 0.4)]
+        metadata = {"d": {"frequency": 10, "positions": [0]}}
+        optimizer = RagOptimizer({"stability": 0.0}, 0.5)
+        ranked, prefix = optimizer.optimize_rag_for_caching(
+            neighbors, [], metadata, {sep.join(["b", "a"]): {}}
+        )
+        self.assertEqual(prefix, sep.join(["b", "a"]))
+        self.assertEqual(ranked, ["b", "a", "d", "c"])
+
+
+class TestRagSimulator(unittest.TestCase):
+    def test_provider_cache_reuses_longest_live_prefix(self):
+        cache = ProviderPrefixCache(ttl=10)
+        self.assertEqual(cache.request(["a", "b", "c"], 0), 0)
+        self.assertEqual(cache.request(["a", "b", "d"], 5), 2)
+        # "c" was last sent at t=0 and has expired, "a" and "b" were refreshed at t=5
+        self.assertEqual(cache.request(["a", "b", "c"], 12), 2)
+        self.assertEqual(cache.request(["x"], 100), 0)
+
+    def test_simulation_reports_hits_and_relevance(self):
+        history = [
+            {
+                "timestamp": float(t),
+                "artifacts": ["a", "b", "c"],
+                "candidates": [["a", 0.1], ["b", 0.2], ["c", 0.3]],
+            }
+            for t in range(4)
+        ]
+        result = simulate_history(history, {}, 0.0, 3600)
+        self.assertEqual(result["prompts"], 4)
+        self.assertEqual(result["hit_ratio"], 0.75)
+        self.assertEqual(result["relevance_loss"], 0.0)
+
+    def test_tuner_respects_relevance_bound(self):
+        history = [
+            {
+                "timestamp": float(t),
+                "artifacts": ["a", "b"],
+                "candidates": [["a", 0.1], [f"new-{t}", 0.2], ["b", 0.3]],
+            }
+            for t in range(6)
+        ]
+        weights, factor, result = tune_optimizer(history, {"stability": 2.0}, 3600, 0.0)
+        self.assertIsNotNone(result)
+        self.assertEqual(result["relevance_loss"], 0.0)
+        # Replays have no modification times, so the configured stability weight is kept
+        self.assertEqual(weights["stability"], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
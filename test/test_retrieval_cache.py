@@ -0,0 +1,152 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import faiss
+import numpy as np
+
+from dir_assistant.assistant.cgrag_assistant import CGRAGAssistant
+from dir_assistant.assistant.retrieval_cache import MATCH_EXACT, RetrievalCache
+from dir_assistant.assistant.storage import IndexStore
+
+
+class TestRetrievalCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.temp_dir.name, "index.db")
+        self.source_path = os.path.join(self.temp_dir.name, "source.py")
+        self.guide_path = os.path.join(self.temp_dir.name, "guide.md")
+        for path in (self.source_path, self.guide_path):
+            with open(path, "w") as f:
+                f.write("contents\n")
+        self.chunks = [
+            {"text": "first", "filepath": self.source_path, "chunk_index": 0},
+            {"text": "second", "filepath": self.source_path, "chunk_index": 1},
+        ]
+        self.embedding = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_cache(self, similarity=0.95):
+        return RetrievalCache(IndexStore(self.store_path), similarity)
+
+    def save_entry(self, cache):
+        neighbors = [(self.chunks[1], 0.9), (self.chunks[0], 0.5)]
+        cache.save(
+            "key",
+            "How does it work?",
+            self.embedding,
+            "- it",
+            neighbors,
+            {self.guide_path},
+        )
+
+    def test_repeated_prompts_reuse_the_guidance_and_neighbors(self):
+        cache = self.create_cache()
+        self.save_entry(cache)
+        cache.close()
+        reopened = self.create_cache()
+        guidance, neighbors, match = reopened.lookup(
+            "key", "how  does it work?", self.embedding, self.chunks
+        )
+        self.assertEqual(match, MATCH_EXACT)
+        self.assertEqual(guidance, "- it")
+        self.assertEqual(neighbors, [(self.chunks[1], 0.9), (self.chunks[0], 0.5)])
+        # Other settings have their own entries
+        self.assertIsNone(
+            reopened.lookup("other", "How does it work?", self.embedding, self.chunks)
+        )
+        reopened.close()
+
+    def test_similar_prompts_reuse_the_closest_entry(self):
+        cache = self.create_cache()
+        self.save_entry(cache)
+        similar = np.array([1.0, 0.1, 0.0], dtype=np.float32)
+        different = np.array([0.5, 1.0, 0.0], dtype=np.float32)
+        _, _, match = cache.lookup("key", "How is it done?", similar, self.chunks)
+        self.assertGreater(match, 0.95)
+        self.assertIsNone(cache.lookup("key", "What is it?", different, self.chunks))
+        exact_only = RetrievalCache(cache.store, similarity=1.1)
+        self.assertIsNone(
+            exact_only.lookup("key", "How is it done?", similar, self.chunks)
+        )
+        cache.close()
+
+    def test_changed_files_invalidate_entries(self):
+        cache = self.create_cache()
+        self.save_entry(cache)
+        # The guidance depended on the guide file as well as the retrieved source file
+        stat = os.stat(self.guide_path)
+        os.utime(self.guide_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(
+            cache.lookup("key", "How does it work?", self.embedding, self.chunks)
+        )
+        self.assertEqual(cache.store.load_retrieval_entries("key"), {})
+        cache.close()
+
+    def test_sessions_share_the_cache_across_threads(self):
+        cache = RetrievalCache(IndexStore(self.store_path), 0.95, max_entries=4)
+        neighbors = [(self.chunks[0], 0.5)]
+        errors = []
+
+        def run_session(session):
+            try:
+                for turn in range(50):
+                    prompt = f"Question {session} {turn}"
+                    embedding = np.random.rand(3).astype(np.float32)
+                    cache.save("key", prompt, embedding, None, neighbors)
+                    cache.lookup("key", prompt, embedding, self.chunks)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run_session, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache.get_entries("key")), 4)
+        cache.close()
+
+    def test_cache_key_depends_on_the_chat_history(self):
+        class FakeEmbed:
+            def get_config(self):
+                return {"model": "fake"}
+
+        class FakeCGRAGAssistant(CGRAGAssistant):
+            def count_tokens(self, text, role="user"):
+                return len(text) // 4
+
+        def create_assistant():
+            index = faiss.IndexFlatIP(3)
+            index.add(np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float32))
+            assistant = FakeCGRAGAssistant(
+                "System", FakeEmbed(), index, self.chunks, 0.5, 0.1, 0.0, 0.0, 3600,
+                {}, 1, True, False, False, True, False, False, "<think>", "</think>",
+            )  # fmt: skip
+            assistant.initialize_history()
+            return assistant
+
+        with patch(
+            "dir_assistant.assistant.base_assistant.CACHE_PATH", self.temp_dir.name
+        ):
+            first, second = create_assistant(), create_assistant()
+        # New sessions share entries, but a conversation only reuses its own
+        self.assertEqual(
+            first.get_retrieval_cache_key(), second.get_retrieval_cache_key()
+        )
+        second.chat_history.append(
+            {"role": "user", "content": "Unrelated", "tokens": 1}
+        )
+        self.assertNotEqual(
+            first.get_retrieval_cache_key(), second.get_retrieval_cache_key()
+        )
+        first.close()
+        second.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
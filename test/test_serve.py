@@ -0,0 +1,117 @@
+import json
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from argparse import Namespace
+from copy import deepcopy
+from test.utils import create_fake_assistant, patch_startup
+from unittest.mock import MagicMock, patch
+
+from dir_assistant.cli.config import CONFIG_DEFAULTS
+from dir_assistant.cli.serve import AssistantServer, serve
+
+
+class TestAssistantServer(unittest.TestCase):
+    def setUp(self):
+        # Answered prompts are recorded in the prompt history of the cache
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        cache_patch = patch(
+            "dir_assistant.assistant.base_assistant.CACHE_PATH", self.temp_dir.name
+        )
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        self.assistant = create_fake_assistant()
+        self.server = AssistantServer(("127.0.0.1", 0), self.assistant)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assistant.close()
+
+    def post(self, path, body, headers={}):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", **headers},
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.read().decode("utf-8")
+
+    def chat(self, content, session_id, stream=False):
+        return self.post(
+            "/chat/completions",
+            {"messages": [{"role": "user", "content": content}], "stream": stream},
+            {"X-Session-ID": session_id},
+        )
+
+    def test_sessions_keep_their_own_history(self):
+        response = json.loads(self.chat("first question", "a"))
+        self.assertEqual(
+            response["choices"][0]["message"]["content"], "The answer is here."
+        )
+        self.assertEqual(response["usage"]["total_tokens"], 42)
+        self.assertEqual(response["sources"][0]["filepath"], "/repo/a.py")
+        self.chat("second question", "a")
+        self.chat("other question", "b")
+        session_a = self.server.sessions.get("a")[0]
+        session_b = self.server.sessions.get("b")[0]
+        self.assertEqual(len(session_a.chat_history), 5)
+        self.assertEqual(len(session_b.chat_history), 3)
+        # Index updates reach every session
+        self.assistant.replace_file_chunks(
+            "/repo/b.py",
+            [{"text": "b.py line 1\n", "filepath": "/repo/b.py", "chunk_index": 0}],
+            [[0.0, 1.0]],
+        )
+        self.assertEqual(len(session_a.chunks), 2)
+        self.assertIs(session_b.index, self.assistant.index)
+
+    def test_streamed_answers_are_server_sent_events(self):
+        lines = self.chat("question", "a", stream=True).split("\n\n")
+        self.assertEqual(lines[-2], "data: [DONE]")
+        chunks = [json.loads(line[len("data: ") :]) for line in lines[:-2]]
+        text = "".join(
+            chunk["choices"][0]["delta"].get("content", "") for chunk in chunks
+        )
+        self.assertEqual(text, "The answer is here.")
+        self.assertEqual(chunks[-1]["choices"][0]["finish_reason"], "stop")
+
+    def test_retrieve(self):
+        response = json.loads(self.post("/retrieve", {"query": "line 1"}))
+        self.assertEqual(len(response["results"]), 1)
+        self.assertEqual(response["results"][0]["text"], "a.py line 1\n")
+        self.assertAlmostEqual(response["results"][0]["score"], 1.0)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.post("/retrieve", {"query": ""})
+        self.assertEqual(context.exception.code, 400)
+
+
+class TestServe(unittest.TestCase):
+    def test_watcher_ignores_global_ignores_once(self):
+        start_file_watcher = MagicMock()
+        args = Namespace(
+            ignore=["build"],
+            dirs=None,
+            verbose=False,
+            no_color=False,
+            host="127.0.0.1",
+            port=0,
+        )
+        with patch_startup(create_fake_assistant(), start_file_watcher), patch.object(
+            AssistantServer, "serve_forever", side_effect=KeyboardInterrupt
+        ), patch("sys.stdout"):
+            serve(args, {"DIR_ASSISTANT": deepcopy(CONFIG_DEFAULTS)})
+        self.assertEqual(args.ignore, ["build"])
+        watcher_ignores = start_file_watcher.call_args.args[2]
+        self.assertEqual(watcher_ignores, ["build"] + CONFIG_DEFAULTS["GLOBAL_IGNORES"])
+        start_file_watcher.return_value.stop.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import threading
+import unittest
+
+import faiss
+import numpy as np
+
+from dir_assistant.assistant.cgrag_assistant import CGRAGAssistant
+from dir_assistant.assistant.stage_timeline import StageTimeline
+from dir_assistant.cli.start import run_startup
+
+
+class FakeEmbed:
+    def create_embedding(self, text):
+        return np.array([1.0, 0.0], dtype=np.float32)
+
+
+class FakeCGRAGAssistant(CGRAGAssistant):
+    def count_tokens(self, text, role="user"):
+        return len(text) // 4
+
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        if is_cgrag_call:
+            self.guidance_started.set()
+            return iter([{"choices": [{"delta": {"content": "Guidance"}}]}])
+        return iter([{"choices": [{"delta": {"content": "Answer"}}]}])
+
+    def create_prompt(self, user_input):
+        # Only finishes early if the guidance completion runs at the same time
+        self.overlapped = self.guidance_started.wait(timeout=5)
+        return super().create_prompt(user_input)
+
+
+class TestStageTimeline(unittest.TestCase):
+    def test_critical_path_follows_the_latest_dependency(self):
+        timeline = StageTimeline(start_time=0.0)
+        timeline.record("embedding", 0.0, 0.1)
+        timeline.record("prompt", 0.1, 0.3, ["embedding"])
+        timeline.record("guidance", 0.1, 0.9, ["embedding"])
+        timeline.record("answer", 0.9, 1.5, ["prompt", "guidance"])
+        self.assertEqual(timeline.critical_path(), ["embedding", "guidance", "answer"])
+        lines = timeline.format().split("\n")
+        self.assertTrue(lines[2].startswith("   prompt "))
+        self.assertTrue(lines[3].startswith(" * guidance "))
+
+    def test_prompt_is_created_while_the_cgrag_guidance_runs(self):
+        chunks = [{"text": "a.py line 1\n", "filepath": "/repo/a.py"}]
+        index = faiss.IndexFlatIP(2)
+        index.add(np.array([[1.0, 0.0]], dtype=np.float32))
+        assistant = FakeCGRAGAssistant(
+            "System", FakeEmbed(), index, chunks, 0.5, 0.1, 0.0, 0.0, 3600, {}, 1,
+            True, False, False, True, False, False, "<think>", "</think>",
+            use_retrieval_cache=False,
+        )  # fmt: skip
+        assistant.guidance_started = threading.Event()
+        assistant.initialize_history()
+        try:
+            self.assertEqual(
+                assistant.run_stream_processes("question", one_off=True), "Answer"
+            )
+        finally:
+            assistant.close()
+        self.assertTrue(assistant.overlapped)
+        self.assertEqual(assistant.last_timeline.critical_path()[-1], "answer")
+        self.assertEqual(
+            set(assistant.last_timeline.stages),
+            {
+                "query embedding",
+                "prompt",
+                "cgrag retrieval",
+                "cgrag guidance",
+                "retrieval",
+                "answer",
+            },
+        )
+
+    def test_startup_loads_the_model_while_the_index_is_built(self):
+        model_loading = threading.Event()
+        assistant = FakeCGRAGAssistant.__new__(FakeCGRAGAssistant)
+
+        def create_index():
+            # Only finishes early if the model loads at the same time
+            self.assertTrue(model_loading.wait(timeout=5))
+            return "index", ["chunk"]
+
+        def create_assistant():
+            model_loading.set()
+            return assistant
+
+        llm, timeline = run_startup(create_index, create_assistant)
+        self.assertIs(llm, assistant)
+        self.assertEqual((llm.index, llm.chunks), ("index", ["chunk"]))
+        self.assertEqual(set(timeline.stages), {"index", "model"})
+
+
+if __name__ == "__main__":
+    unittest.main()
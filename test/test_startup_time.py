@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# The modules each subcommand imports before it runs, the most seconds their imports may
+# take on a developer machine, and the heavy libraries they must not import.
+STARTUP_BUDGETS = {
+    "dir_assistant.main": (0.5, ("litellm", "prompt_toolkit", "faiss", "dynaconf")),
+    "dir_assistant.cli.config": (0.5, ("litellm", "prompt_toolkit", "faiss")),
+    "dir_assistant.cli.setkey": (0.5, ("litellm", "prompt_toolkit", "faiss")),
+    "dir_assistant.cli.models": (0.5, ("litellm", "prompt_toolkit", "faiss")),
+    "dir_assistant.cli.start": (1.5, ("litellm", "llama_cpp", "watchdog")),
+}
+
+# Import times depend on the machine, so the budgets are only checked when this is set.
+# The budgets are multiplied by it, for example 1 on a developer machine or 3 on slow CI.
+STARTUP_BUDGET_SCALE = os.environ.get("DIR_ASSISTANT_STARTUP_BUDGET_SCALE")
+
+
+def measure_import(module):
+    """
+    Imports a module in a new interpreter.
+
+    Returns:
+        tuple: The cumulative import time of the module in seconds and the names of the
+            top level packages that were imported.
+    """
+    code = (
+        f"import sys, {module}; "
+        "print(' '.join({name.split('.')[0] for name in sys.modules}))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    seconds = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            seconds = int(parts[1]) / 1_000_000
+    return seconds, set(result.stdout.split())
+
+
+class TestStartupTime(unittest.TestCase):
+    def test_subcommands_do_not_import_heavy_packages(self):
+        for module, (_, excluded_packages) in STARTUP_BUDGETS.items():
+            with self.subTest(module=module):
+                _, packages = measure_import(module)
+                self.assertFalse(packages & set(excluded_packages))
+
+    @unittest.skipUnless(
+        STARTUP_BUDGET_SCALE, "set DIR_ASSISTANT_STARTUP_BUDGET_SCALE to check"
+    )
+    def test_subcommand_imports_stay_within_budget(self):
+        for module, (budget, _) in STARTUP_BUDGETS.items():
+            with self.subTest(module=module):
+                seconds, _ = measure_import(module)
+                self.assertIsNotNone(seconds)
+                self.assertLess(seconds, budget * float(STARTUP_BUDGET_SCALE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+from dir_assistant.assistant.storage import (
+    IndexStore,
+    PrefixCacheStore,
+    PromptHistoryStore,
+)
+from dir_assistant.assistant.token_cache import TokenCountCache
+from dir_assistant.cli.migrate import migrate_index_cache, migrate_prompt_history
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, filename):
+        return os.path.join(self.directory.name, filename)
+
+    def write_legacy(self, filename, entries):
+        connection = sqlite3.connect(self.path(filename))
+        connection.execute('CREATE TABLE "unnamed" (key TEXT PRIMARY KEY, value BLOB)')
+        connection.executemany(
+            'INSERT INTO "unnamed" (key, value) VALUES (?, ?)',
+            [(key, sqlite3.Binary(pickle.dumps(value))) for key, value in entries],
+        )
+        connection.commit()
+        connection.close()
+
+    def test_index_store_round_trip(self):
+        store = IndexStore(self.path("index.db"))
+        chunks = [
+            {"text": "a", "filepath": "/f", "tokens": 1},
+            {"text": "b", "filepath": "/f", "tokens": 2},
+        ]
+        store.save_file_chunks("cfg", "/f", 1.5, chunks, [[1.0, 2.0], [3.0, 4.0]])
+        store.save_file_chunks("cfg", "/empty", 2.5, [], [])
+        # Reads observe queued writes without an explicit flush
+        loaded = store.load_chunks("cfg")
+        store.close()
+        self.assertEqual(loaded["/f"]["mtime"], 1.5)
+        self.assertEqual([c["text"] for c in loaded["/f"]["chunks"]], ["a", "b"])
+        self.assertEqual(loaded["/f"]["embeddings"][1].tolist(), [3.0, 4.0])
+        self.assertEqual(loaded["/empty"]["chunks"], [])
+        self.assertEqual(IndexStore(self.path("index.db")).load_chunks("other"), {})
+
+    def test_replacing_file_chunks_drops_old_chunks(self):
+        store = IndexStore(self.path("index.db"))
+        store.save_file_chunks(
+            "cfg", "/f", 1.0, [{"text": "a"}, {"text": "b"}], [[0.0], [1.0]]
+        )
+        store.save_file_chunks("cfg", "/f", 2.0, [{"text": "c"}], [[2.0]])
+        loaded = store.load_chunks("cfg")
+        store.close()
+        self.assertEqual([c["text"] for c in loaded["/f"]["chunks"]], ["c"])
+
+    def test_prefix_expiry(self):
+        store = PrefixCacheStore(self.path("prefix.db"))
+        store.set_prefix_hit("old", 10.0)
+        store.set_prefix_hit("new", 100.0)
+        store.delete_prefixes_before(50.0)
+        self.assertEqual(
+            store.get_prefixes_since(0.0),
+            {"new": {"last_hit_timestamp": 100.0, "hits": 0, "misses": 0}},
+        )
+        store.record_prefix_result("new", 110.0, hit=True)
+        store.record_prefix_result("new", 120.0, hit=False)
+        self.assertEqual(
+            store.get_prefixes_since(0.0),
+            {"new": {"last_hit_timestamp": 120.0, "hits": 1, "misses": 1}},
+        )
+        store.close()
+
+    def test_prompt_history_candidates(self):
+        store = PromptHistoryStore(self.path("history.db"))
+        store.add_prompt(1.0, "old", ["a"])
+        store.add_prompt(2.0, "new", ["a"], [["a", 0.5], ["b", 0.7]])
+        prompts = store.get_prompts()
+        store.close()
+        self.assertIsNone(prompts[0]["candidates"])
+        self.assertEqual(prompts[1]["candidates"], [["a", 0.5], ["b", 0.7]])
+
+    def test_failed_write_does_not_roll_back_other_writes(self):
+        store = PrefixCacheStore(self.path("prefix.db"))
+        operations = [
+            ([(store.UPSERT_PREFIX, ("kept", 10.0), False)], Future()),
+            ([("INSERT INTO missing_table VALUES (?)", (1,), False)], Future()),
+            ([(store.UPSERT_PREFIX, ("also kept", 20.0), False)], Future()),
+        ]
+        # The three operations share one transaction
+        store._commit_operations(operations)
+        self.assertIsNone(operations[0][1].exception())
+        self.assertIsInstance(operations[1][1].exception(), sqlite3.OperationalError)
+        self.assertIsNone(operations[2][1].exception())
+        self.assertEqual(set(store.get_prefixes_since(0.0)), {"kept", "also kept"})
+        store.close()
+
+    def test_writer_survives_a_locked_database(self):
+        store = PrefixCacheStore(self.path("prefix.db"))
+        store._writer_connection.execute("PRAGMA busy_timeout = 0")
+        other = sqlite3.connect(self.path("prefix.db"), isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        future = store.write((store.UPSERT_PREFIX, ("locked", 10.0)))
+        with self.assertRaises(sqlite3.OperationalError):
+            future.result(timeout=10)
+        other.execute("ROLLBACK")
+        other.close()
+        store.set_prefix_hit("unlocked", 20.0)
+        self.assertEqual(set(store.get_prefixes_since(0.0)), {"unlocked"})
+        store.close()
+
+    def test_token_counts_persist_per_tokenizer(self):
+        calls = []
+
+        def count_tokens(text):
+            calls.append(text)
+            return len(text)
+
+        cache = TokenCountCache(count_tokens, "model-a", IndexStore(self.path("i.db")))
+        self.assertEqual(cache.count("abc"), 3)
+        self.assertEqual(cache.count("abc"), 3)
+        cache.close()
+        cache = TokenCountCache(count_tokens, "model-a", IndexStore(self.path("i.db")))
+        self.assertEqual(cache.count("abc"), 3)
+        cache.close()
+        self.assertEqual(calls, ["abc"])
+        cache = TokenCountCache(count_tokens, "model-b", IndexStore(self.path("i.db")))
+        cache.count("abc")
+        cache.close()
+        self.assertEqual(calls, ["abc", "abc"])
+
+    def test_token_counts_in_memory_are_bounded(self):
+        calls = []
+
+        def count_tokens(text):
+            calls.append(text)
+            return len(text)
+
+        cache = TokenCountCache(count_tokens, max_counts=2)
+        for text in ("a", "bb", "a", "ccc", "bb"):
+            cache.count(text)
+        # "bb" was the least recently used count when "ccc" was added
+        self.assertEqual(calls, ["a", "bb", "ccc", "bb"])
+        # Counts are kept by text hash, not by the text
+        self.assertEqual(
+            set(cache.counts),
+            {
+                hashlib.sha256(text.encode("utf-8")).hexdigest()
+                for text in ("ccc", "bb")
+            },
+        )
+
+    def test_migrate_legacy_caches(self):
+        embed_config = "f" * 64
+        self.write_legacy(
+            "index_cache.sqlite",
+            [
+                (
+                    f"{embed_config}-./f.py",
+                    {"filepath": "/p/f.py", "contents": "x", "mtime": 3.0},
+                ),
+                (
+                    f"{embed_config}-/p/f.py_chunks",
+                    {
+                        "chunks": [{"text": "x", "filepath": "/p/f.py", "tokens": 1}],
+                        "embeddings": [[0.5]],
+                        "mtime": 3.0,
+                    },
+                ),
+            ],
+        )
+        self.write_legacy(
+            "prompt_history.sqlite",
+            [
+                ("2.0", {"prompt": "second", "artifacts": ["b"]}),
+                ("1.0", {"prompt": "first", "artifacts": ["a"]}),
+            ],
+        )
+        index_store = IndexStore(self.path("index.db"))
+        history_store = PromptHistoryStore(self.path("history.db"))
+        self.assertEqual(
+            migrate_index_cache(self.path("index_cache.sqlite"), index_store), 1
+        )
+        self.assertEqual(
+            migrate_prompt_history(self.path("prompt_history.sqlite"), history_store), 2
+        )
+        loaded = index_store.load_chunks(embed_config)
+        self.assertEqual(loaded["/p/f.py"]["chunks"][0]["text"], "x")
+        self.assertEqual(
+            [p["prompt"] for p in history_store.get_prompts()], ["first", "second"]
+        )
+        index_store.close()
+        history_store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import unittest
+from unittest.mock import patch
+
+from dir_assistant.assistant.stream_renderer import (
+    TerminalWriter,
+    ThinkingFilter,
+    remove_thinking,
+)
+
+
+def run_filter(thinking_filter, deltas):
+    return [thinking_filter.feed(delta) for delta in deltas] + [
+        thinking_filter.finish()
+    ]
+
+
+class TestThinkingFilter(unittest.TestCase):
+    def test_patterns_split_across_deltas_are_found(self):
+        deltas = [
+            "<th",
+            "ink>",
+            "Let me reason " * 5,
+            "about it.</",
+            "think",
+            ">Answer",
+            " here",
+        ]
+        shown = run_filter(ThinkingFilter("<think>", "</think>"), deltas)
+        self.assertEqual("".join(shown), "Answer here")
+        # Nothing is shown before the thinking ends, and the answer streams right after
+        self.assertEqual(shown[:5], ["", "", "", "", ""])
+        self.assertEqual(shown[5], "Answer")
+
+    def test_responses_without_thinking_are_shown_after_the_start_window(self):
+        deltas = ["This response ", "does not think ", "at all."]
+        shown = run_filter(ThinkingFilter("<think>", "</think>"), deltas)
+        self.assertEqual(shown[:2], ["", "This response does not think "])
+        self.assertEqual("".join(shown), "".join(deltas))
+
+    def test_short_responses_are_shown_when_the_stream_ends(self):
+        shown = run_filter(
+            ThinkingFilter("<think>", "</think>"), ["<think>a</think>Hi"]
+        )
+        self.assertEqual(shown, ["", "Hi"])
+        disabled = ThinkingFilter("<think>", "</think>", enabled=False)
+        self.assertEqual(run_filter(disabled, ["<think>a"]), ["<think>a", ""])
+
+    def test_remove_thinking_removes_every_block(self):
+        content = "<think>a</think>One <think>b</think>two<think>unclosed"
+        self.assertEqual(remove_thinking(content, "<think>", "</think>"), "One two")
+        self.assertEqual(remove_thinking(content, "", ""), content)
+
+
+class TestTerminalWriter(unittest.TestCase):
+    @patch("dir_assistant.assistant.stream_renderer.time.perf_counter")
+    def test_writes_are_batched_into_frames(self, mock_perf_counter):
+        mock_perf_counter.side_effect = [0.0, 0.01, 0.02, 0.05, 0.06, 0.07]
+        stream = io.StringIO()
+        writer = TerminalWriter(stream, "<c>", "</c>", max_fps=20)
+        for text in ["a", "b", "c", "d", "e"]:
+            writer.write(text)
+        self.assertEqual(stream.getvalue(), "<c>a</c><c>bcd</c>")
+        writer.flush()
+        self.assertEqual(stream.getvalue(), "<c>a</c><c>bcd</c><c>e</c>")
+
+
+if __name__ == "__main__":
+    unittest.main()
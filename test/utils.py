@@ -1,6 +1,14 @@
 import os
 import sys
 import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import faiss
+import numpy as np
+
+from dir_assistant.assistant.base_assistant import BaseAssistant
 
 # Simulate pressing Alt-Enter by sending the appropriate escape sequence
 # Alt-Enter is often represented by sending an escape character followed by Enter
@@ -45,3 +53,86 @@ def send_input(master_fd, input_str):
         input_str (str): The string to send as input.
     """
     os.write(master_fd, input_str.encode())
+
+
+class FakeEmbed:
+    def create_embedding(self, text):
+        return np.array([1.0, 0.0], dtype=np.float32)
+
+
+class FakeAssistant(BaseAssistant):
+    def count_tokens(self, text, role="user"):
+        return len(text) // 4
+
+    def call_completion(self, chat_history, is_cgrag_call=False):
+        return iter(
+            [
+                {"choices": [{"delta": {"content": "The answer"}}]},
+                {"choices": [{"delta": {"content": " is here."}}]},
+                {
+                    "choices": [],
+                    "usage": {
+                        "prompt_tokens": 40,
+                        "completion_tokens": 2,
+                        "total_tokens": 42,
+                    },
+                },
+            ]
+        )
+
+
+def create_fake_assistant(
+    filepaths=("/repo/a.py",),
+    embed=None,
+    artifact_cosine_cutoff=0.0,
+    assistant_class=FakeAssistant,
+):
+    """
+    Creates an assistant with a fake LLM over an index of one chunk per file. The chunk of
+    the first file matches every query of FakeEmbed, and the chunk of the second does not.
+    Args:
+        filepaths (tuple): The files in the index, at most two.
+        embed: The embedding model. Defaults to FakeEmbed.
+        artifact_cosine_cutoff (float): The smallest similarity of retrieved chunks.
+        assistant_class (type): A subclass of FakeAssistant.
+    Returns:
+        FakeAssistant: The assistant, which answers "The answer is here." to any prompt.
+    """
+    chunks = [
+        {
+            "text": f"{os.path.basename(filepath)} line 1\n",
+            "filepath": filepath,
+            "chunk_index": 0,
+        }
+        for filepath in filepaths
+    ]
+    index = faiss.IndexFlatIP(2)
+    index.add(np.eye(len(chunks), 2, dtype=np.float32))
+    return assistant_class(
+        "System", embed or FakeEmbed(), index, chunks, 0.5, 0.1,
+        artifact_cosine_cutoff, 0.0, 3600, {}, 1, False, True, False, False,
+        "<think>", "</think>",
+    )  # fmt: skip
+
+
+@contextmanager
+def patch_startup(assistant, start_file_watcher):
+    """
+    Makes initialize_llm return an assistant without loading models or indexing files,
+    and replaces the file watcher, for tests of the subcommands that start one.
+    Args:
+        assistant (FakeAssistant): The assistant initialize_llm returns.
+        start_file_watcher (callable): Called instead of starting a file watcher.
+    """
+    modules = {
+        "dir_assistant.assistant.lite_llm_embed": SimpleNamespace(
+            LiteLlmEmbed=lambda **options: FakeEmbed()
+        ),
+        "dir_assistant.assistant.file_watcher": SimpleNamespace(
+            start_file_watcher=start_file_watcher
+        ),
+    }
+    with patch.dict(sys.modules, modules), patch(
+        "dir_assistant.cli.start.run_startup", return_value=(assistant, None)
+    ):
+        yield